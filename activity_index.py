@@ -0,0 +1,182 @@
+"""
+Activity index of the stored high-res stills, to find the moments something changed without opening the JPEGs.
+
+For every still written, a small grayscale thumbnail is decoded at reduced JPEG scale, and two features are derived
+from it: the mean brightness and a difference score against the previous still of the same sender. The difference is
+the mean absolute difference of the two thumbnails after removing their mean brightness, so the sender's exposure
+steps and the light slowly changing through the day don't look like activity.
+
+Records are appended to one file per sender and day:
+
+    <root>/<sender_id>/<YYYY-MM-DD>.v2.idx   records of [timestamp, double][brightness, float][difference, float]
+                                             [still, 40 bytes][thumbnail, height x width uint8]
+
+all big endian and fixed size, so a day loads with a single read into a NumPy structured array and queries are
+vectorized over it. The thumbnail is kept so the first still after a restart is still compared with its
+predecessor. The still is the name the receiver stored it under, relative to the sender's folder and NUL padded,
+so two stills taken in the same second can be told apart. Index files of the first format (.idx, without it) are
+not read.
+"""
+
+import datetime
+import math
+import os
+import threading
+
+import cv2
+import numpy as np
+
+
+INDEX_SUFFIX = '.v2.idx'
+STILL_NAME_SIZE = 40
+
+
+def record_dtype(thumbnail_size):
+    width, height = thumbnail_size
+    return np.dtype([('ts', '>f8'), ('brightness', '>f4'), ('difference', '>f4'), ('still', f'S{STILL_NAME_SIZE}'),
+                     ('thumbnail', 'u1', (height, width))])
+
+
+def thumbnail(jpeg, thumbnail_size):
+    """Grayscale thumbnail of a JPEG, decoded at 1/8 scale first so the full image is never decompressed."""
+    image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if image is None:
+        return None
+    return cv2.resize(image, thumbnail_size, interpolation=cv2.INTER_AREA)
+
+
+def difference_score(current, previous):
+    """Mean absolute difference of two thumbnails with their mean brightness removed, 0 to 255."""
+    current = current.astype(np.float32)
+    previous = previous.astype(np.float32)
+    return float(np.abs((current - current.mean()) - (previous - previous.mean())).mean())
+
+
+class ActivityIndex:
+    """
+    thumbnailer(sender_id, jpeg, thumbnail_size) makes the thumbnails, thumbnail() in this process by default; the
+    receiver can hand that work to its frame worker processes.
+    """
+
+    def __init__(self, root, thumbnail_size=(32, 24), recent_per_sender=8, thumbnailer=None):
+        self.root = root
+        self.thumbnailer = thumbnailer or (lambda sender_id, jpeg, size: thumbnail(jpeg, size))
+        self.thumbnail_size = thumbnail_size
+        self.dtype = record_dtype(thumbnail_size)
+        self.recent_per_sender = recent_per_sender
+        self.recent = {}  # {sender_id: [(ts, thumbnail)], oldest first}, to compare new stills with
+        self.lock = threading.Lock()
+        self.indexed = 0
+        self.failed = 0
+
+    def _day_path(self, sender_id, day):
+        return os.path.join(self.root, sender_id, day.strftime("%Y-%m-%d") + INDEX_SUFFIX)
+
+    @staticmethod
+    def _day_name(ts, default):
+        """'YYYY-MM-DD' of a unix timestamp, or default if it is outside the range of dates."""
+        try:
+            return datetime.datetime.fromtimestamp(ts).date().isoformat()
+        except (OverflowError, OSError, ValueError):
+            return default
+
+    def _load(self, path):
+        try:
+            data = np.fromfile(path, dtype=np.uint8)
+        except FileNotFoundError:
+            return np.empty(0, dtype=self.dtype)
+        usable = len(data) - len(data) % self.dtype.itemsize  # Ignore a record torn by a crash
+        return data[:usable].view(self.dtype)
+
+    def _days(self, sender_id):
+        """The days the sender has an index file for, as 'YYYY-MM-DD' strings, oldest first."""
+        try:
+            names = os.listdir(os.path.join(self.root, sender_id))
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-len(INDEX_SUFFIX)] for name in names if name.endswith(INDEX_SUFFIX))
+
+    def _last_indexed(self, sender_id):
+        """(ts, thumbnail) of the newest record on disk for the sender, to pick up where a previous run stopped."""
+        for day in reversed(self._days(sender_id)):
+            records = self._load(os.path.join(self.root, sender_id, day + INDEX_SUFFIX))
+            if len(records):
+                return [(float(records['ts'][-1]), records['thumbnail'][-1].copy())]
+        return []
+
+    def _previous(self, sender_id, ts):
+        # Writers can finish out of order, so look for the newest still taken before this one
+        recent = self.recent.get(sender_id)
+        if recent is None:
+            recent = self.recent[sender_id] = self._last_indexed(sender_id)
+        earlier = [item for item in recent if item[0] < ts]
+        return earlier[-1][1] if earlier else None
+
+    def add(self, sender_id, ts, jpeg, name):
+        """
+        Computes the features of a still stored under name and appends its record. Safe to call from several
+        threads.
+        """
+        encoded_name = name.encode()
+        if len(encoded_name) > STILL_NAME_SIZE:
+            raise ValueError(f"Still name {name!r} longer than {STILL_NAME_SIZE} bytes")
+        small = self.thumbnailer(sender_id, jpeg, self.thumbnail_size)
+        if small is None:
+            with self.lock:
+                self.failed += 1
+            return
+
+        with self.lock:
+            previous = self._previous(sender_id, ts)
+            recent = self.recent[sender_id]
+            recent.append((ts, small))
+            recent.sort(key=lambda item: item[0])
+            del recent[:-self.recent_per_sender]
+
+            record = np.zeros(1, dtype=self.dtype)
+            record['ts'] = ts
+            record['brightness'] = small.mean()
+            record['difference'] = difference_score(small, previous) if previous is not None else math.nan
+            record['still'] = encoded_name
+            record['thumbnail'] = small
+
+            path = self._day_path(sender_id, datetime.datetime.fromtimestamp(ts))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'ab') as file:
+                file.write(record.tobytes())
+            self.indexed += 1
+
+    def query(self, sender_id, start, end):
+        """
+        The records of a sender with start <= ts < end, oldest first, without their thumbnails. Only the day files
+        that exist are read, however wide the range.
+        """
+        first_day = self._day_name(start, '0000-00-00')
+        last_day = self._day_name(end, '9999-99-99')
+        parts = []
+        for day in self._days(sender_id):
+            # 'YYYY-MM-DD' names sort like the dates they stand for
+            if first_day <= day <= last_day:
+                records = self._load(os.path.join(self.root, sender_id, day + INDEX_SUFFIX))
+                parts.append(records[['ts', 'brightness', 'difference', 'still']])
+        records = np.concatenate(parts) if parts else np.empty(0, dtype=self.dtype)
+        records = records[(records['ts'] >= start) & (records['ts'] < end)]
+        return records[np.argsort(records['ts'], kind='stable')]
+
+    def top_changed(self, sender_id, start, end, k=10):
+        """
+        The k records with the highest difference score in the range, most changed first, as dicts with ts,
+        brightness, difference and the still's name.
+        """
+        records = self.query(sender_id, start, end)
+        records = records[~np.isnan(records['difference'])]
+        if len(records) > k:
+            records = records[np.argpartition(-records['difference'], k)[:k]]
+        records = records[np.argsort(-records['difference'], kind='stable')]
+        return [{'ts': float(ts), 'brightness': float(brightness), 'difference': float(difference),
+                 'still': still.decode()}
+                for ts, brightness, difference, still in records]
+
+    def stats(self):
+        with self.lock:
+            return {'indexed': self.indexed, 'failed': self.failed}
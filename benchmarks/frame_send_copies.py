@@ -0,0 +1,101 @@
+"""
+Compares the per-frame memory traffic of the old and new live frame send paths of send_video_frames.
+
+Runs without a camera: a preallocated 640x480 YUV420 array stands in for the mapped camera buffer, and frames are
+sent over a local socket pair drained by a background thread. For each path it reports the memory allocated while
+sending one frame, as traced by tracemalloc (numpy and OpenCV arrays included), and the time per frame. Every
+allocation on this path is a frame-sized buffer being filled, so it tracks the bytes copied per frame.
+
+    python benchmarks/frame_send_copies.py [--frames 200]
+"""
+
+import argparse
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from protocol import id_header, send_id_and_payload  # noqa: E402
+from video_encoding import LoresJpegEncoder  # noqa: E402
+
+
+SENDER_ID = b'benchmark-cam'
+
+
+def make_camera_buffer(width=640, height=480):
+    # Smooth gradients plus noise, so the JPEG size is close to a real scene
+    y = np.add.outer(np.arange(height), np.arange(width)) % 256
+    noise = np.random.default_rng(0).integers(0, 8, (height * 3 // 2, width))
+    yuv = np.empty((height * 3 // 2, width), dtype=np.uint8)
+    yuv[:height] = y
+    yuv[height:] = 128
+    return (yuv + noise).astype(np.uint8)
+
+
+def old_path(camera_buffer, sock, _state):
+    yuv420 = camera_buffer.copy()  # capture_array copies out of the camera buffer
+    rgb = cv2.cvtColor(yuv420, cv2.COLOR_YUV2RGB_YV12)
+    _, buffer = cv2.imencode('.jpg', rgb)
+    frame = buffer.tobytes()
+    message = struct.pack("Q", len(SENDER_ID)) + SENDER_ID
+    message += struct.pack("Q", len(frame)) + frame
+    sock.sendall(message)
+
+
+def new_path(camera_buffer, sock, state):
+    frame = state['encoder'].encode(camera_buffer)  # MappedArray view, converted into a reused buffer
+    send_id_and_payload(sock, state['header'], frame)
+
+
+def drain(sock):
+    buffer = bytearray(1024 * 1024)
+    while sock.recv_into(buffer):
+        pass
+
+
+def run(path, camera_buffer, frames):
+    sender, receiver = socket.socketpair()
+    threading.Thread(target=drain, args=(receiver,), daemon=True).start()
+    state = {'encoder': LoresJpegEncoder(), 'header': id_header(SENDER_ID)}
+    path(camera_buffer, sender, state)  # Warm up, allocates the reused buffers
+
+    allocated = 0
+    tracemalloc.start()
+    started = time.perf_counter()
+    for _ in range(frames):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        path(camera_buffer, sender, state)
+        _, frame_peak = tracemalloc.get_traced_memory()
+        allocated += frame_peak - before
+    elapsed = time.perf_counter() - started
+    tracemalloc.stop()
+
+    sender.close()
+    return allocated / frames, elapsed / frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=200)
+    args = parser.parse_args()
+
+    camera_buffer = make_camera_buffer()
+    jpeg_size = len(cv2.imencode('.jpg', cv2.cvtColor(camera_buffer, cv2.COLOR_YUV2RGB_YV12))[1])
+    print(f"640x480 lores frame: {camera_buffer.nbytes} bytes YUV420, {jpeg_size} bytes JPEG")
+
+    for name, path in (('old', old_path), ('new', new_path)):
+        per_frame, seconds = run(path, camera_buffer, args.frames)
+        print(f"{name}: {per_frame / 1024:8.1f} KiB allocated per frame, {seconds * 1000:6.2f} ms per frame")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Per-frame cost of encoding the 640x480 lores YUV420 stream to JPEG, old path against the new ones:
+
+    old      cvtColor(COLOR_YUV2RGB_YV12) into a new array + cv2.imencode (what /stream used to do)
+    opencv   LoresJpegEncoder without simplejpeg: cvtColor(COLOR_YUV2BGR_I420) into a reused buffer + imencode
+    planes   LoresJpegEncoder with simplejpeg: the Y/U/V planes go to libjpeg-turbo directly
+
+Also reports how far each decoded result is from the true colours of the frame, which shows the U/V swap of the
+YV12 conversion.
+
+    python benchmarks/lores_yuv_encode.py [--frames 300]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from video_encoding import DEFAULT_QUALITY, LoresJpegEncoder, simplejpeg  # noqa: E402
+
+
+def make_test_frame(width=640, height=480):
+    # A colourful BGR scene converted to full-range (sYCC) I420, the colour space and layout of the lores stream
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    bgr = np.dstack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                     np.full((height, width), 128, np.float32)])
+    bgr = np.clip(bgr + rng.normal(0, 4, bgr.shape), 0, 255).astype(np.uint8)
+
+    y_plane, cr, cb = cv2.split(cv2.cvtColor(bgr, cv2.COLOR_BGR2YCrCb))
+    chroma_size = (width // 2, height // 2)
+    u = cv2.resize(cb, chroma_size, interpolation=cv2.INTER_AREA)
+    v = cv2.resize(cr, chroma_size, interpolation=cv2.INTER_AREA)
+    yuv420 = np.concatenate([y_plane.reshape(-1), u.reshape(-1), v.reshape(-1)]).reshape(height * 3 // 2, width)
+    return bgr, yuv420
+
+
+def old_encode(yuv420):
+    rgb = cv2.cvtColor(yuv420, cv2.COLOR_YUV2RGB_YV12)
+    return cv2.imencode('.jpg', rgb)[1]
+
+
+def time_encoder(encode, yuv420, frames):
+    encode(yuv420)  # Warm up
+    started = time.perf_counter()
+    for _ in range(frames):
+        jpeg = encode(yuv420)
+    return (time.perf_counter() - started) / frames, jpeg
+
+
+def colour_error(jpeg, reference_bgr):
+    decoded = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return float(np.abs(decoded.astype(np.int16) - reference_bgr).mean())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=300)
+    args = parser.parse_args()
+
+    reference_bgr, yuv420 = make_test_frame()
+    encoders = [('old', old_encode), ('opencv', LoresJpegEncoder(DEFAULT_QUALITY, use_yuv_planes=False).encode)]
+    if simplejpeg is not None:
+        encoders.append(('planes', LoresJpegEncoder(DEFAULT_QUALITY).encode))
+    else:
+        print("simplejpeg is not installed, skipping the YUV planes encoder")
+
+    baseline = None
+    for name, encode in encoders:
+        seconds, jpeg = time_encoder(encode, yuv420, args.frames)
+        baseline = baseline or seconds
+        print(f"{name:7s} {seconds * 1000:6.2f} ms per frame ({baseline / seconds:4.2f}x), "
+              f"{len(jpeg):7d} bytes, mean colour error {colour_error(jpeg, reference_bgr):5.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,479 @@
+"""
+Load generator for stream_and_data_receiver.py: simulates N senders and M viewers against a running receiver, to
+find how many cameras one instance handles before frames drop.
+
+Every simulated sender speaks the real wire formats (protocol.py): live frames with a timing prefix on
+VIDEO_STREAM_PORT over TCP or UDP, sensor batches and clock pings on DATA_PORT, and resumable still uploads on
+HIGH_RES_PIC_PORT. Connection churn closes and reopens the video and sensor connections after random lifetimes, and
+a slow link paces each sender's video and still bytes to a fixed rate. Viewers read /video_feed (one simulated sender
+each, round robin) and /mosaic_feed.
+
+Each frame carries its send time in a JPEG comment segment, which the receiver relays untouched, so the viewers
+measure send-to-viewer latency on the load generator's own clock. The report covers, over the measured period:
+
+    ingest     frames sent and published by the receiver (its /stream_stats), the drop rate
+    viewers    frames per second each viewer got, and the send-to-viewer latency percentiles
+    stills     upload times and the stills the receiver wrote (its /ingest_stats), sensor ACK times
+    receiver   CPU (its frame worker processes included) and RSS, when it runs on this machine
+    stages     the receiver's own /latency_stats tail latencies for the simulated senders
+
+    python benchmarks/receiver_load.py --senders 8 --viewers 4 --duration 60
+    python benchmarks/receiver_load.py --host 192.168.1.20 --senders 16 --fps 10 --churn 20 --link-rate 200
+"""
+
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from latency import ClockOffsetEstimator  # noqa: E402
+from protocol import (encode_frame_timing, encode_ping, encode_sensor_batch, id_header, read_ack,  # noqa: E402
+                      read_pong, send_frame_datagrams, send_id_and_payload)
+from spool import upload_still  # noqa: E402
+
+
+COMMENT_TAG = b'loadgen'
+LINK_CHUNK = 1400  # Bytes sent at a time on a slow link
+
+
+def make_jpeg(width, height, quality, seed):
+    # Smooth gradients plus noise, so the JPEG size is close to a real scene
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    image = np.dstack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                       np.full((height, width), rng.integers(0, 256), np.float32)])
+    image = np.clip(image + rng.normal(0, 6, image.shape), 0, 255).astype(np.uint8)
+    return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+
+def tag_frame(jpeg, sender_id, seq, sent_at):
+    """Inserts a COM segment with the sender, sequence number and send time right after the SOI marker."""
+    text = b' '.join([COMMENT_TAG, sender_id.encode(), str(seq).encode(), repr(sent_at).encode()])
+    return jpeg[:2] + b'\xff\xfe' + struct.pack('>H', len(text) + 2) + text + jpeg[2:]
+
+
+def read_tag(jpeg):
+    """(sender id, seq, sent_at) of a tagged frame, or None."""
+    if jpeg[2:4] != b'\xff\xfe':
+        return None
+    length = struct.unpack('>H', jpeg[4:6])[0]
+    parts = bytes(jpeg[6:4 + length]).split(b' ')
+    if len(parts) != 4 or parts[0] != COMMENT_TAG:
+        return None
+    return parts[1].decode(), int(parts[2]), float(parts[3])
+
+
+def percentiles(values, points=(50, 90, 99)):
+    if not values:
+        return 'n/a'
+    results = np.percentile(np.array(values) * 1000, points)
+    parts = [f'p{point} {value:.1f}' for point, value in zip(points, results)] + [f'max {max(values) * 1000:.1f} ms']
+    return ', '.join(parts)
+
+
+class Metrics:
+    """Counters and samples of the simulation, cleared when the measured period starts."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counts = {}
+            self.samples = {}
+            self.started = time.monotonic()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def sample(self, name, value):
+        with self.lock:
+            self.samples.setdefault(name, []).append(value)
+
+    def get(self, name):
+        with self.lock:
+            return self.counts.get(name, 0)
+
+
+class SimulatedSender:
+    def __init__(self, index, args, metrics, stop):
+        self.sender_id = f'{args.prefix}-{index:03d}'
+        self.args = args
+        self.metrics = metrics
+        self.stop = stop
+        self.frame = make_jpeg(*args.frame_size, args.jpeg_quality, index)
+        self.clock = ClockOffsetEstimator()
+        self.still = make_jpeg(*args.still_size, 90, index + 1000) if args.still_interval else None
+        self.stills = 0
+
+    def lifetime(self):
+        """Seconds until the next simulated disconnect, or None without churn."""
+        return random.expovariate(1 / self.args.churn) if self.args.churn else None
+
+    def send_paced(self, sock, buffers):
+        # A slow link: the bytes trickle out at link_rate, so the receiver waits on partial messages
+        data = b''.join(bytes(buffer) for buffer in buffers)
+        for start in range(0, len(data), LINK_CHUNK):
+            sock.sendall(data[start:start + LINK_CHUNK])
+            time.sleep(min(LINK_CHUNK, len(data) - start) / self.args.link_rate)
+
+    def run_video(self):
+        args = self.args
+        use_udp = args.transport == 'udp'
+        header = id_header(self.sender_id.encode())
+        interval = 1 / args.fps
+        seq = 0
+        next_frame_at = time.monotonic()
+        while not self.stop.is_set():
+            try:
+                if use_udp:
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    sock.connect((args.host, args.video_port))
+                else:
+                    sock = socket.create_connection((args.host, args.video_port), timeout=30)
+            except OSError:
+                self.metrics.count('connect_failures')
+                self.stop.wait(1)
+                continue
+
+            lifetime = self.lifetime()
+            close_at = time.monotonic() + lifetime if lifetime else None
+            try:
+                with sock:
+                    while not self.stop.is_set():
+                        delay = next_frame_at - time.monotonic()
+                        if delay > 0:
+                            time.sleep(delay)
+                        next_frame_at = max(next_frame_at + interval, time.monotonic())  # No catching up
+
+                        sent_at = time.time()
+                        frame = tag_frame(self.frame, self.sender_id, seq, sent_at)
+                        timing = encode_frame_timing(0, sent_at, sent_at, self.clock.offset)
+                        started = time.perf_counter()
+                        if use_udp:
+                            send_frame_datagrams(sock, self.sender_id.encode(), seq & 0xFFFFFFFF, frame,
+                                                 args.max_datagram, prefix=timing)
+                        elif args.link_rate:
+                            self.send_paced(sock, [header, struct.pack("Q", len(timing) + len(frame)), timing, frame])
+                        else:
+                            send_id_and_payload(sock, header, frame, prefix=timing)
+                        self.metrics.sample('frame_send', time.perf_counter() - started)
+                        self.metrics.count(f'sent:{self.sender_id}')
+                        self.metrics.count('bytes_sent', len(frame) + len(timing))
+                        seq += 1
+
+                        if close_at and time.monotonic() >= close_at:
+                            self.metrics.count('reconnects')
+                            break
+            except OSError:
+                self.metrics.count('connection_errors')
+                self.stop.wait(1)
+
+    def run_data(self):
+        """Sensor batches and clock pings on the data link, and timed still uploads."""
+        args = self.args
+        next_sample_at = next_ping_at = time.monotonic()
+        next_still_at = time.monotonic() + random.uniform(0, args.still_interval or 1)
+        sensor_socket = None
+        close_at = None
+        while not self.stop.is_set():
+            now = time.monotonic()
+            try:
+                if sensor_socket is None:
+                    sensor_socket = socket.create_connection((args.host, args.data_port), timeout=30)
+                    lifetime = self.lifetime()
+                    close_at = now + lifetime if lifetime else None
+
+                if now >= next_ping_at:
+                    sent_at = time.time()
+                    sensor_socket.sendall(encode_ping(sent_at))
+                    _, receiver_time = read_pong(sensor_socket)
+                    self.clock.add(sent_at, receiver_time, time.time())
+                    next_ping_at = now + 10
+
+                if now >= next_sample_at:
+                    sample = {'temperature': 20 + random.random() * 5, 'humidity': 40 + random.random() * 20,
+                              'datetime': time.strftime('%Y-%m-%dT%H:%M:%S'), 'load_generator': True}
+                    started = time.perf_counter()
+                    sensor_socket.sendall(encode_sensor_batch(self.sender_id, [sample]))
+                    read_ack(sensor_socket)
+                    self.metrics.sample('sensor_ack', time.perf_counter() - started)
+                    next_sample_at = now + args.sensor_interval
+
+                if close_at and now >= close_at:
+                    sensor_socket.close()
+                    sensor_socket = None
+                    self.metrics.count('reconnects')
+            except (OSError, ValueError):
+                self.metrics.count('connection_errors')
+                if sensor_socket is not None:
+                    sensor_socket.close()
+                sensor_socket = None
+                self.stop.wait(1)
+
+            if args.still_interval and now >= next_still_at:
+                next_still_at = now + args.still_interval
+                self.upload_still()
+            self.stop.wait(0.2)
+
+        if sensor_socket is not None:
+            sensor_socket.close()
+
+    def upload_still(self):
+        offset = self.clock.offset
+        captured_at = time.time()
+        # Numbered in a JPEG comment, so every upload has new bytes and the receiver's duplicate check stores it
+        path = os.path.join(self.args.still_dir, f'{self.sender_id}-{self.stills}.jpg')
+        with open(path, 'wb') as file:
+            file.write(tag_frame(self.still, self.sender_id, self.stills, captured_at))
+        self.stills += 1
+        still = SimpleNamespace(path=path, upload_id=uuid.uuid4().hex, captured_at=captured_at, sensor_timestamp=0)
+        started = time.perf_counter()
+        try:
+            with socket.create_connection((self.args.host, self.args.still_port), timeout=30) as sock:
+                upload_still(sock, self.sender_id, still, 256 * 1024, max_rate=self.args.link_rate or None,
+                             clock_offset=None if math.isnan(offset) else offset)
+            self.metrics.sample('still_upload', time.perf_counter() - started)
+            self.metrics.count('stills_uploaded')
+        except (OSError, ValueError):
+            self.metrics.count('stills_failed')
+        finally:
+            os.unlink(path)
+
+
+def run_viewer(args, path, metrics, stop, name):
+    """Reads an MJPEG feed, counting frames and measuring the latency of tagged ones."""
+    while not stop.is_set():
+        try:
+            connection = http.client.HTTPConnection(args.host, args.http_port, timeout=10)
+            connection.request('GET', path)
+            response = connection.getresponse()
+            buffer = bytearray()
+            while not stop.is_set():
+                data = response.read1(65536)
+                if not data:
+                    break
+                buffer += data
+                while True:
+                    start = buffer.find(b'\xff\xd8')
+                    end = buffer.find(b'\xff\xd9', start) if start >= 0 else -1
+                    if end < 0:
+                        if start > 0:
+                            del buffer[:start]
+                        break
+                    received_at = time.time()
+                    tag = read_tag(buffer[start:end + 2])
+                    del buffer[:end + 2]
+                    metrics.count(f'viewed:{name}')
+                    if tag is not None:
+                        metrics.sample('viewer_latency', received_at - tag[2])
+            connection.close()
+        except (OSError, http.client.HTTPException):
+            metrics.count('viewer_errors')
+            stop.wait(1)
+
+
+def find_receiver(port):
+    """The local process listening on port, or None."""
+    import psutil
+    try:
+        for connection in psutil.net_connections(kind='tcp'):
+            if connection.status == psutil.CONN_LISTEN and connection.laddr.port == port and connection.pid:
+                return psutil.Process(connection.pid)
+    except psutil.AccessDenied:
+        pass
+    return None
+
+
+def monitor_receiver(process, metrics, stop):
+    """Samples the receiver's CPU (its worker processes included) and RSS every second."""
+    import psutil
+    processes = {}
+    while not stop.wait(1):
+        try:
+            cpu = rss = 0
+            for member in [process] + process.children(recursive=True):
+                tracked = processes.setdefault(member.pid, member)
+                cpu += tracked.cpu_percent(None)
+                rss += tracked.memory_info().rss
+            metrics.sample('receiver_cpu', cpu)
+            metrics.sample('receiver_rss', rss)
+        except psutil.Error:
+            pass
+
+
+def get_json(args, path):
+    connection = http.client.HTTPConnection(args.host, args.http_port, timeout=10)
+    try:
+        connection.request('GET', path)
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+
+def receiver_snapshot(args):
+    try:
+        return get_json(args, '/stream_stats'), get_json(args, '/ingest_stats')
+    except (OSError, ValueError, http.client.HTTPException) as e:
+        print(f"Could not read the receiver's stats: {e}")
+        return {'streams': {}}, {}
+
+
+def report(args, senders, viewer_names, metrics, before, after, elapsed):
+    streams_before, ingest_before = before
+    streams_after, ingest_after = after
+    frame_kb = len(senders[0].frame) / 1024
+    print(f"\n{args.senders} senders x {args.fps:g} fps {args.frame_size[0]}x{args.frame_size[1]} "
+          f"({frame_kb:.1f} KiB frames, {args.transport.upper()}), {len(viewer_names)} viewers, {elapsed:.0f} s measured")
+
+    sent = published = 0
+    for sender in senders:
+        sent += metrics.get(f'sent:{sender.sender_id}')
+        published += (streams_after['streams'].get(sender.sender_id, {}).get('seq', 0)
+                      - streams_before['streams'].get(sender.sender_id, {}).get('seq', 0))
+    drop_rate = 1 - published / sent if sent else 0
+    print(f"Ingest:   {sent} frames sent ({sent / elapsed / args.senders:.1f} fps per sender, "
+          f"{metrics.get('bytes_sent') * 8 / elapsed / 1e6:.1f} Mbit/s), {published} published by the receiver, "
+          f"drop rate {max(drop_rate, 0) * 100:.1f}%")
+    print(f"          send call {percentiles(metrics.samples.get('frame_send', []))}")
+    udp = [ingest.get('udp_video') or {} for ingest in (ingest_before, ingest_after)]
+    print(f"          UDP frames incomplete {udp[1].get('incomplete_frames', 0) - udp[0].get('incomplete_frames', 0)}, "
+          f"connection errors {metrics.get('connection_errors')}, reconnects {metrics.get('reconnects')}, "
+          f"failed connects {metrics.get('connect_failures')}")
+
+    if viewer_names:
+        rates = [metrics.get(f'viewed:{name}') / elapsed for name in viewer_names]
+        print(f"Viewers:  {np.mean(rates):.1f} fps mean, {min(rates):.1f} min, {metrics.get('viewer_errors')} errors")
+        print(f"          send to viewer {percentiles(metrics.samples.get('viewer_latency', []))}")
+
+    print(f"Stills:   {metrics.get('stills_uploaded')} uploaded, {metrics.get('stills_failed')} failed, "
+          f"upload {percentiles(metrics.samples.get('still_upload', []))}")
+    writer = [ingest.get('image_writer') or {} for ingest in (ingest_before, ingest_after)]
+    written, duplicates, failed = (writer[1].get(key, 0) - writer[0].get(key, 0)
+                                   for key in ('written', 'duplicates_skipped', 'failed'))
+    print(f"          receiver wrote {written}, skipped {duplicates} as duplicates, {failed} failed to write")
+    waited = ingest_after.get('waited_jobs', 0) - ingest_before.get('waited_jobs', 0)
+    print(f"          {waited} ingest pool jobs waited for a free slot")
+    print(f"Sensors:  ACK {percentiles(metrics.samples.get('sensor_ack', []))}")
+
+    cpu = metrics.samples.get('receiver_cpu')
+    if cpu:
+        rss = np.array(metrics.samples['receiver_rss']) / 1024 ** 2
+        print(f"Receiver: CPU {np.mean(cpu):.0f}% mean, {max(cpu):.0f}% max (100% = one core), "
+              f"RSS {rss.mean():.0f} MiB mean, {rss.max():.0f} MiB max")
+    else:
+        print("Receiver: CPU and RSS not measured (not running on this machine, or not found; see --receiver-pid)")
+
+    try:
+        latency = get_json(args, '/latency_stats')
+    except (OSError, ValueError, http.client.HTTPException):
+        latency = {}
+    stages = {}
+    for sender in senders:
+        for stage, stats in latency.get(sender.sender_id, {}).items():
+            if stats.get('count'):
+                stages[stage] = max(stages.get(stage, 0), stats['p99_ms'])
+    if stages:
+        print("Stages:   worst sender p99 (cumulative since the receiver started): "
+              + ', '.join(f'{stage} {p99:.1f} ms' for stage, p99 in stages.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    size = lambda value: tuple(int(part) for part in value.split('x'))  # noqa: E731
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--video-port', type=int, default=5555)
+    parser.add_argument('--data-port', type=int, default=5556)
+    parser.add_argument('--still-port', type=int, default=5557)
+    parser.add_argument('--http-port', type=int, default=5000)
+    parser.add_argument('--senders', type=int, default=4)
+    parser.add_argument('--prefix', default='loadgen', help="sender ids are <prefix>-000, <prefix>-001...")
+    parser.add_argument('--fps', type=float, default=15)
+    parser.add_argument('--frame-size', type=size, default=(640, 480), help="WIDTHxHEIGHT of the live frames")
+    parser.add_argument('--jpeg-quality', type=int, default=95)
+    parser.add_argument('--transport', choices=('tcp', 'udp'), default='tcp')
+    parser.add_argument('--max-datagram', type=int, default=1400)
+    parser.add_argument('--still-interval', type=float, default=30, help="seconds between stills, 0 for none")
+    parser.add_argument('--still-size', type=size, default=(1920, 1080))
+    parser.add_argument('--sensor-interval', type=float, default=30)
+    parser.add_argument('--churn', type=float, default=0,
+                        help="mean seconds a video or sensor connection lives before it is reopened, 0 for never")
+    parser.add_argument('--link-rate', type=float, default=0,
+                        help="KiB/s per sender for TCP video and stills, to simulate a slow link; 0 for unlimited")
+    parser.add_argument('--viewers', type=int, default=2, help="/video_feed viewers, one sender each")
+    parser.add_argument('--mosaic-viewers', type=int, default=0)
+    parser.add_argument('--viewer-fps', type=float, default=0, help="?fps= of the viewers, 0 for the receiver's default")
+    parser.add_argument('--warmup', type=float, default=5, help="seconds before the measured period starts")
+    parser.add_argument('--duration', type=float, default=30, help="seconds measured")
+    parser.add_argument('--receiver-pid', type=int, help="found from the video port when on this machine")
+    args = parser.parse_args()
+    args.link_rate *= 1024
+
+    metrics = Metrics()
+    stop = threading.Event()
+    threads = []
+    with tempfile.TemporaryDirectory() as args.still_dir:
+        senders = [SimulatedSender(index, args, metrics, stop) for index in range(args.senders)]
+        for sender in senders:
+            threads.append(threading.Thread(target=sender.run_video, daemon=True))
+            threads.append(threading.Thread(target=sender.run_data, daemon=True))
+
+        viewer_names = []
+        fps_query = f'&fps={args.viewer_fps:g}' if args.viewer_fps else ''
+        for index in range(args.viewers):
+            name = f'viewer-{index}'
+            path = f'/video_feed?sender={senders[index % len(senders)].sender_id}{fps_query}'
+            threads.append(threading.Thread(target=run_viewer, args=(args, path, metrics, stop, name), daemon=True))
+            viewer_names.append(name)
+        for index in range(args.mosaic_viewers):
+            name = f'mosaic-{index}'
+            threads.append(threading.Thread(target=run_viewer, args=(args, '/mosaic_feed', metrics, stop, name),
+                                            daemon=True))
+            viewer_names.append(name)
+
+        try:
+            import psutil
+            receiver = psutil.Process(args.receiver_pid) if args.receiver_pid else find_receiver(args.video_port)
+        except ImportError:
+            receiver = None
+        if receiver is not None:
+            threads.append(threading.Thread(target=monitor_receiver, args=(receiver, metrics, stop), daemon=True))
+
+        print(f"Simulating {args.senders} senders and {len(viewer_names)} viewers against {args.host}, "
+              f"{args.warmup:g} s warm-up then {args.duration:g} s measured...")
+        for thread in threads:
+            thread.start()
+        try:
+            time.sleep(args.warmup)
+            before = receiver_snapshot(args)
+            metrics.reset()
+            time.sleep(args.duration)
+            elapsed = time.monotonic() - metrics.started
+            after = receiver_snapshot(args)
+        finally:
+            stop.set()
+        report(args, senders, viewer_names, metrics, before, after, elapsed)
+        for thread in threads:
+            thread.join(timeout=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Startup auto-tuning of the sender's live stream for the hardware it runs on.
+
+A short micro-benchmark on the device measures how fast the camera delivers frames and how long a lores JPEG takes
+to encode at each candidate size and quality. The encode frames are a real full-resolution capture scaled down, so
+their detail is representative. The largest size, then the highest quality, that can be encoded at the minimum frame
+rate within the CPU budget wins, and the buffer count is sized to the memory budget.
+
+The chosen profile is cached per Pi model and camera in a JSON file, so only the first start on a given hardware
+combination pays for the benchmark.
+"""
+
+import datetime
+import json
+import os
+import tempfile
+import time
+
+
+LORES_SIZES = [(1280, 960), (1024, 768), (800, 600), (640, 480), (480, 360), (320, 240)]  # Largest first
+JPEG_QUALITIES = [95, 85, 75]  # Highest first
+
+MIN_BUFFER_COUNT = 2
+MAX_BUFFER_COUNT = 8
+
+
+def profile_key(model, sensor_resolution):
+    return f'{model}|{sensor_resolution[0]}x{sensor_resolution[1]}'
+
+
+def load_profile(path, key):
+    """Returns the cached profile for key, or None."""
+    try:
+        with open(path) as file:
+            profile = json.load(file).get(key)
+    except (OSError, ValueError):
+        return None
+    if profile is None:
+        return None
+    profile['lores_size'] = tuple(profile['lores_size'])
+    return profile
+
+
+def save_profile(path, key, profile):
+    try:
+        with open(path) as file:
+            profiles = json.load(file)
+    except (OSError, ValueError):
+        profiles = {}
+    profiles[key] = profile
+
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as file:
+        json.dump(profiles, file, indent=2)
+    os.replace(file.name, path)
+
+
+def measure_capture_fps(picam2, frames=10):
+    """Frames per second the camera delivers with its current configuration."""
+    picam2.capture_request().release()  # The first request may have been waiting in the queue
+    started = time.perf_counter()
+    for _ in range(frames):
+        picam2.capture_request().release()
+    return frames / (time.perf_counter() - started)
+
+
+def measure_encode_times(picam2, encoder_class, sizes, qualities, repeats=5):
+    """
+    Returns {(size, quality): seconds per frame} for encoding I420 frames of each size with encoder_class, which
+    is constructed with a quality argument and has an encode(yuv420) method.
+    """
+    import cv2
+
+    request = picam2.capture_request()
+    try:
+        main_frame = request.make_array("main")
+    finally:
+        request.release()
+
+    times = {}
+    for size in sizes:
+        scaled = cv2.resize(main_frame, size, interpolation=cv2.INTER_AREA)
+        yuv420 = cv2.cvtColor(scaled, cv2.COLOR_BGR2YUV_I420)
+        for quality in qualities:
+            encoder = encoder_class(quality=quality)
+            encoder.encode(yuv420)  # Warm up, the first call allocates
+            started = time.perf_counter()
+            for _ in range(repeats):
+                encoder.encode(yuv420)
+            times[(size, quality)] = (time.perf_counter() - started) / repeats
+    return times
+
+
+def buffer_count_for(available_bytes, main_size, lores_size, memory_budget):
+    """Number of camera buffers (each a main RGB888 frame and a lores YUV420 frame) that fit the memory budget."""
+    buffer_bytes = main_size[0] * main_size[1] * 3 + lores_size[0] * lores_size[1] * 3 // 2
+    count = int(available_bytes * memory_budget // buffer_bytes)
+    return max(MIN_BUFFER_COUNT, min(count, MAX_BUFFER_COUNT))
+
+
+def choose_stream(encode_times, capture_fps, cpu_budget, min_fps, max_fps):
+    """
+    Picks (lores_size, jpeg_quality, fps) from the encode times. cpu_budget is the share of one core the live
+    stream may use. If no candidate reaches min_fps, the cheapest one is used at whatever rate it manages.
+    """
+    def fps_for(candidate):
+        return min(capture_fps, max_fps, cpu_budget / encode_times[candidate])
+
+    for candidate in sorted(encode_times, key=lambda c: (c[0][0] * c[0][1], c[1]), reverse=True):
+        if fps_for(candidate) >= min_fps:
+            return candidate[0], candidate[1], fps_for(candidate)
+
+    cheapest = min(encode_times, key=encode_times.get)
+    return cheapest[0], cheapest[1], fps_for(cheapest)
+
+
+def calibrate(picam2, encoder_class, main_size, available_bytes, cpu_budget=0.5, memory_budget=0.5, min_fps=10,
+              max_fps=30):
+    """Runs the micro-benchmark on a started camera and returns the chosen profile as a JSON-serializable dict."""
+    started = time.perf_counter()
+    capture_fps = measure_capture_fps(picam2)
+    sizes = [size for size in LORES_SIZES if size[0] <= main_size[0] and size[1] <= main_size[1]]
+    encode_times = measure_encode_times(picam2, encoder_class, sizes, JPEG_QUALITIES)
+    lores_size, jpeg_quality, fps = choose_stream(encode_times, capture_fps, cpu_budget, min_fps, max_fps)
+
+    return {
+        'lores_size': lores_size,
+        'jpeg_quality': jpeg_quality,
+        'fps': round(fps, 1),
+        'buffer_count': buffer_count_for(available_bytes, main_size, lores_size, memory_budget),
+        'capture_fps': round(capture_fps, 1),
+        'encode_ms': round(encode_times[(lores_size, jpeg_quality)] * 1000, 2),
+        'calibration_seconds': round(time.perf_counter() - started, 2),
+        'calibrated_at': datetime.datetime.now().isoformat(),
+    }
@@ -5,43 +5,57 @@ and supports dynamic image processing. It's designed for use in remote monitorin
 """
 
 
+from startup_timing import startup  # First, so the startup phases are timed from here
+
+import itertools
 import json
+import math
 import re
+import select
 import subprocess
-import psutil
 import numpy as np
-from flask import Flask, Response, url_for, send_file, render_template, jsonify
-from picamera2 import Picamera2
+from picamera2 import Picamera2, MappedArray
 from picamera2.encoders import H264Encoder  #JpegEncoder, MJPEGEncoder
-from picamera2.outputs import FileOutput
+from picamera2.outputs import FileOutput, Output
+import functools
 import io
 import threading
 from threading import Condition, Thread, Event
 from datetime import datetime
-import cv2
 import os
 from libcamera import controls as libcontrols
 import time
 import sys
 import socket
-import struct
-from werkzeug.serving import ThreadedWSGIServer
 from socket import SOL_SOCKET, SO_REUSEADDR
 import libcamera
-
-from utils import WatchdogTimer, read_sensor
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import calibration
+from fmp4 import LiveSegmenter
+from governor import LoadGovernor, cap, read_soc_temperature, read_throttle_flags
+from latency import ClockOffsetEstimator, capture_wall_time
+from protocol import (encode_sensor_batch, read_ack, id_header, send_id_and_payload, send_frame_datagrams, encode_ping,
+                      read_pong, encode_frame_timing, read_message, MSG_CONTROL)
+from spool import StillSpool, send_spooled_still
+from supervisor import Supervisor
+from video_encoding import LoresJpegEncoder, fit_roi
+
+# cv2 (timed stills, bursts) and psutil (sensor data) are imported where they are used, in the worker threads,
+# so they don't delay the first frame
 
 try:
     import sender_settings as settings
 except ImportError:
     raise ImportError("Settings file not found. Please copy and modify 'sender_settings_template.py' as 'sender_settings.py'.")
 
+startup.mark('camera_imports')
+
 
 # Global shutdown event
 shutdown_event = Event()
-
-
-app = Flask(__name__)
+shutdown_complete = Event()  # Set once shutdown_server() is done, the main thread exits then
 
 # Connection parameters
 use_domain_name = settings.use_domain_name
@@ -61,95 +75,94 @@ SAVE_TO_DISK = settings.SAVE_TO_DISK
 # Sleep time (in seconds) between data reads and sending
 SLEEP_TIME = settings.SLEEP_TIME
 
+# Sensor samples kept while the receiver is unreachable, and how many go in one message when flushing them
+SENSOR_BUFFER_MAX = getattr(settings, 'SENSOR_BUFFER_MAX', 2880)
+SENSOR_MAX_BATCH = getattr(settings, 'SENSOR_MAX_BATCH', 500)
+
+# Burst mode limits
+BURST_MAX_FRAMES = getattr(settings, 'BURST_MAX_FRAMES', 20)
+BURST_JPEG_QUALITY = getattr(settings, 'BURST_JPEG_QUALITY', 95)
+# Stills captured in a burst when the timed stills worker sees the scene brightness change suddenly (e.g. lights
+# switched on), spooled and uploaded like the timed stills. 0 disables it.
+BURST_ON_SCENE_CHANGE = getattr(settings, 'BURST_ON_SCENE_CHANGE', 0)
+
+# Worker supervision: seconds without a heartbeat before a worker is considered stalled, and how many times it is
+# restarted within WORKER_RESTART_WINDOW seconds before escalating to a camera re-init or a process restart.
+# The timed stills worker uses watchdog_timeout.
+VIDEO_WORKER_DEADLINE = getattr(settings, 'VIDEO_WORKER_DEADLINE', 60)
+SENSOR_WORKER_DEADLINE = getattr(settings, 'SENSOR_WORKER_DEADLINE', 120)
+HTTP_WORKER_DEADLINE = getattr(settings, 'HTTP_WORKER_DEADLINE', 30)
+WORKER_MAX_RESTARTS = getattr(settings, 'WORKER_MAX_RESTARTS', 3)
+WORKER_RESTART_WINDOW = getattr(settings, 'WORKER_RESTART_WINDOW', 600)
+
+# Seconds an HTTP request that needs the camera waits for it while it (re)starts, before answering 503
+CAMERA_WAIT_TIMEOUT = getattr(settings, 'CAMERA_WAIT_TIMEOUT', 10)
+
+# Stills waiting to be uploaded are kept on disk until the receiver has them, within these limits. The backlog is
+# drained at SPOOL_DRAIN_RATE bytes per second (0 for no limit), giving way to the live timed stills.
+SPOOL_DIR = getattr(settings, 'SPOOL_DIR', 'spool')
+SPOOL_MAX_BYTES = getattr(settings, 'SPOOL_MAX_BYTES', 512 * 1024 * 1024)
+SPOOL_MAX_AGE = getattr(settings, 'SPOOL_MAX_AGE', 7 * 24 * 60 * 60)
+SPOOL_CHUNK_SIZE = getattr(settings, 'SPOOL_CHUNK_SIZE', 256 * 1024)
+SPOOL_DRAIN_RATE = getattr(settings, 'SPOOL_DRAIN_RATE', 256 * 1024)
+SPOOL_DRAIN_INTERVAL = getattr(settings, 'SPOOL_DRAIN_INTERVAL', 30)  # Seconds between checks of an idle spool
+SPOOL_WORKER_DEADLINE = getattr(settings, 'SPOOL_WORKER_DEADLINE', 120)
+
+# Live video transport: 'tcp', or 'udp' to send frames as MTU-sized datagrams that the receiver drops when
+# incomplete instead of stalling the stream on a lost packet. Stills and sensor data always use TCP.
+VIDEO_TRANSPORT = getattr(settings, 'VIDEO_TRANSPORT', 'tcp')
+UDP_MAX_DATAGRAM = getattr(settings, 'UDP_MAX_DATAGRAM', 1400)  # Bytes per datagram, keep below the path MTU
+
+# Startup auto-tuning of the lores size, JPEG quality, buffer count and frame rate (see calibration.py). The result
+# is cached per Pi model and camera; delete the cache file to calibrate again.
+AUTO_TUNE = getattr(settings, 'AUTO_TUNE', False)
+AUTO_TUNE_CPU_BUDGET = getattr(settings, 'AUTO_TUNE_CPU_BUDGET', 0.5)  # Share of one core for the live stream
+AUTO_TUNE_MEMORY_BUDGET = getattr(settings, 'AUTO_TUNE_MEMORY_BUDGET', 0.5)  # Share of available memory for buffers
+AUTO_TUNE_MIN_FPS = getattr(settings, 'AUTO_TUNE_MIN_FPS', 10)
+AUTO_TUNE_MAX_FPS = getattr(settings, 'AUTO_TUNE_MAX_FPS', 30)
+CALIBRATION_CACHE = getattr(settings, 'CALIBRATION_CACHE', 'calibration_cache.json')
+
+# Region-of-interest presets for the live stream, as (x, y, width, height) fractions of the full field of view, e.g.
+# {'gate': (0.55, 0.35, 0.2, 0.2)}. 'full' is always available. Switched at runtime with /roi/<preset>, on the sender
+# or on the receiver. ROI_METHOD 'main' crops the full-resolution main stream and scales the crop to the lores size,
+# leaving the stills untouched; 'scaler' sets the camera's ScalerCrop instead, which costs no CPU but crops the timed
+# stills as well on Pi models before the Pi 5. Either way the stream keeps its lores size and bitrate.
+ROI_PRESETS = getattr(settings, 'ROI_PRESETS', {})
+ROI_METHOD = getattr(settings, 'ROI_METHOD', 'main')
+
+# Browser live view of the hardware H.264 stream at /live, packaged as fragmented MP4 (see fmp4.py). Each segment is
+# one group of pictures, so the keyframe interval sets both the segment length and how long a new viewer waits for
+# its first picture. The newest LIVE_SEGMENT_WINDOW segments are kept in memory. The MJPEG /stream stays available
+# as the fallback, and is the one that follows an ROI_METHOD 'main' region of interest.
+LIVE_H264_KEYFRAME_INTERVAL = getattr(settings, 'LIVE_H264_KEYFRAME_INTERVAL', 30)  # Frames
+LIVE_SEGMENT_WINDOW = getattr(settings, 'LIVE_SEGMENT_WINDOW', 6)
+
+# Load governor tiers (see governor.py), entered at a SoC temperature ('temp', degrees C) or CPU load ('cpu',
+# percent) and while the firmware throttles. While one is active it caps the live stream's 'fps' and 'jpeg_quality',
+# scales the timed stills by 'still_scale', and with 'analytics' False measures the stills' brightness on a 1/8 scale
+# decode. A tier is left when the readings stay GOVERNOR_*_HYSTERESIS below its thresholds for GOVERNOR_COOL_DOWN
+# seconds. An empty list turns the governor off.
+GOVERNOR_TIERS = getattr(settings, 'GOVERNOR_TIERS', [
+    {'name': 'warm', 'temp': 70, 'fps': 15},
+    {'name': 'hot', 'temp': 75, 'fps': 8, 'jpeg_quality': 70, 'still_scale': 0.5, 'analytics': False},
+    {'name': 'critical', 'temp': 80, 'fps': 2, 'jpeg_quality': 60, 'still_scale': 0.25, 'analytics': False},
+])
+GOVERNOR_INTERVAL = getattr(settings, 'GOVERNOR_INTERVAL', 10)  # Seconds between readings
+GOVERNOR_TEMP_HYSTERESIS = getattr(settings, 'GOVERNOR_TEMP_HYSTERESIS', 5)
+GOVERNOR_CPU_HYSTERESIS = getattr(settings, 'GOVERNOR_CPU_HYSTERESIS', 15)
+GOVERNOR_COOL_DOWN = getattr(settings, 'GOVERNOR_COOL_DOWN', 120)
+STILL_JPEG_QUALITY = 90  # Of the stills scaled down by a tier, the quality picamera2 saves the others with
+
+still_spool = StillSpool(SPOOL_DIR, SPOOL_MAX_BYTES, SPOOL_MAX_AGE)
+live_upload = Event()  # Set while a timed still is being uploaded
+spool_added = Event()  # Wakes the idle backlog drain when stills are spooled to be uploaded by it
+governor = LoadGovernor(GOVERNOR_TIERS, temp_hysteresis=GOVERNOR_TEMP_HYSTERESIS,
+                        cpu_hysteresis=GOVERNOR_CPU_HYSTERESIS, cool_down=GOVERNOR_COOL_DOWN)
+
 # Unique identifier for the sender
 sender_id = socket.gethostname()  # or any other unique identifier
 sender_id_encoded = sender_id.encode()
-
-
-def shutdown_server():
-    """
-    Initiates the shutdown process for the server and related threads.
-
-    This function signals all threads to stop, safely stops camera recording, and shuts down the Flask server.
-    """
-    print("Initiating shutdown...")
-
-    # Signal all threads to stop
-    shutdown_event.set()
-
-    # Safely stop camera recording
-    try:
-        picam2.stop_recording()
-        print("picamera stopped")
-    except Exception as e:
-        print(f"Error stopping camera recording: {e}")
-
-    # Get the current thread
-    current_thread = threading.current_thread()
-    print("Current thread: ", current_thread.name)
-
-    # Define a timeout for thread joins
-    join_timeout = 10
-
-    # Wait for threads to finish, skip if it's the current thread
-    if thread.is_alive() and thread != current_thread:
-        print("Waiting for save_pic_every_minute thread to finish...")
-        thread.join(timeout=join_timeout)
-    else:
-        print("save_pic_every_minute thread NOT ALIVE OR IS CURRENT THREAD...")
-
-    if send_data_thread.is_alive() and send_data_thread != current_thread:
-        print("Waiting for sensor_thread to finish...")
-        send_data_thread.join(timeout=join_timeout)
-    else:
-        print("sensor_thread NOT ALIVE OR IS CURRENT THREAD...")
-
-    if video_thread.is_alive() and video_thread != current_thread:
-        print("Waiting for video_thread to finish...")
-        video_thread.join(timeout=join_timeout)
-    else:
-        print("video_thread NOT ALIVE OR IS CURRENT THREAD...")
-
-    if watchdog.is_alive() and current_thread != watchdog:
-        print("Stopping watchdog...")
-        watchdog.stop()
-        watchdog.join(timeout=join_timeout)
-        if watchdog.is_alive():
-            print("Warning: watchdog did not shut down cleanly.")
-
-    print("Threads stopped. Checking server shutdown...")
-
-    # Shutdown the Flask server
-    if server is not None and current_thread != threading.main_thread():
-        print("Shutting down server...")
-        server.shutdown()
-
-    print("Shutdown complete.")
-
-
-@app.route('/manual_shutdown')
-def manual_shutdown():
-    """
-    Flask route to manually initiate server shutdown.
-
-    This route triggers the shutdown of the server when accessed.
-
-    Returns:
-        str: A message indicating that the server is shutting down.
-    """
-    shutdown_server()
-    return 'Server shutting down...'
-
-
-@app.route('/complete_shutdown')
-def complete_shutdown():
-    """
-    This method exits the application sending a signal of 100, which in turn tells the main run app to stop re-executing
-    this program.
-    """
-    shutdown_server()
-    sys.exit(100)
-    return 'Server shutting down...'
+sender_id_header = id_header(sender_id_encoded)  # Packed once, prefixed to every frame sent over TCP
 
 
 class StreamingOutput(io.BufferedIOBase):
@@ -205,25 +218,12 @@ normalized_model = normalize_string(pi_model)
 
 if 'raspberry pi zero 2 w rev 10' in normalized_model:
     buffer_count = 4
+    burst_max_in_flight = 2  # Full-resolution frames held in memory at once during a burst
 else:
     buffer_count = 8
+    burst_max_in_flight = os.cpu_count() or 2
 print(f"Allocating {buffer_count} buffers")
 
-picam2 = Picamera2()
-
-full_resolution = picam2.sensor_resolution
-print("Sensor resolution: ")
-print(full_resolution)
-
-# main={"size": (1280, 720), "format": "RGB888"}
-video_config = picam2.create_video_configuration(main={"size": full_resolution, "format": "RGB888"},
-                                                 lores={"size": (640, 480)},
-                                                 encode="lores",
-                                                 buffer_count=buffer_count)    # Need to decrease this to 2-3 in the raspberry pi
-                                                                    # zero 2 w to avoid running out of memory when using
-                                                                    # the full sensor resolution, specially on the
-                                                                    # camera module 3.
-
 initial_controls = {
     "AwbEnable": True,
     "AeEnable": True
@@ -231,53 +231,344 @@ initial_controls = {
     #"FrameDurationLimits": (33333, 1000000)
 }
 
-picam2.set_controls(initial_controls)
+# Constants (in microseconds)
+MIN_EXPOSURE_TIME = 100000
+EXPOSURE_INCREMENT = 50000
+DEFAULT_EXPOSURE_TIME = 100000
+
+encoder = H264Encoder(repeat=True, iperiod=LIVE_H264_KEYFRAME_INTERVAL)  # SPS/PPS with every keyframe, for new viewers
+output = StreamingOutput()
+live_segmenter = LiveSegmenter(window=LIVE_SEGMENT_WINDOW)
+
+# Live stream settings used without auto-tuning; fps None sends frames as fast as they come
+default_video_profile = {'lores_size': (640, 480), 'jpeg_quality': 95, 'buffer_count': buffer_count, 'fps': None}
 
+# Set by open_camera(), which runs in the background while the rest of the program loads
+picam2 = None
+full_resolution = None
+video_config = None
+video_profile = default_video_profile
 CAM_MODULE_V = 2  # Indicates whether it is the cam module 1, 2, 3...
+MAX_EXPOSURE_TIME = int(1000000 * 10)
+camera_ready = Event()
+camera_error = None
+
+roi_name = 'full'  # Region of interest of the live stream
+roi_crop = None  # With ROI_METHOD 'main', the (x, y, width, height) of the main stream to stream, None for all of it
+
+
+class LiveVideoOutput(Output):
+    """Hands the encoded H.264 frames to the fMP4 segmenter of the browser live view."""
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        live_segmenter.add_frame(frame, keyframe, timestamp)
+
+
+live_output = LiveVideoOutput()
+
+
+def start_recording(profile):
+    live_segmenter.reset(profile['lores_size'])
+    picam2.start_recording(encoder, [FileOutput(output), live_output])
+
+
+def create_video_config(profile):
+    # main={"size": (1280, 720), "format": "RGB888"}
+    config = picam2.create_video_configuration(main={"size": full_resolution, "format": "RGB888"},
+                                               lores={"size": profile['lores_size']},
+                                               encode="lores",
+                                               buffer_count=profile['buffer_count'])    # Need to decrease this to 2-3 in the raspberry pi
+                                                                    # zero 2 w to avoid running out of memory when using
+                                                                    # the full sensor resolution, specially on the
+                                                                    # camera module 3.
+    if ROTATE_180:
+        config["transform"] = libcamera.Transform(hflip=1, vflip=1)
+    return config
+
+
+def calibrate_video_profile(profile_key):
+    """Benchmarks the started camera, caches the chosen profile and reconfigures the camera if it differs."""
+    global video_config
+    import psutil
+
+    print("Calibrating the live stream for this hardware...")
+    profile = calibration.calibrate(picam2, LoresJpegEncoder, full_resolution, psutil.virtual_memory().available,
+                                    cpu_budget=AUTO_TUNE_CPU_BUDGET, memory_budget=AUTO_TUNE_MEMORY_BUDGET,
+                                    min_fps=AUTO_TUNE_MIN_FPS, max_fps=AUTO_TUNE_MAX_FPS)
+    try:
+        calibration.save_profile(CALIBRATION_CACHE, profile_key, profile)
+    except OSError as e:
+        print(f"Error caching the calibration: {e}")
+
+    if (profile['lores_size'], profile['buffer_count']) != (video_profile['lores_size'], video_profile['buffer_count']):
+        picam2.stop_recording()
+        video_config = create_video_config(profile)
+        picam2.configure(video_config)
+        start_recording(profile)
+    startup.mark('camera_calibrated')
+    return profile
+
+
+def open_camera():
+    global picam2, full_resolution, video_config, video_profile, CAM_MODULE_V, MAX_EXPOSURE_TIME
+
+    picam2 = Picamera2()
+    startup.mark('camera_open')
+
+    full_resolution = picam2.sensor_resolution
+    print("Sensor resolution: ")
+    print(full_resolution)
+
+    profile_key = calibration.profile_key(normalized_model, full_resolution)
+    cached_profile = calibration.load_profile(CALIBRATION_CACHE, profile_key) if AUTO_TUNE else None
+    video_profile = cached_profile or default_video_profile
+    video_config = create_video_config(video_profile)
+
+    picam2.set_controls(initial_controls)
 
-# Assuming typical Raspberry Pi camera models
-if full_resolution == (4608, 2592):
-    print("Camera Module v3 detected")
-    CAM_MODULE_V = 3
-elif full_resolution == (3280, 2464):
-    print("Camera Module v2 detected")
     CAM_MODULE_V = 2
-elif full_resolution == (2592, 1944):
-    print("Camera Module v1")
-    CAM_MODULE_V = 1
-elif full_resolution == (4056, 3040):
-    print("HQ Camera")
-else:
-    print("Unknown Camera Model")
 
-# Constants (in microseconds)
-if CAM_MODULE_V == 3:
-    MAX_EXPOSURE_TIME = int(1000000 * 112)  #112 seconds in total of max exposure
-elif CAM_MODULE_V == 2:
-    MAX_EXPOSURE_TIME = int(1000000 * 10)
-elif CAM_MODULE_V == 1:
-    MAX_EXPOSURE_TIME = int(1000000 * .9)
-MIN_EXPOSURE_TIME = 100000
-EXPOSURE_INCREMENT = 50000
-DEFAULT_EXPOSURE_TIME = 100000
+    # Assuming typical Raspberry Pi camera models
+    if full_resolution == (4608, 2592):
+        print("Camera Module v3 detected")
+        CAM_MODULE_V = 3
+    elif full_resolution == (3280, 2464):
+        print("Camera Module v2 detected")
+        CAM_MODULE_V = 2
+    elif full_resolution == (2592, 1944):
+        print("Camera Module v1")
+        CAM_MODULE_V = 1
+    elif full_resolution == (4056, 3040):
+        print("HQ Camera")
+    else:
+        print("Unknown Camera Model")
+
+    if CAM_MODULE_V == 3:
+        MAX_EXPOSURE_TIME = int(1000000 * 112)  #112 seconds in total of max exposure
+    elif CAM_MODULE_V == 2:
+        MAX_EXPOSURE_TIME = int(1000000 * 10)
+    elif CAM_MODULE_V == 1:
+        MAX_EXPOSURE_TIME = int(1000000 * .9)
+
+    picam2.configure(video_config)
+    startup.mark('camera_configured')
+
+    start_recording(video_profile)
+    startup.mark('camera_started')
+
+    if roi_name != 'full':
+        apply_roi(roi_name)  # Keep the region of interest across camera re-inits
+
+    if AUTO_TUNE and cached_profile is None:
+        video_profile = calibrate_video_profile(profile_key)
+    print(f"Live stream profile: {video_profile}")
+
+
+def apply_roi(name):
+    """Points the live stream at a preset region of interest, or back at the full view with 'full'."""
+    global roi_name, roi_crop
+    if name != 'full' and name not in ROI_PRESETS:
+        raise KeyError(name)
+    lores_w, lores_h = video_profile['lores_size']
+    crop = None
+    if ROI_METHOD == 'scaler':
+        _, maximum, default = picam2.camera_controls['ScalerCrop']
+        scaler_crop = default
+        if name != 'full':
+            x, y, width, height = fit_roi(ROI_PRESETS[name], maximum[2:], lores_w / lores_h)
+            scaler_crop = (maximum[0] + x, maximum[1] + y, width, height)
+        picam2.set_controls({'ScalerCrop': scaler_crop})
+    elif name != 'full':
+        crop = fit_roi(ROI_PRESETS[name], full_resolution, lores_w / lores_h)
+    roi_crop = crop
+    roi_name = name
+    print(f"Live stream region of interest: {name}")
+
+
+def set_roi(name, timeout=None):
+    """apply_roi once the camera is started, waiting for it at most timeout seconds if given (see wait_for_camera)."""
+    wait_for_camera(timeout)
+    apply_roi(name)
+
+
+def init_camera():
+    """Opens the camera; runs in its own thread at startup, overlapping with the imports and the Flask setup."""
+    global camera_error
+    try:
+        open_camera()
+    except Exception as e:
+        camera_error = e
+        print(f"Error initializing the camera: {e}")
+    finally:
+        camera_ready.set()
 
-if ROTATE_180:
-    video_config["transform"] = libcamera.Transform(hflip=1, vflip=1)
 
-picam2.configure(video_config)
-encoder = H264Encoder()
-output = StreamingOutput()
+def wait_for_camera(timeout=None):
+    """
+    Blocks until the camera is started, for at most timeout seconds if given. Raises TimeoutError if it isn't
+    started by then and RuntimeError if opening it failed.
+    """
+    if not camera_ready.wait(timeout):
+        raise TimeoutError("Camera not ready yet")
+    if camera_error is not None:
+        raise RuntimeError(f"Camera not available: {camera_error}")
+
+
+def reinit_camera():
+    """
+    Closes and reopens the camera and restarts recording, without restarting the process. Used by the supervisor
+    when a camera worker keeps stalling after being restarted, or when the camera failed to open at startup.
+    """
+    global camera_error
+    print("Re-initializing the camera...")
+    camera_ready.clear()
+    try:
+        if picam2 is not None:
+            try:
+                picam2.stop_recording()
+            except Exception as e:
+                print(f"Error stopping camera recording: {e}")
+            picam2.close()
+
+        open_camera()
+        camera_error = None
+        print("Camera re-initialized")
+    except Exception as e:
+        camera_error = e
+        raise
+    finally:
+        camera_ready.set()
 
-picam2.start_recording(encoder, FileOutput(output))
 
+camera_thread = Thread(target=init_camera, name='camera-init', daemon=True)
+camera_thread.start()
 
-def send_video_frames():
+
+# Flask and the sensor libraries are imported while the camera starts up
+from flask import Flask, Response, url_for, send_file, render_template, jsonify
+from werkzeug.serving import ThreadedWSGIServer
+
+from utils import read_sensor
+
+startup.mark('imports')
+
+app = Flask(__name__)
+
+
+def shutdown_server():
+    """
+    Initiates the shutdown process for the server and related threads.
+
+    This function signals all threads to stop, safely stops camera recording, and shuts down the Flask server.
+    """
+    print("Initiating shutdown...")
+
+    # Signal all threads to stop
+    shutdown_event.set()
+
+    # Safely stop camera recording
+    try:
+        picam2.stop_recording()
+        print("picamera stopped")
+    except Exception as e:
+        print(f"Error stopping camera recording: {e}")
+
+    # Get the current thread
+    current_thread = threading.current_thread()
+    print("Current thread: ", current_thread.name)
+
+    # No more restarts from here on
+    supervisor.stop()
+
+    # Shutdown the Flask server
+    if server is not None:
+        print("Shutting down server...")
+        server.shutdown()
+
+    # Wait for the workers to finish, skip if it's the current thread
+    supervisor.join_workers(timeout=10)
+
+    print("Shutdown complete.")
+    shutdown_complete.set()
+
+
+@app.route('/manual_shutdown')
+def manual_shutdown():
+    """
+    Flask route to manually initiate server shutdown.
+
+    This route triggers the shutdown of the server when accessed.
+
+    Returns:
+        str: A message indicating that the server is shutting down.
+    """
+    shutdown_server()
+    return 'Server shutting down...'
+
+
+@app.route('/complete_shutdown')
+def complete_shutdown():
+    """
+    This method exits the application sending a signal of 100, which in turn tells the main run app to stop re-executing
+    this program.
+    """
+    shutdown_server()
+    sys.exit(100)
+    return 'Server shutting down...'
+
+
+def capture_lores_jpeg(lores_encoder):
+    """
+    Captures the next lores frame and returns (JPEG buffer, SensorTimestamp of the frame in nanoseconds).
+
+    The camera buffer is read in place through MappedArray instead of being copied out with capture_array, and is
+    handed back to libcamera as soon as the colour conversion is done.
+    """
+    crop = roi_crop
+    request = picam2.capture_request()
+    try:
+        sensor_timestamp = request.get_metadata().get('SensorTimestamp', 0)
+        if crop is not None:
+            # Region of interest: scale the crop of the full-resolution frame down to the lores size
+            x, y, width, height = crop
+            with MappedArray(request, "main") as mapped:
+                return (lores_encoder.encode_scaled(mapped.array[y:y + height, x:x + width],
+                                                    video_profile['lores_size']), sensor_timestamp)
+        with MappedArray(request, "lores") as mapped:
+            return lores_encoder.encode(mapped.array), sensor_timestamp
+    finally:
+        request.release()
+
+
+# Receiver clock minus this sender's clock, from the pings on the sensor data connection
+receiver_clock = ClockOffsetEstimator()
+
+
+def frame_timing(sensor_timestamp):
+    """The timing prefix of a live frame about to be sent, so the receiver can measure its latency."""
+    sent_at = time.time()
+    return encode_frame_timing(sensor_timestamp, capture_wall_time(sensor_timestamp, sent_at), sent_at,
+                               receiver_clock.offset)
+
+
+def live_stream_limits():
+    """Frame rate (None for as fast as frames come) and JPEG quality of the live stream, within the governor's tier."""
+    limits = governor.limits
+    return cap(video_profile['fps'], limits.get('fps')), cap(video_profile['jpeg_quality'], limits.get('jpeg_quality'))
+
+
+def send_video_frames(worker):
     """
     Function to send video frames continuously
     """
     global receiver_ip
-    # Todo: try switching to UDP for faster data transfer and also send the pictures every 1 min alongside other data
-    while not shutdown_event.is_set():  # while True...
+    wait_for_camera()
+    lores_encoder = LoresJpegEncoder(quality=video_profile['jpeg_quality'])
+    next_frame_at = 0
+    use_udp = VIDEO_TRANSPORT == 'udp'
+    frame_seq = 0
+    while not worker.should_stop():  # while True...
+        worker.beat()
         try:
             # Resolve domain name to IP address
             if use_domain_name:
@@ -285,24 +576,37 @@ def send_video_frames():
             else:
                 receiver_ip = ip_address
 
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client_socket:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM if use_udp else socket.SOCK_STREAM) as client_socket:
                 client_socket.settimeout(30)
-                client_socket.connect((receiver_ip, VIDEO_PORT))
+                client_socket.connect((receiver_ip, VIDEO_PORT))  # For UDP this only sets the destination
                 print("")
-                print(f"Connected to video receiver at {receiver_ip}:{VIDEO_PORT}")
-
-                while not shutdown_event.is_set():  # while True:
-                    yuv420 = picam2.capture_array("lores")
-                    rgb = cv2.cvtColor(yuv420, cv2.COLOR_YUV2RGB_YV12)
-                    _, buffer = cv2.imencode('.jpg', rgb)
-                    frame = buffer.tobytes()
-
-                    # Send the sender's ID and frame together
-                    message = struct.pack("Q", len(sender_id_encoded)) + sender_id_encoded
-                    message += struct.pack("Q", len(frame)) + frame
-                    client_socket.sendall(message)
-
-                    if shutdown_event.is_set():
+                print(f"Connected to video receiver at {receiver_ip}:{VIDEO_PORT} ({VIDEO_TRANSPORT.upper()})")
+
+                while not worker.should_stop():  # while True:
+                    fps, lores_encoder.quality = live_stream_limits()
+                    frame_interval = 1 / fps if fps else 0
+                    if frame_interval:
+                        # Pace the stream to the profile's frame rate
+                        delay = next_frame_at - time.monotonic()
+                        if delay > 0:
+                            time.sleep(delay)
+                        next_frame_at = max(next_frame_at + frame_interval, time.monotonic())
+
+                    frame, sensor_timestamp = capture_lores_jpeg(lores_encoder)
+                    startup.mark('first_frame')
+
+                    timing = frame_timing(sensor_timestamp)
+                    if use_udp:
+                        send_frame_datagrams(client_socket, sender_id_encoded, frame_seq, frame, UDP_MAX_DATAGRAM,
+                                             prefix=timing)
+                        frame_seq = (frame_seq + 1) & 0xFFFFFFFF
+                    else:
+                        # Send the sender's ID and frame together, straight from the encoder's buffer
+                        send_id_and_payload(client_socket, sender_id_header, frame, prefix=timing)
+                    startup.mark('first_send')
+                    worker.beat()
+
+                    if worker.should_stop():
                         print("shutdown_event triggered in send_video_frames() (1)")
                         break
 
@@ -314,7 +618,7 @@ def send_video_frames():
             continue  # Continue in the event of a timeout
 
         # Check for shutdown event at a suitable place in your loop
-        if shutdown_event.is_set():
+        if worker.should_stop():
             print("shutdown_event triggered in send_video_frames() (2)")
             break
 
@@ -332,22 +636,108 @@ def sensor_data():
     return jsonify(data)
 
 
+@app.route('/health')
+def health():
+    """
+    Heartbeat age, deadline and restart count of every supervised worker, the startup phase timings and the live
+    stream profile in use.
+    """
+    return jsonify({'workers': supervisor.status(), 'startup': startup.as_dict(), 'video_profile': video_profile,
+                    'spool': still_spool.stats(), 'governor': governor.stats()})
+
+
+@app.route('/roi')
+def get_roi():
+    return jsonify({'roi': roi_name, 'method': ROI_METHOD, 'crop': roi_crop, 'presets': ROI_PRESETS})
+
+
+def requires_camera(route):
+    """Makes a route wait for the camera before it runs, answering 503 if the camera isn't available in time."""
+    @functools.wraps(route)
+    def wrapper(*args, **kwargs):
+        try:
+            wait_for_camera(CAMERA_WAIT_TIMEOUT)
+        except (TimeoutError, RuntimeError) as e:
+            return str(e), 503
+        return route(*args, **kwargs)
+    return wrapper
+
+
+@app.route('/roi/<preset>')
+@requires_camera
+def switch_roi(preset):
+    """Switches the live stream to a region of interest preset, or back to the full view with /roi/full."""
+    try:
+        set_roi(preset)
+    except KeyError:
+        return jsonify({'error': f"Unknown preset {preset}", 'presets': list(ROI_PRESETS)}), 404
+    return get_roi()
+
+
 @app.route('/stream')
+@requires_camera
 def stream():
     def generate():
+        lores_encoder = LoresJpegEncoder(quality=video_profile['jpeg_quality'])  # One per viewer, encoders keep per-thread buffers
+        next_frame_at = 0
         while True:
-            yuv420 = picam2.capture_array("lores")  # Capture YUV420 frame
-            rgb = cv2.cvtColor(yuv420, cv2.COLOR_YUV2RGB_YV12)  # Convert YUV to RGB
-            frame_encoded = cv2.imencode('.jpg', rgb)[1].tobytes()  # Encode as JPEG
+            fps, lores_encoder.quality = live_stream_limits()
+            if fps:
+                time.sleep(max(next_frame_at - time.monotonic(), 0))
+                next_frame_at = max(next_frame_at + 1 / fps, time.monotonic())
+            try:
+                wait_for_camera(CAMERA_WAIT_TIMEOUT)  # Rides out a camera re-init, ends the stream if it fails
+            except (TimeoutError, RuntimeError):
+                return
+            frame_encoded, _ = capture_lores_jpeg(lores_encoder)  # Capture YUV420 frame and encode as JPEG
 
             yield (b'--FRAME\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_encoded + b'\r\n')
+                   b'Content-Type: image/jpeg\r\n\r\n' + memoryview(frame_encoded) + b'\r\n')
 
     return Response(generate(),
                     mimetype='multipart/x-mixed-replace; boundary=FRAME')
 
 
+@app.route('/live')
+def live():
+    """Browser live view of the H.264 stream, falling back to the MJPEG stream where it can't play."""
+    return render_template('live.html')
+
+
+@app.route('/live.mp4')
+def live_mp4():
+    """The live H.264 stream as one endless fragmented MP4, starting at the newest keyframe."""
+    if live_segmenter.init is None:
+        return "Live stream not started yet", 503
+    return Response(live_segmenter.stream(), mimetype='video/mp4', headers={'Cache-Control': 'no-cache'})
+
+
+@app.route('/live/index.m3u8')
+def live_playlist():
+    playlist = live_segmenter.playlist()
+    if playlist is None:
+        return "Live stream not started yet", 503
+    return Response(playlist, mimetype='application/vnd.apple.mpegurl', headers={'Cache-Control': 'no-cache'})
+
+
+@app.route('/live/init.mp4')
+def live_init():
+    init = live_segmenter.init
+    if init is None:
+        return "Live stream not started yet", 503
+    return Response(init, mimetype='video/mp4', headers={'Cache-Control': 'no-cache'})
+
+
+@app.route('/live/<int:sequence>.m4s')
+def live_segment(sequence):
+    segment = live_segmenter.segment(sequence)
+    if segment is None:
+        return "Segment no longer available", 404
+    return Response(segment.data, mimetype='video/iso.segment')
+
+
 @app.route('/save_pic')
+@requires_camera
 def save_pic():
     # Ensure the 'static' folder exists
     if not os.path.exists('static'):
@@ -364,6 +754,7 @@ def save_pic():
 
 
 @app.route('/take_pic')
+@requires_camera
 def take_pic():
     # Request a capture
     request = picam2.capture_request()
@@ -378,7 +769,101 @@ def take_pic():
     return send_file(img_buffer, mimetype='image/jpeg')
 
 
+# Encoder threads for burst captures; JPEG encoding releases the GIL, so they run on all cores
+burst_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 2, thread_name_prefix='burst-encoder')
+burst_lock = threading.Lock()  # One burst at a time
+
+
+def encode_main_frame(frame, quality):
+    import cv2
+    # RGB888 main-stream frames are stored in BGR order, which is what OpenCV expects
+    _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer
+
+
+def capture_burst(count, quality=95, max_in_flight=None):
+    """
+    Captures count consecutive full-resolution frames and returns them as (JPEG as a numpy buffer, sensor timestamp)
+    pairs, in capture order.
+
+    Each camera request is released as soon as its pixels are copied out, so the camera keeps streaming, and the
+    copies are encoded in parallel on burst_pool. At most max_in_flight frames are captured but not yet encoded,
+    which caps the peak memory of a burst.
+    """
+    in_flight = threading.BoundedSemaphore(max_in_flight or burst_max_in_flight)
+
+    def encode(frame):
+        try:
+            return encode_main_frame(frame, quality)
+        finally:
+            in_flight.release()
+
+    with burst_lock:
+        futures = []
+        try:
+            for _ in range(count):
+                in_flight.acquire()
+                try:
+                    request = picam2.capture_request()
+                    try:
+                        frame = request.make_array("main")
+                        sensor_timestamp = request.get_metadata().get('SensorTimestamp', 0)
+                    finally:
+                        request.release()
+                    futures.append((burst_pool.submit(encode, frame), sensor_timestamp))
+                except BaseException:
+                    in_flight.release()
+                    raise
+        except BaseException:
+            wait([future for future, _ in futures])  # Let the encoders finish before the next burst can start
+            raise
+
+        # Results are collected in submission order, whatever order the encoders finish in
+        return [(future.result(), sensor_timestamp) for future, sensor_timestamp in futures]
+
+
+def spool_burst(count):
+    """
+    Captures a burst of count full-resolution stills (up to BURST_MAX_FRAMES) and spools them, so the backlog drain
+    uploads them to the receiver. Returns how many were spooled.
+    """
+    stills = capture_burst(max(1, min(count, BURST_MAX_FRAMES)), BURST_JPEG_QUALITY)
+    for jpeg, sensor_timestamp in stills:
+        captured_at = capture_wall_time(sensor_timestamp)
+        if math.isnan(captured_at):
+            captured_at = time.time()
+        still_spool.add(jpeg, captured_at, sensor_timestamp=sensor_timestamp)
+    spool_added.set()
+    return len(stills)
+
+
+@app.route('/burst/<int:count>')
+@requires_camera
+def burst(count):
+    """
+    Captures a burst of count full-resolution stills (up to BURST_MAX_FRAMES), saves them to static/bursts/ and
+    returns the saved paths, in capture order, with the timings.
+    """
+    count = max(1, min(count, BURST_MAX_FRAMES))
+    started = time.monotonic()
+    stills = capture_burst(count, BURST_JPEG_QUALITY)
+    elapsed = time.monotonic() - started
+
+    burst_directory = os.path.join('static', 'bursts', datetime.now().strftime("%d-%m-%Y_%H-%M-%S"))
+    os.makedirs(burst_directory, exist_ok=True)
+    files = []
+    for index, (jpeg, _) in enumerate(stills):
+        path = os.path.join(burst_directory, f'{index:03d}.jpg')
+        with open(path, 'wb') as f:
+            f.write(jpeg)
+        files.append(path)
+    print(f"Burst of {count} stills captured and encoded in {elapsed:.2f} s, saved to {burst_directory}")
+
+    return jsonify({'count': count, 'seconds': elapsed, 'fps': count / elapsed if elapsed else None, 'files': files})
+
+
 @app.route('/controls')
+@requires_camera
 def show_controls():
     # Capture the metadata from the camera
     metadata = picam2.capture_metadata()
@@ -392,6 +877,7 @@ def show_controls():
 
 
 @app.route('/set_controls/<int:exposure_time>')
+@requires_camera
 def set_controls(exposure_time):
     # WARNING: If a really high exposure value is passed (say 3000 up more or less) then the camera is not able to
     # go back to normal after it has been reset
@@ -427,6 +913,7 @@ def set_controls(exposure_time):
 
 
 @app.route('/reset')
+@requires_camera
 def reset():
     # Set the controls on the camera
     picam2.set_controls(initial_controls)
@@ -437,6 +924,7 @@ def reset():
 
 
 @app.route('/activate_long_exposure_mode')
+@requires_camera
 def activate_long_exposure_mode():
     # Create a dictionary with the desired controls
     controls = {
@@ -483,18 +971,22 @@ def create_directory():
     return path
 
 
-def measure_brightness(image_input):
+def measure_brightness(image_input, reduced=False):
     """
     Method to estimate the brightness of an image
     :param image_input:
+    :param reduced: decode JPEG input at 1/8 scale, much cheaper for a mean
     :return:
     """
+    import cv2
+
+    flag = cv2.IMREAD_REDUCED_COLOR_8 if reduced else cv2.IMREAD_COLOR
     # Check if the input is a string (path) or a BytesIO object
     if isinstance(image_input, str):  # It's a file path
-        img = cv2.imread(image_input, cv2.IMREAD_COLOR)
+        img = cv2.imread(image_input, flag)
     elif isinstance(image_input, io.BytesIO):  # It's a BytesIO object
         img_buffer = np.frombuffer(image_input.getbuffer(), dtype=np.uint8)
-        img = cv2.imdecode(img_buffer, cv2.IMREAD_COLOR)
+        img = cv2.imdecode(img_buffer, flag)
         image_input.seek(0)  # Reset buffer position
     else:
         raise ValueError("Unsupported input type")
@@ -504,7 +996,19 @@ def measure_brightness(image_input):
     return v.mean()  # Return the average brightness
 
 
-def take_timed_picture(save_to_disk: bool = False):
+def encode_scaled_still(request, scale):
+    """A timed still scaled down by the load governor: the main stream resized by scale and encoded as JPEG."""
+    import cv2
+    with MappedArray(request, "main") as mapped:
+        height, width = mapped.array.shape[:2]
+        size = (max(int(width * scale), 1), max(int(height * scale), 1))
+        scaled = cv2.resize(mapped.array, size, interpolation=cv2.INTER_AREA)
+    return encode_main_frame(scaled, STILL_JPEG_QUALITY)
+
+
+def take_timed_picture(worker, save_to_disk: bool = False):
+    wait_for_camera()
+
     # Brightness thresholds with hysteresis buffers
     LOW_BRIGHTNESS_THRESHOLD = 40
     BUFFER_LOW = 45
@@ -523,7 +1027,7 @@ def take_timed_picture(save_to_disk: bool = False):
 
     is_daylight_reset_done = False  # Flag to track if reset has been done during current daylight period
 
-    while not shutdown_event.is_set():  # while True:
+    while not worker.should_stop():  # while True:
         any_other_failure_condition = True
 
         # Take the picture
@@ -532,8 +1036,18 @@ def take_timed_picture(save_to_disk: bool = False):
         # Always capture the image to memory first
         try:
             request = picam2.capture_request()
-            request.save("main", img_buffer, format='jpeg')
-            request.release()
+            try:
+                sensor_timestamp = request.get_metadata().get('SensorTimestamp', 0)
+                still_scale = governor.limits.get('still_scale', 1)
+                if still_scale < 1:
+                    img_buffer.write(encode_scaled_still(request, still_scale))
+                else:
+                    request.save("main", img_buffer, format='jpeg')
+            finally:
+                request.release()  # Back to the camera whatever happened, or it runs out of buffers
+            captured_at = capture_wall_time(sensor_timestamp)
+            if math.isnan(captured_at):
+                captured_at = time.time()
             img_buffer.seek(0)
         except Exception as e:
             print(f"Error in image capture: {e}")
@@ -548,7 +1062,7 @@ def take_timed_picture(save_to_disk: bool = False):
                 f.write(img_buffer.getvalue())
             print(f"Image saved to disk at {full_path}")
 
-        brightness = measure_brightness(img_buffer)
+        brightness = measure_brightness(img_buffer, reduced=not governor.limits.get('analytics', True))
         print(f"Current brightness value: {brightness}")
         print(f"Current exposure_time: {exposure_time}")
 
@@ -604,6 +1118,13 @@ def take_timed_picture(save_to_disk: bool = False):
                 reset()
                 adjusted = False
 
+                # Something happened in the scene, catch it in a burst (unless the load governor is shedding work)
+                if BURST_ON_SCENE_CHANGE and governor.limits.get('analytics', True):
+                    try:
+                        print(f"Sudden brightness change, {spool_burst(BURST_ON_SCENE_CHANGE)} burst stills spooled")
+                    except Exception as e:
+                        print(f"Error in scene change burst: {e}")
+
         # Check for really high brightness values
         if brightness > 200:
             reset()
@@ -637,69 +1158,104 @@ def take_timed_picture(save_to_disk: bool = False):
         # Initialize a flag to check if the high-res picture was sent
         high_res_pic_sent = False
 
-        # Resolve domain name to IP address
-        if use_domain_name:
-            receiver_ip = socket.gethostbyname(domain_name)
-        else:
-            receiver_ip = ip_address
+        # Spool it first, so it is kept until the receiver has all of it, whatever happens to the upload
+        with img_buffer.getbuffer() as pic_data:
+            still = still_spool.add(pic_data, captured_at, claim=True, sensor_timestamp=sensor_timestamp)
 
+        live_upload.set()  # The backlog drain steps aside until this one is sent
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as pic_socket:
-                if shutdown_event.is_set():
-                    print("shutdown_event triggered in take_timed_picture() (1)")
-                    break
-                pic_socket.settimeout(30)  # Set a timeout for connection
-                pic_socket.connect((receiver_ip, HIGH_RES_PIC_PORT))
-
-                print("")
-                print(f"Connected to image receiver at {receiver_ip}:{HIGH_RES_PIC_PORT}")
-
-                # Send the picture
-                img_buffer.seek(0)  # Reset the buffer position to the start
-                pic_data = img_buffer.read()
-                print("High-resolution picture ready.")
-
-                # Combine ID and picture into a single message
-                message = struct.pack("Q", len(sender_id_encoded)) + sender_id_encoded
-                message += struct.pack("Q", len(pic_data)) + pic_data
-
-                # Send the combined message
-                pic_socket.sendall(message)
-                print("High-resolution picture sent.")
-                high_res_pic_sent = True
-
-                # total_length = len(pic_data)
-                # pic_socket.sendall(struct.pack("Q", total_length))
-                # # Send the picture in chunks
-                # chunk_size = 1024  # You can adjust this size
-                # for i in range(0, total_length, chunk_size):
-                #     pic_socket.sendall(pic_data[i:i + chunk_size])
-                # print("High-resolution picture sent.")
-                # high_res_pic_sent = True
+            if worker.should_stop():
+                print("shutdown_event triggered in take_timed_picture() (1)")
+                break
 
+            print("High-resolution picture ready.")
+            send_spooled_still(still_spool, still, resolve_receiver, HIGH_RES_PIC_PORT, sender_id, SPOOL_CHUNK_SIZE,
+                               clock_offset=known_clock_offset())
+            print("High-resolution picture sent.")
+            high_res_pic_sent = True
 
+        except socket.gaierror as e:
+            print(f"Could not resolve the receiver: {e}. Kept in the spool.")
         except TimeoutError as e:
-            print(f"High-res picture connection timed out: {e}. Retrying...")
-        except (ConnectionRefusedError, ConnectionResetError, BrokenPipeError) as e:
-            print(f"High-res picture connection lost: {e}. Retrying...")
+            print(f"High-res picture connection timed out: {e}. Kept in the spool.")
+        except (ConnectionError, ValueError) as e:
+            print(f"High-res picture connection lost: {e}. Kept in the spool.")
         except Exception as e:
             print(f"Unexpected error in High-res picture connection: {e}")
+        finally:
+            live_upload.clear()
+            still_spool.release(still)
 
         # Update the heartbeat
         if high_res_pic_sent or not any_other_failure_condition:
-            watchdog.update_heartbeat()
+            worker.beat()
 
         # Sleep in smaller increments to allow for shutdown check
         print("Sleeping for the next ", str(SLEEP_TIME), " seconds... \n")
         for _ in range(SLEEP_TIME):  # Assuming you want to sleep for 60 seconds
             time.sleep(1)
-            if shutdown_event.is_set():
+            if worker.should_stop():
                 print("shutdown_event triggered in save_pic_every_minute() (2)")
                 break
 
     print("save_pic_every_minute thread is shutting down")
 
 
+def govern_load(worker):
+    """Takes the temperature, throttle flag and CPU load readings of the load governor every GOVERNOR_INTERVAL seconds."""
+    import psutil
+    psutil.cpu_percent()  # Starts the measurement, every call returns the load since the previous one
+    while not worker.should_stop():
+        worker.beat()
+        for _ in range(GOVERNOR_INTERVAL):
+            time.sleep(1)
+            if worker.should_stop():
+                break
+        governor.update(read_soc_temperature(), psutil.cpu_percent(), read_throttle_flags())
+
+    print("govern_load thread is shutting down")
+
+
+def resolve_receiver():
+    """The receiver's IP address, looked up from domain_name if set to. Raises socket.gaierror if that fails."""
+    return socket.gethostbyname(domain_name) if use_domain_name else ip_address
+
+
+def drain_spool(worker):
+    """
+    Uploads the spooled stills left over from failed uploads, oldest first, at no more than SPOOL_DRAIN_RATE
+    bytes per second and pausing while a timed still is being uploaded.
+    """
+    while not worker.should_stop():
+        worker.beat()
+        still = still_spool.claim_oldest()
+        if still is None:
+            for _ in range(SPOOL_DRAIN_INTERVAL):
+                if spool_added.wait(1):
+                    break
+                worker.beat()
+                if worker.should_stop():
+                    break
+            spool_added.clear()
+            continue
+
+        try:
+            send_spooled_still(still_spool, still, resolve_receiver, HIGH_RES_PIC_PORT, sender_id, SPOOL_CHUNK_SIZE,
+                               max_rate=SPOOL_DRAIN_RATE, pause_event=live_upload, progress=worker.beat,
+                               clock_offset=known_clock_offset())
+            print(f"Spooled still {still.upload_id} sent ({len(still_spool.pending())} left)")
+
+        except (OSError, ValueError) as e:
+            print(f"Spooled still upload failed: {e}. Retrying in {SPOOL_DRAIN_INTERVAL} seconds...")
+            for _ in range(SPOOL_DRAIN_INTERVAL):
+                time.sleep(1)
+                worker.beat()
+                if worker.should_stop():
+                    break
+
+    print("drain_spool thread is shutting down")
+
+
 def get_cpu_temp():
     # For Raspberry Pi
     try:
@@ -710,6 +1266,7 @@ def get_cpu_temp():
 
 
 def get_system_uptime():
+    import psutil
     try:
         boot_time = datetime.fromtimestamp(psutil.boot_time())
         now = datetime.now()
@@ -721,25 +1278,113 @@ def get_system_uptime():
 
 
 def get_used_ram():
+    import psutil
     ram = psutil.virtual_memory()
     return ram.used / (1024 ** 2)  # MB
 
 
 def get_used_disk():
+    import psutil
     disk = psutil.disk_usage('/')
     return disk.used / (1024 ** 3)  # GB
 
 
-def send_data():
-    while not shutdown_event.is_set():  # while True...
+def collect_sensor_data():
+    send_data_dict = read_sensor()
+    # Add additional data
+    send_data_dict['cpu_temp'] = get_cpu_temp()
+    send_data_dict['system_uptime'] = get_system_uptime()
+    send_data_dict['used_ram'] = get_used_ram()
+    send_data_dict['used_disk'] = get_used_disk()
+    send_data_dict['datetime'] = datetime.now().isoformat()
+    # Time from process start to the first video frame sent, constant for a run: charts cold starts over restarts
+    send_data_dict['startup_first_send'] = startup.phases.get('first_send')
+    send_data_dict['roi'] = roi_name
+    # Load governor tier and firmware throttle flags, to tell thermal trouble from network trouble on the receiver
+    send_data_dict['governor_tier'] = governor.limits['name']
+    send_data_dict['throttle_flags'] = governor.readings['throttle_flags']
+    return send_data_dict
 
-        # Resolve domain name to IP address
-        if use_domain_name:
-            receiver_ip = socket.gethostbyname(domain_name)
-        else:
-            receiver_ip = ip_address
 
+# Sensor samples not yet acknowledged by the receiver. Sampling carries on while disconnected, and the backlog is
+# flushed in a few messages once the link is back. Module level, so it outlives restarts of the send_data worker.
+pending_samples = deque(maxlen=SENSOR_BUFFER_MAX)
+
+
+def flush_sensor_samples(sensor_socket, pending_samples):
+    """
+    Sends the buffered samples in batches of up to SENSOR_MAX_BATCH, oldest first. Samples are only removed from
+    the buffer once the receiver acknowledges them, so nothing is lost if the connection drops mid-flush.
+    """
+    while pending_samples:
+        batch = list(itertools.islice(pending_samples, SENSOR_MAX_BATCH))
+        sensor_socket.sendall(encode_sensor_batch(sender_id, batch))
+        accepted = read_ack(sensor_socket, handle_control)
+        if accepted != len(batch):
+            raise ConnectionError(f"Receiver acknowledged {accepted} of {len(batch)} samples")
+        for _ in batch:
+            pending_samples.popleft()
+
+        print(f"Sensor data sent... ({len(batch)} samples)")
+        print(batch[-1])
+
+
+def handle_control(commands):
+    """Applies a CONTROL message from the receiver."""
+    if 'roi' in commands:
+        # Bounded, so a camera re-init or failure doesn't hold up the sensor worker
         try:
+            set_roi(commands['roi'], CAMERA_WAIT_TIMEOUT)
+        except (KeyError, RuntimeError, TimeoutError) as e:
+            print(f"Receiver asked for an unavailable region of interest: {e!r}")
+
+
+def wait_for_control(sensor_socket, timeout):
+    """Waits up to timeout seconds, applying the CONTROL messages the receiver sends meanwhile."""
+    readable, _, _ = select.select([sensor_socket], [], [], timeout)
+    if readable:
+        msg_type, _, body = read_message(sensor_socket)
+        if msg_type != MSG_CONTROL:
+            raise ConnectionError(f"Unexpected message type {msg_type} from the receiver")
+        handle_control(json.loads(body))
+
+
+def known_clock_offset():
+    """The receiver clock offset estimate, or None before the first ping was answered."""
+    offset = receiver_clock.offset
+    return None if math.isnan(offset) else offset
+
+
+def ping_receiver(sensor_socket):
+    """Times one PING/PONG round trip and adds it to the receiver clock offset estimate."""
+    sent_at = time.time()
+    sensor_socket.sendall(encode_ping(sent_at))
+    echoed_at, receiver_time = read_pong(sensor_socket, handle_control)
+    received_at = time.time()
+    if echoed_at == sent_at:
+        receiver_clock.add(sent_at, receiver_time, received_at)
+
+
+def send_data(worker):
+    next_sample_at = 0
+
+    def sample_if_due():
+        nonlocal next_sample_at
+        if time.monotonic() >= next_sample_at:
+            pending_samples.append(collect_sensor_data())
+            next_sample_at = time.monotonic() + SLEEP_TIME
+
+    while not worker.should_stop():  # while True...
+        worker.beat()
+        sample_if_due()
+
+        try:
+            # Resolve domain name to IP address
+            if use_domain_name:
+                receiver_ip = socket.gethostbyname(domain_name)
+            else:
+                receiver_ip = ip_address
+
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sensor_socket:
                 sensor_socket.settimeout(30)  # Set a timeout for the connection, time in seconds
                 sensor_socket.connect((receiver_ip, DATA_PORT))
@@ -747,84 +1392,92 @@ def send_data():
                 print("")
                 print(f"Connected to data receiver at {receiver_ip}:{DATA_PORT}")
 
-                while not shutdown_event.is_set():  # while True...
-                    send_data_dict = read_sensor()
-                    # Add additional data
-                    send_data_dict['cpu_temp'] = get_cpu_temp()
-                    send_data_dict['system_uptime'] = get_system_uptime()
-                    send_data_dict['used_ram'] = get_used_ram()
-                    send_data_dict['used_disk'] = get_used_disk()
-                    send_data_dict['datetime'] = datetime.now().isoformat()
-
-                    # Include the sender's identifier
-                    send_data_dict['sender_id'] = sender_id
-
-                    sensor_socket.sendall(json.dumps(send_data_dict).encode())
-                    print("Sensor data sent...")
-                    print(send_data_dict)
-                    for _ in range(SLEEP_TIME):  # Assuming you want to sleep for X seconds
-                        time.sleep(1)
-                        if shutdown_event.is_set():
+                while not worker.should_stop():  # while True...
+                    sample_if_due()
+                    flush_sensor_samples(sensor_socket, pending_samples)
+                    ping_receiver(sensor_socket)
+                    worker.beat()
+
+                    while time.monotonic() < next_sample_at:  # Sleep until the next sample is due
+                        wait_for_control(sensor_socket, 1)
+                        worker.beat()
+                        if worker.should_stop():
                             print("shutdown_event triggered in send_data() (1)")
                             break
 
         except TimeoutError as e:
-            print(f"Sensor data connection timed out: {e}. Retrying...")
+            print(f"Sensor data connection timed out: {e}. Retrying... ({len(pending_samples)} samples buffered)")
             time.sleep(5)  # Wait before retrying
 
-        except (ConnectionRefusedError, ConnectionResetError, BrokenPipeError) as e:
-            print(f"Sensor data connection lost: {e}. Retrying...")
+        except (ConnectionError, socket.gaierror) as e:
+            print(f"Sensor data connection lost: {e}. Retrying... ({len(pending_samples)} samples buffered)")
             time.sleep(5)  # Wait before retrying
 
         except Exception as e:
-            print(f"Unexpected error in sending sensor data: {e}")
+            # The supervisor restarts the worker, the buffered samples are kept for it
+            print(f"Unexpected error in sending sensor data: {e} ({len(pending_samples)} samples buffered)")
             #time.sleep(5)  # Wait before retrying
             break
 
         except socket.timeout:
             continue  # Continue in the event of a timeout
 
-        if shutdown_event.is_set():
+        if worker.should_stop():
             break
 
     print("send_sensor_data thread is shutting down")
-    # Todo: check why it does not reestablishes connection after it is lost.
 
 
-if __name__ == '__main__':
-    # Watchdog start
-    watchdog_timeout = settings.watchdog_timeout
-    watchdog = WatchdogTimer(watchdog_timeout, reset_callback=shutdown_server, shutdown_event=shutdown_event)
-    watchdog.daemon = True
-    watchdog.start()
-    print(watchdog.name, " : watchdog thread started")
-
-    # Start thread to send data
-    send_data_thread = Thread(target=send_data)
-    send_data_thread.daemon = True
-    send_data_thread.start()
-    print(send_data_thread.name, " : sensor_thread started")
-
-    # Start the thread to save pictures every minute
-    thread = Thread(target=take_timed_picture, args=(SAVE_TO_DISK,))
-    thread.daemon = True  # This ensures the thread will be stopped when the main program finishes
-    thread.start()
-    print(thread.name, " : send_timed_image thread started")
-
-    # Start thread to send video
-    video_thread = Thread(target=send_video_frames)
-    video_thread.daemon = True
-    video_thread.start()
-    print(video_thread.name, " : video_thread started")
+class SupervisedWSGIServer(ThreadedWSGIServer):
+    """ThreadedWSGIServer that reports a heartbeat on every pass of its accept loop (every 0.5 s when idle)."""
+
+    def __init__(self, host, port, app, heartbeat):
+        super().__init__(host, port, app)
+        self.heartbeat = heartbeat
+
+    def service_actions(self):
+        super().service_actions()
+        self.heartbeat()
+
+
+server = None
+
+
+def serve_http(worker):
+    global server
+    if server is not None:
+        # A previous serving loop stalled; free the port for the new server
+        server.server_close()
 
     # Create a server instance with threaded support
-    server = ThreadedWSGIServer('0.0.0.0', 8000, app)
+    server = SupervisedWSGIServer('0.0.0.0', 8000, app, heartbeat=worker.beat)
 
     # Set SO_REUSEADDR option
     server.socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    startup.mark('http_listening')
+
+    server.serve_forever()
+    print("HTTP server is shutting down")
+
+
+if __name__ == '__main__':
+    # Every worker gets its own heartbeat and deadline; a stalled one is restarted on its own, with a camera
+    # re-init and a process restart (through run.py) as the last resorts
+    supervisor = Supervisor(shutdown_event, fatal_callback=shutdown_server, max_restarts=WORKER_MAX_RESTARTS,
+                            restart_window=WORKER_RESTART_WINDOW)
+    supervisor.add('sensor', send_data, deadline=SENSOR_WORKER_DEADLINE)
+    supervisor.add('stills', take_timed_picture, deadline=settings.watchdog_timeout, args=(SAVE_TO_DISK,),
+                   recover=reinit_camera)
+    supervisor.add('video', send_video_frames, deadline=VIDEO_WORKER_DEADLINE, recover=reinit_camera)
+    supervisor.add('spool', drain_spool, deadline=SPOOL_WORKER_DEADLINE)
+    if GOVERNOR_TIERS:
+        supervisor.add('governor', govern_load, deadline=GOVERNOR_INTERVAL * 3 + 30)
+    supervisor.add('http', serve_http, deadline=HTTP_WORKER_DEADLINE)
+    supervisor.start()
 
     try:
-        server.serve_forever()
+        while not shutdown_complete.wait(1):
+            pass
     except KeyboardInterrupt:
         print("KeyboardInterrupt received, shutting down the server")
         shutdown_server()
@@ -835,4 +1488,4 @@ if __name__ == '__main__':
             picam2.stop_recording()
         except Exception as e:
             print(f"Error stopping camera recording during final cleanup: {e}")
-        watchdog.stop()
+        supervisor.stop()
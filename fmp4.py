@@ -0,0 +1,247 @@
+"""
+Fragmented MP4 packaging of the camera's hardware H.264 stream, for live viewing in a browser.
+
+The encoder delivers one access unit per frame as an Annex B byte stream (start-code separated NAL units, SPS and
+PPS repeated before every keyframe). Frames are collected from one keyframe to the next and each group is written
+as one fragment, a moof box describing the samples followed by an mdat box holding them, with the NAL units
+length-prefixed as MP4 requires. The parameter sets go once into the initialization segment (ftyp + moov).
+
+The newest fragments are kept in a small in-memory window, which serves both an HLS playlist of fMP4 segments and
+a single endless fragmented MP4 stream.
+"""
+
+import math
+import struct
+import threading
+import time
+from collections import deque
+
+
+TIMESCALE = 90000  # Ticks per second of the sample timestamps, the usual one for video
+
+NAL_SPS = 7
+NAL_PPS = 8
+NAL_AUD = 9
+
+MATRIX = struct.pack('>9I', 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000)
+KEYFRAME_FLAGS = 0x02000000  # Depends on no other sample
+DELTA_FRAME_FLAGS = 0x01010000  # Depends on others, not a sync sample
+
+
+def box(kind, *payloads):
+    data = b''.join(payloads)
+    return struct.pack('>I4s', 8 + len(data), kind) + data
+
+
+def full_box(kind, version, flags, *payloads):
+    return box(kind, struct.pack('>I', version << 24 | flags), *payloads)
+
+
+def split_nal_units(data):
+    """The NAL units of an Annex B byte stream, without their start codes."""
+    data = bytes(data)
+    units = []
+    start = data.find(b'\0\0\1')
+    while start != -1:
+        start += 3
+        end = data.find(b'\0\0\1', start)
+        # A NAL unit never ends in a zero byte, those belong to the next 4-byte start code
+        unit = data[start:end if end != -1 else len(data)].rstrip(b'\0')
+        if unit:
+            units.append(unit)
+        start = end
+    return units
+
+
+def avc_config(sps, pps):
+    """The avcC box: profile and level come from the SPS, lengths are prefixed with 4 bytes."""
+    config = (bytes([1, sps[1], sps[2], sps[3], 0xFF, 0xE1]) + struct.pack('>H', len(sps)) + sps
+              + b'\1' + struct.pack('>H', len(pps)) + pps)
+    if sps[1] in (100, 110, 122, 144):
+        config += bytes([0xFC | 1, 0xF8, 0xF8, 0])  # 4:2:0, 8 bit, no SPS extensions
+    return box(b'avcC', config)
+
+
+def init_segment(sps, pps, width, height):
+    """ftyp + moov of a single H.264 video track, with an mvex box announcing fragments."""
+    avc1 = box(b'avc1', b'\0' * 6, struct.pack('>H', 1), b'\0' * 16,
+               struct.pack('>HHIIIH', width, height, 0x00480000, 0x00480000, 0, 1), b'\0' * 32,
+               struct.pack('>Hh', 0x18, -1), avc_config(sps, pps))
+    stbl = box(b'stbl',
+               full_box(b'stsd', 0, 0, struct.pack('>I', 1), avc1),
+               full_box(b'stts', 0, 0, struct.pack('>I', 0)),
+               full_box(b'stsc', 0, 0, struct.pack('>I', 0)),
+               full_box(b'stsz', 0, 0, struct.pack('>II', 0, 0)),
+               full_box(b'stco', 0, 0, struct.pack('>I', 0)))
+    minf = box(b'minf',
+               full_box(b'vmhd', 0, 1, struct.pack('>4H', 0, 0, 0, 0)),
+               box(b'dinf', full_box(b'dref', 0, 0, struct.pack('>I', 1), full_box(b'url ', 0, 1))),
+               stbl)
+    mdia = box(b'mdia',
+               full_box(b'mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, TIMESCALE, 0, 0x55C4, 0)),  # Language 'und'
+               full_box(b'hdlr', 0, 0, struct.pack('>I4s12x', 0, b'vide'), b'VideoHandler\0'),
+               minf)
+    trak = box(b'trak',
+               full_box(b'tkhd', 0, 3, struct.pack('>IIIII', 0, 0, 1, 0, 0), b'\0' * 8,
+                        struct.pack('>hhhH', 0, 0, 0, 0), MATRIX, struct.pack('>II', width << 16, height << 16)),
+               mdia)
+    moov = box(b'moov',
+               full_box(b'mvhd', 0, 0, struct.pack('>IIIIIH', 0, 0, TIMESCALE, 0, 0x00010000, 0x0100), b'\0' * 10,
+                        MATRIX, b'\0' * 24, struct.pack('>I', 2)),
+               trak,
+               box(b'mvex', full_box(b'trex', 0, 0, struct.pack('>5I', 1, 1, 0, 0, 0))))
+    return box(b'ftyp', b'isom', struct.pack('>I', 0x200), b'isom', b'iso6', b'avc1', b'mp41') + moov
+
+
+def media_segment(sequence, base_decode_time, samples):
+    """
+    moof + mdat of one fragment. samples is a list of (duration in TIMESCALE ticks, length-prefixed sample data,
+    keyframe).
+    """
+    def moof(data_offset):
+        trun = full_box(b'trun', 0, 0x000701, struct.pack('>Ii', len(samples), data_offset),
+                        *[struct.pack('>III', duration, len(data), KEYFRAME_FLAGS if keyframe else DELTA_FRAME_FLAGS)
+                          for duration, data, keyframe in samples])
+        traf = box(b'traf',
+                   full_box(b'tfhd', 0, 0x020000, struct.pack('>I', 1)),  # Offsets are relative to the moof
+                   full_box(b'tfdt', 1, 0, struct.pack('>Q', base_decode_time)),
+                   trun)
+        return box(b'moof', full_box(b'mfhd', 0, 0, struct.pack('>I', sequence)), traf)
+
+    # The sample data starts right after the moof and the mdat header; the moof size doesn't depend on the offset
+    header = moof(len(moof(0)) + 8)
+    return header + box(b'mdat', *[data for _, data, _ in samples])
+
+
+class Segment:
+    __slots__ = ('sequence', 'duration', 'data')
+
+    def __init__(self, sequence, duration, data):
+        self.sequence = sequence
+        self.duration = duration  # Seconds
+        self.data = data
+
+
+class LiveSegmenter:
+    """
+    Turns encoded frames into fMP4 segments, one per group of pictures, keeping the newest window of them.
+    Frames before the first keyframe are dropped. A segment is also cut after max_segment_frames frames, in case
+    the encoder sends keyframes further apart than expected.
+    """
+
+    def __init__(self, window=6, max_segment_frames=300):
+        self.window = window
+        self.max_segment_frames = max_segment_frames
+        self.condition = threading.Condition()
+        self.reset((0, 0))
+
+    def reset(self, size):
+        """Starts over for a new stream of the given (width, height), e.g. after the camera was reconfigured."""
+        with self.condition:
+            self.width, self.height = size
+            self.sps = self.pps = None
+            self.init = None
+            self.segments = deque(maxlen=self.window)
+            self.sequence = 0
+            self.pending = []  # (timestamp, sample data, keyframe) of the segment being built
+            self.first_timestamp = None
+            self.last_duration = TIMESCALE // 30
+            self.condition.notify_all()
+
+    def add_frame(self, frame, keyframe, timestamp=None):
+        """Adds one encoded frame (Annex B). timestamp is in microseconds, the time of arrival if not given."""
+        timestamp = time.monotonic_ns() // 1000 if timestamp is None else timestamp
+        sps = pps = None
+        sample = []
+        for unit in split_nal_units(frame):
+            unit_type = unit[0] & 0x1F
+            if unit_type == NAL_SPS:
+                sps = unit
+            elif unit_type == NAL_PPS:
+                pps = unit
+            elif unit_type != NAL_AUD:
+                sample.append(struct.pack('>I', len(unit)) + unit)
+        sample = b''.join(sample)
+
+        with self.condition:
+            if keyframe and sps and pps and (sps, pps) != (self.sps, self.pps):
+                if self.init is not None:
+                    self.reset((self.width, self.height))  # New parameter sets, players need a new init segment
+                self.sps, self.pps = sps, pps
+                self.init = init_segment(sps, pps, self.width, self.height)
+            if self.init is None or (not self.pending and not keyframe):
+                return
+
+            if self.pending and (keyframe or len(self.pending) >= self.max_segment_frames):
+                self._cut(timestamp)
+            self.pending.append((timestamp, sample, keyframe))
+
+    def _cut(self, next_timestamp):
+        if self.first_timestamp is None:
+            self.first_timestamp = self.pending[0][0]
+        timestamps = [timestamp for timestamp, _, _ in self.pending] + [next_timestamp]
+        samples = []
+        for index, (_, data, keyframe) in enumerate(self.pending):
+            duration = (timestamps[index + 1] - timestamps[index]) * TIMESCALE // 1000000
+            if duration <= 0:
+                duration = self.last_duration
+            self.last_duration = duration
+            samples.append((duration, data, keyframe))
+
+        self.sequence += 1
+        base_decode_time = (self.pending[0][0] - self.first_timestamp) * TIMESCALE // 1000000
+        data = media_segment(self.sequence, base_decode_time, samples)
+        duration = sum(duration for duration, _, _ in samples) / TIMESCALE
+        self.segments.append(Segment(self.sequence, duration, data))
+        self.pending = []
+        self.condition.notify_all()
+
+    def segment(self, sequence):
+        with self.condition:
+            for segment in self.segments:
+                if segment.sequence == sequence:
+                    return segment
+        return None
+
+    def playlist(self, segment_url='{}.m4s', init_url='init.mp4'):
+        """HLS media playlist of the segments in the window, or None before the first one is complete."""
+        with self.condition:
+            segments = list(self.segments)
+        if not segments:
+            return None
+        lines = ['#EXTM3U', '#EXT-X-VERSION:7',
+                 f'#EXT-X-TARGETDURATION:{math.ceil(max(segment.duration for segment in segments))}',
+                 f'#EXT-X-MEDIA-SEQUENCE:{segments[0].sequence}', f'#EXT-X-MAP:URI="{init_url}"']
+        for segment in segments:
+            lines += [f'#EXTINF:{segment.duration:.3f},', segment_url.format(segment.sequence)]
+        return '\n'.join(lines) + '\n'
+
+    def wait_newer(self, sequence, timeout=None):
+        """Blocks until a segment after sequence is available. Returns it, or None on timeout or a stream reset."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.segments and self.segments[-1].sequence > sequence
+                                    or self.sequence < sequence, timeout)
+            for segment in self.segments:
+                if segment.sequence > sequence:
+                    return segment
+        return None
+
+    def stream(self, timeout=10):
+        """
+        Yields an endless fragmented MP4: the init segment, then the newest complete segment and every one after.
+        Ends when the stream is reset or no segment comes within timeout seconds.
+        """
+        with self.condition:
+            init = self.init
+            sequence = self.segments[-1].sequence - 1 if self.segments else 0
+        if init is None:
+            return
+        yield init
+        while True:
+            segment = self.wait_newer(sequence, timeout)
+            if segment is None or self.init is not init:
+                return
+            if segment.sequence != sequence + 1:
+                return  # Fell behind the window, the player must reconnect
+            sequence = segment.sequence
+            yield segment.data
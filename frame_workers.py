@@ -0,0 +1,275 @@
+"""
+Worker processes for the receiver's CPU-bound frame work: decoding and scaling live frames into mosaic tiles and
+decoding the activity thumbnails of stills. Each worker is a separate Python process, so this work scales with the
+cores instead of sharing the receiver's GIL.
+
+Every worker owns a multiprocessing.shared_memory block split into fixed-size slots. To hand it a job, the receiver
+copies the JPEG into a free slot and writes a small fixed-size header to the worker's stdin:
+
+    [job id, uint64][kind, uint8][slot, uint16][length, uint32][4 int32 arguments]
+
+The worker decodes the JPEG in place, writes its result array back into the same slot and answers on its stdout:
+
+    [job id, uint64][ok, uint8][busy seconds, double][result shape, 3 x uint32][source width, height, 2 x uint32]
+
+all big endian, so frame bytes are never pickled or piped. Jobs are sharded by sender id: a sender's jobs always go
+to the same worker and run in order, and a burst from one camera only queues behind itself.
+
+The workers are started with subprocess rather than multiprocessing, which would import the receiver script again
+in every worker, its threads and database included.
+"""
+
+import itertools
+import os
+import queue
+import struct
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from multiprocessing import resource_tracker, shared_memory
+
+import cv2
+import numpy as np
+
+
+JOB_HEADER = struct.Struct("!QBHI4i")
+RESULT_HEADER = struct.Struct("!QBd3I2I")
+
+KIND_TILE = 1  # Arguments: tile width, tile height, cv2.imread flag
+KIND_THUMBNAIL = 2  # Arguments: thumbnail width, height
+
+
+def fit_tile(jpeg, tile_w, tile_h, flag=cv2.IMREAD_COLOR):
+    """
+    Decodes a frame with the given imread flag and scales it to fit a tile, keeping its aspect ratio.
+    Returns (image, (width, height) of the frame at full scale, or None if decoded reduced), or (None, None).
+    """
+    image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), flag)
+    if image is None:
+        return None, None
+    source_size = (image.shape[1], image.shape[0]) if flag == cv2.IMREAD_COLOR else None
+    scale = min(tile_w / image.shape[1], tile_h / image.shape[0])
+    fit_w, fit_h = max(int(image.shape[1] * scale), 1), max(int(image.shape[0] * scale), 1)
+    return cv2.resize(image, (fit_w, fit_h), interpolation=cv2.INTER_AREA), source_size
+
+
+def run_job(kind, data, args):
+    """Runs one job on a JPEG buffer. Returns (result array or None, source size or None)."""
+    if kind == KIND_TILE:
+        return fit_tile(data, args[0], args[1], args[2])
+    if kind == KIND_THUMBNAIL:
+        from activity_index import thumbnail
+        return thumbnail(data, (args[0], args[1])), None
+    raise ValueError(f"Unknown job kind {kind}")
+
+
+def read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) < size:
+        raise EOFError
+    return data
+
+
+def worker_main(shm_name, slot_size):
+    """Serves jobs from stdin until it closes. Runs in the worker process."""
+    results = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    sys.stdout = sys.stderr  # Prints go to the log, stdout carries the results
+    jobs = sys.stdin.buffer
+    shm = shared_memory.SharedMemory(name=shm_name)
+    # Attaching registers the block with this process's resource tracker, which would unlink it when the worker
+    # exits; it belongs to the receiver
+    resource_tracker.unregister(shm._name, 'shared_memory')
+
+    while True:
+        try:
+            job_id, kind, slot, length, *args = JOB_HEADER.unpack(read_exactly(jobs, JOB_HEADER.size))
+        except EOFError:
+            break
+
+        started = time.perf_counter()
+        data = np.ndarray((length,), dtype=np.uint8, buffer=shm.buf, offset=slot * slot_size)
+        shape = (0, 0, 0)
+        source_size = (0, 0)
+        try:
+            result, source = run_job(kind, data, args)
+            if result is not None:
+                if result.nbytes > slot_size:
+                    raise ValueError(f"Result of {result.nbytes} bytes does not fit a slot")
+                np.ndarray(result.shape, dtype=np.uint8, buffer=shm.buf, offset=slot * slot_size)[...] = result
+                shape = result.shape + (0,) * (3 - result.ndim)
+                source_size = source or (0, 0)
+            ok = 1
+        except Exception as e:
+            print(f"Frame worker {os.getpid()} failed on job {job_id}: {e!r}")
+            ok = 0
+        del data
+
+        results.write(RESULT_HEADER.pack(job_id, ok, time.perf_counter() - started, *shape, *source_size))
+        results.flush()
+
+
+class WorkerProcess:
+    def __init__(self, index, slots, slot_size):
+        self.index = index
+        self.slot_size = slot_size
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        self.slots = slots
+        self.free_slots = queue.Queue()
+        self.in_flight = {}  # {job id: (future, slot)}
+        self.lock = threading.Lock()  # Serializes writes to the worker's stdin
+        self.process = None
+        self.jobs = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.restarts = 0
+        self.started_at = None
+
+    def start(self):
+        self.free_slots = queue.Queue()
+        for slot in range(self.slots):
+            self.free_slots.put(slot)
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), self.shm.name,
+                                         str(self.slot_size)], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.started_at = time.monotonic()
+        threading.Thread(target=self._read_results, args=(self.process,), name=f'frame-worker-{self.index}',
+                         daemon=True).start()
+
+    def submit(self, job_id, kind, data, args):
+        """Copies data to a free slot and queues the job. Returns a Future, or None if no slot is free."""
+        try:
+            slot = self.free_slots.get_nowait()
+        except queue.Empty:
+            return None
+
+        data = memoryview(data).cast('B')
+        args = tuple(args) + (0,) * (4 - len(args))
+        self.shm.buf[slot * self.slot_size:slot * self.slot_size + len(data)] = data
+        future = Future()
+        with self.lock:
+            self.in_flight[job_id] = (future, slot)
+            try:
+                self.process.stdin.write(JOB_HEADER.pack(job_id, kind, slot, len(data), *args))
+                self.process.stdin.flush()
+            except (BrokenPipeError, ValueError):
+                del self.in_flight[job_id]
+                self.free_slots.put(slot)
+                return None  # The worker is being restarted
+        return future
+
+    def _read_results(self, process):
+        while True:
+            try:
+                header = read_exactly(process.stdout, RESULT_HEADER.size)
+            except (EOFError, ValueError, OSError):
+                break
+            job_id, ok, busy, height, width, channels, source_w, source_h = RESULT_HEADER.unpack(header)
+            with self.lock:
+                future, slot = self.in_flight.pop(job_id)
+            self.jobs += 1
+            self.busy_seconds += busy
+
+            if not ok:
+                self.failed += 1
+                self.free_slots.put(slot)
+                future.set_exception(RuntimeError(f"Frame worker {self.index} failed on job {job_id}"))
+                continue
+            result = None
+            if height:
+                shape = (height, width, channels) if channels else (height, width)
+                result = np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=slot * self.slot_size).copy()
+            self.free_slots.put(slot)
+            future.set_result((result, (source_w, source_h) if source_w else None))
+
+        self._restart(process)
+
+    def _restart(self, process):
+        process.wait()
+        with self.lock:
+            if process is not self.process:
+                return  # Stopped on purpose
+            print(f"Frame worker {self.index} exited with code {process.returncode}, restarting it")
+            for future, _ in self.in_flight.values():
+                future.set_exception(RuntimeError(f"Frame worker {self.index} exited"))
+            self.in_flight = {}
+            self.restarts += 1
+            self.start()
+
+    def stop(self):
+        process = self.process
+        self.process = None
+        if process is not None:
+            process.stdin.close()
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.shm.close()
+        self.shm.unlink()
+
+    def stats(self):
+        uptime = time.monotonic() - self.started_at if self.started_at else 0
+        return {
+            'pid': self.process.pid if self.process else None,
+            'alive': self.process is not None and self.process.poll() is None,
+            'jobs': self.jobs,
+            'failed': self.failed,
+            'in_flight': len(self.in_flight),
+            'busy_seconds': self.busy_seconds,
+            'utilization': self.busy_seconds / uptime if uptime else None,
+            'restarts': self.restarts,
+        }
+
+
+class FrameProcessPool:
+    """
+    Worker processes with shared-memory slots, sharded by sender id. A job that finds no free slot in its worker,
+    or doesn't fit a slot, runs in the calling thread instead, as it would without the pool.
+    """
+
+    def __init__(self, processes, slots_per_worker, slot_size, job_timeout):
+        self.workers = [WorkerProcess(index, slots_per_worker, slot_size) for index in range(processes)]
+        self.slot_size = slot_size
+        self.job_timeout = job_timeout
+        self.job_ids = itertools.count(1)
+        self.ran_locally = 0
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        print(f"Started {len(self.workers)} frame worker processes")
+
+    def worker_for(self, shard_key):
+        return self.workers[zlib.crc32(shard_key.encode()) % len(self.workers)]
+
+    def submit(self, shard_key, kind, data, args):
+        """Queues a job on the sender's worker. Returns a Future of (result, source size), or None if it can't."""
+        if len(data) > self.slot_size:
+            return None
+        return self.worker_for(shard_key).submit(next(self.job_ids), kind, data, args)
+
+    def result(self, future, kind, data, args):
+        """Waits for a submitted job, running it locally if it wasn't submitted, failed or timed out."""
+        if future is not None:
+            try:
+                return future.result(self.job_timeout)
+            except Exception as e:
+                print(f"Frame job failed in its worker, running it locally: {e!r}")
+        self.ran_locally += 1
+        return run_job(kind, data, args)
+
+    def run(self, shard_key, kind, data, args):
+        return self.result(self.submit(shard_key, kind, data, args), kind, data, args)
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+    def stats(self):
+        return {'workers': [worker.stats() for worker in self.workers], 'ran_locally': self.ran_locally}
+
+
+if __name__ == '__main__':
+    worker_main(sys.argv[1], int(sys.argv[2]))
@@ -0,0 +1,135 @@
+"""
+Thermal- and throttle-aware load governor of the sender.
+
+A Pi in a hot enclosure throttles its CPU, and the sender's frame timing goes erratic long before anything fails.
+The governor polls the SoC temperature, the firmware's throttle flags and the CPU load, and steps the sender through
+configured tiers of lighter work: tier 0 is normal operation, each tier above it is a dict of entry thresholds and
+the limits that apply while it is active, e.g.
+
+    {'name': 'hot', 'temp': 75, 'cpu': 95, 'fps': 8, 'jpeg_quality': 70, 'still_scale': 0.5, 'analytics': False}
+
+A tier is entered as soon as the temperature (degrees C) or the CPU load (percent) reaches one of its thresholds,
+skipping tiers if needed, and one tier further up on every poll while the firmware reports it is capping the clock.
+It is left one tier at a time, once the readings stayed below its thresholds by the hysteresis margins for the
+cool-down period, so the sender doesn't flap at a threshold. Every change is logged and kept with its readings, so
+thermal trouble can be told apart from network trouble.
+"""
+
+import subprocess
+import threading
+import time
+from collections import deque
+
+
+# Bits of `vcgencmd get_throttled` that are set while the condition lasts (the bits 16 up are "has occurred")
+THROTTLE_FLAGS = {
+    0x1: 'under_voltage',
+    0x2: 'frequency_capped',
+    0x4: 'throttled',
+    0x8: 'soft_temperature_limit',
+}
+THROTTLING = 0x2 | 0x4 | 0x8  # The flags that mean the firmware is slowing the CPU down
+
+
+def read_soc_temperature(path='/sys/class/thermal/thermal_zone0/temp'):
+    """SoC temperature in degrees C, or None where it can't be read. Cheaper than spawning vcgencmd."""
+    try:
+        with open(path) as file:
+            return int(file.read()) / 1000
+    except (OSError, ValueError):
+        return None
+
+
+def read_throttle_flags():
+    """The firmware's throttle flags from `vcgencmd get_throttled`, or None where it's not available."""
+    try:
+        output = subprocess.check_output(["vcgencmd", "get_throttled"], timeout=5).decode()
+        return int(output.strip().split('=')[1], 16)
+    except (OSError, subprocess.SubprocessError, IndexError, ValueError):
+        return None
+
+
+def throttle_flag_names(flags):
+    return [name for bit, name in THROTTLE_FLAGS.items() if flags and flags & bit]
+
+
+def cap(value, limit):
+    """The lower of a setting and a tier limit, either of which can be None for no limit."""
+    if limit is None:
+        return value
+    return limit if value is None else min(value, limit)
+
+
+class LoadGovernor:
+    def __init__(self, tiers, temp_hysteresis=5, cpu_hysteresis=15, cool_down=120, history=50):
+        self.tiers = [{'name': 'normal'}] + list(tiers)
+        self.temp_hysteresis = temp_hysteresis
+        self.cpu_hysteresis = cpu_hysteresis
+        self.cool_down = cool_down
+        self.tier = 0
+        self.cool_since = None
+        self.changed_at = time.time()
+        self.changes = deque(maxlen=history)
+        self.readings = {'temp': None, 'cpu': None, 'throttle_flags': None}
+        self.lock = threading.Lock()
+
+    @property
+    def limits(self):
+        """The limits of the current tier; keys that are missing don't limit anything."""
+        return self.tiers[self.tier]
+
+    def _reached(self, tier, temp, cpu, margin_temp=0, margin_cpu=0):
+        """Whether the readings are at (or within the margins below) one of the tier's thresholds."""
+        return ((temp is not None and 'temp' in tier and temp >= tier['temp'] - margin_temp)
+                or (cpu is not None and 'cpu' in tier and cpu >= tier['cpu'] - margin_cpu))
+
+    def update(self, temp, cpu, throttle_flags, now=None):
+        """Takes one set of readings and changes tier if they call for it. Returns the new tier's name if it did."""
+        now = time.time() if now is None else now
+        throttling = bool(throttle_flags and throttle_flags & THROTTLING)
+        with self.lock:
+            self.readings = {'temp': temp, 'cpu': cpu, 'throttle_flags': throttle_flags}
+            target = max([index for index, tier in enumerate(self.tiers) if index and self._reached(tier, temp, cpu)],
+                         default=0)
+            if throttling:
+                target = max(target, min(self.tier + 1, len(self.tiers) - 1))
+
+            if target > self.tier:
+                reason = 'firmware throttling' if throttling and target == self.tier + 1 else 'thresholds reached'
+                return self._change(target, reason, now)
+
+            current = self.tiers[self.tier]
+            if self.tier == 0 or throttling or self._reached(current, temp, cpu, self.temp_hysteresis,
+                                                             self.cpu_hysteresis):
+                self.cool_since = None
+                return None
+            if self.cool_since is None:
+                self.cool_since = now
+            if now - self.cool_since < self.cool_down:
+                return None
+            return self._change(self.tier - 1, 'cooled down', now)
+
+    def _change(self, tier, reason, now):
+        previous = self.tiers[self.tier]['name']
+        self.tier = tier
+        self.cool_since = None
+        self.changed_at = now
+        name = self.tiers[tier]['name']
+        readings = self.readings
+        self.changes.append({'time': now, 'from': previous, 'to': name, 'reason': reason, **readings})
+        print(f"Load governor: {previous} -> {name} ({reason}; temp {readings['temp']} C, cpu {readings['cpu']}%, "
+              f"throttle flags {throttle_flag_names(readings['throttle_flags']) or 'none'})")
+        return name
+
+    def stats(self):
+        with self.lock:
+            return {
+                'tier': self.tier,
+                'name': self.tiers[self.tier]['name'],
+                'limits': {key: value for key, value in self.tiers[self.tier].items()
+                           if key not in ('name', 'temp', 'cpu')},
+                'since': self.changed_at,
+                **self.readings,
+                'throttling': throttle_flag_names(self.readings['throttle_flags']),
+                'changes': list(self.changes),
+            }
@@ -0,0 +1,124 @@
+"""
+Capture-to-display latency measurement shared by the sender and the receiver.
+
+The sender derives each frame's wall-clock capture time from the camera's SensorTimestamp and stamps its send time,
+both on its own clock. To compare them with the receiver's clock it pings the receiver over the sensor data link
+and keeps an NTP-style estimate of the offset between the clocks. The receiver files the stages of every frame into
+per-sender histograms.
+"""
+
+import bisect
+import math
+import threading
+import time
+from collections import deque
+
+
+def capture_wall_time(sensor_timestamp, now=None):
+    """
+    Wall-clock time at which a frame with the given SensorTimestamp (nanoseconds) was captured, or NaN if unknown.
+
+    SensorTimestamp comes from the V4L2 buffer timestamp, which is on CLOCK_MONOTONIC, the clock of
+    time.monotonic_ns(), so the frame's age is the difference between the two.
+    """
+    if not sensor_timestamp:
+        return math.nan
+    now = time.time() if now is None else now
+    age = (time.monotonic_ns() - sensor_timestamp) / 1e9
+    return now - age if 0 <= age < 60 else math.nan
+
+
+class ClockOffsetEstimator:
+    """
+    Estimates receiver clock minus sender clock from ping round trips. Of the last few samples, the one with the
+    shortest round trip is used: its offset error is bounded by half of that round trip.
+    """
+
+    def __init__(self, window=8):
+        self.samples = deque(maxlen=window)  # (round trip, offset)
+        self.lock = threading.Lock()
+
+    def add(self, sent_at, receiver_time, received_at):
+        round_trip = received_at - sent_at
+        offset = receiver_time - (sent_at + received_at) / 2
+        with self.lock:
+            self.samples.append((round_trip, offset))
+
+    def best(self):
+        with self.lock:
+            return min(self.samples) if self.samples else (math.nan, math.nan)
+
+    @property
+    def offset(self):
+        return self.best()[1]
+
+    @property
+    def round_trip(self):
+        return self.best()[0]
+
+
+# Upper bounds of the histogram buckets, in seconds; the last bucket takes everything above
+BUCKET_BOUNDS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10]
+BUCKET_LABELS = [f'{bound * 1000:g}' for bound in BUCKET_BOUNDS] + ['inf']  # In milliseconds
+
+
+class LatencyHistogram:
+    """Fixed log-spaced buckets, so recording is O(log n) and memory stays constant however long it runs."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of the samples (the maximum for the last one)."""
+        target = fraction * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return min(BUCKET_BOUNDS[index], self.maximum) if index < len(BUCKET_BOUNDS) else self.maximum
+        return self.maximum
+
+    def stats(self):
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count * 1000,
+            'p50_ms': self.percentile(0.5) * 1000,
+            'p90_ms': self.percentile(0.9) * 1000,
+            'p99_ms': self.percentile(0.99) * 1000,
+            'max_ms': self.maximum * 1000,
+            'buckets_ms': dict(zip(BUCKET_LABELS, self.counts)),
+        }
+
+
+class LatencyTracker:
+    """Latency histograms per sender and stage. Negative and non-finite measurements are ignored."""
+
+    def __init__(self):
+        self.histograms = {}  # {sender_id: {stage: LatencyHistogram}}
+        self.lock = threading.Lock()
+
+    def record(self, sender_id, stage, seconds):
+        if not math.isfinite(seconds) or seconds < 0:
+            return
+        with self.lock:
+            stages = self.histograms.setdefault(sender_id, {})
+            histogram = stages.get(stage)
+            if histogram is None:
+                histogram = stages[stage] = LatencyHistogram()
+            histogram.add(seconds)
+
+    def stats(self, sender_id=None):
+        with self.lock:
+            return {sender: {stage: histogram.stats() for stage, histogram in stages.items()}
+                    for sender, stages in self.histograms.items() if sender_id is None or sender == sender_id}
@@ -0,0 +1,296 @@
+"""
+Wire formats shared by the sender (flask_picam2_stream_and_pic.py) and the receiver (stream_and_data_receiver.py).
+
+Live frames and high-res stills are sent as [id size][sender id][payload size][payload], sizes packed as native
+"Q". The id part never changes for a sender, so it is packed once and sent from a list of buffers with the payload.
+
+Sensor data travels as length-prefixed messages so they survive TCP coalescing and splitting:
+
+    [magic 'SD'][version][type][flags][body length, uint32 big endian][body]
+
+A DATA body is JSON {"sender_id": ..., "samples": [{...}, ...]}, zlib-compressed when the FLAG_ZLIB flag is set,
+so a sender that was offline can flush its buffered history in one message. The receiver answers every DATA message
+with an ACK whose body is the number of samples it accepted (uint32), after which the sender may drop them.
+
+To estimate the offset between the two clocks, the sender also sends a PING carrying its wall-clock send time
+(double). The receiver answers right away with a PONG carrying that time and its own wall-clock time.
+
+The receiver can also send the sender a CONTROL message at any time, a JSON object of commands such as
+{"roi": "<preset>"} to switch the live stream's region of interest. It is not answered.
+
+High-res stills are uploaded resumably with messages of the same layout, magic 'SU':
+
+    OFFER   JSON {"sender_id", "upload_id", "size", "captured_at", "sensor_timestamp", "sent_at", "clock_offset"},
+            answered with an OFFSET
+    OFFSET  [offset, uint64]: how many bytes of the upload the receiver holds
+    CHUNK   [offset, uint64][data], answered with an OFFSET once the data is on disk
+
+A sender whose connection dropped offers the same upload again and continues from the offset it gets back. The
+upload is complete when the OFFSET equals its size.
+
+In UDP video mode each live frame is split into datagrams that fit the path MTU, every one self-describing:
+
+    [magic 'VF'][version][sender id length][frame sequence, uint32][fragment index, uint16][fragment count, uint16]
+    [sender id][payload chunk]
+
+all big endian. The receiver reassembles a frame once every fragment of it has arrived and gives up on it after a
+short deadline, so a lost datagram costs one frame instead of stalling the stream.
+
+With either transport, a live frame payload may start with a timing prefix ahead of the JPEG:
+
+    [magic 'FT'][version][pad][sensor timestamp ns, uint64][captured at][sent at][clock offset]
+
+the last three being doubles, all big endian. Times are the sender's wall clock, the clock offset its current
+estimate of receiver clock minus its own, NaN while unknown. A JPEG starts with 0xFFD8, so payloads without the
+prefix are still told apart.
+"""
+
+import json
+import struct
+import zlib
+
+
+SENSOR_MAGIC = b'SD'
+SENSOR_PROTOCOL_VERSION = 1
+
+MSG_DATA = 1
+MSG_ACK = 2
+MSG_PING = 3
+MSG_PONG = 4
+MSG_CONTROL = 5
+
+FLAG_ZLIB = 0x01
+
+STILL_MAGIC = b'SU'
+STILL_OFFER = 1
+STILL_OFFSET = 2
+STILL_CHUNK = 3
+OFFSET_BODY = struct.Struct("!Q")
+
+SENSOR_HEADER = struct.Struct("!2sBBBI")
+ACK_BODY = struct.Struct("!I")
+PING_BODY = struct.Struct("!d")
+PONG_BODY = struct.Struct("!dd")
+
+VIDEO_FRAGMENT_MAGIC = b'VF'
+VIDEO_FRAGMENT_VERSION = 1
+VIDEO_FRAGMENT_HEADER = struct.Struct("!2sBBIHH")
+DEFAULT_MAX_DATAGRAM = 1400  # Fits a 1500 byte Ethernet/WiFi MTU with room for IP, UDP and tunnel headers
+
+FRAME_TIMING_MAGIC = b'FT'
+FRAME_TIMING_VERSION = 1
+FRAME_TIMING = struct.Struct("!2sBxQddd")
+
+MAX_SENSOR_BODY_SIZE = 16 * 1024 * 1024
+COMPRESS_THRESHOLD = 512  # Bodies smaller than this are sent uncompressed, zlib would barely help
+
+
+def recv_exactly(sock, size):
+    """Reads exactly size bytes from a blocking socket. Raises ConnectionError if the peer closes first."""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise ConnectionError(f"Connection closed after {received} of {size} bytes")
+        received += count
+    return bytes(buffer)
+
+
+def id_header(sender_id_encoded):
+    """The constant [id size][sender id] prefix of a sender's frame and still messages."""
+    return struct.pack("Q", len(sender_id_encoded)) + sender_id_encoded
+
+
+def sendmsg_all(sock, buffers):
+    """
+    Sends a list of bytes-like objects with scatter-gather sendmsg(), without concatenating them first.
+    Like sendall(), keeps sending until everything is out, resuming after a partial send.
+    """
+    views = [memoryview(buffer).cast('B') for buffer in buffers]
+    while views:
+        sent = sock.sendmsg(views)
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if views and sent:
+            views[0] = views[0][sent:]
+
+
+def send_id_and_payload(sock, header, payload, prefix=b''):
+    """
+    Sends one [id header][payload size][payload] message. payload can be any bytes-like object; prefix (e.g. a
+    frame timing prefix) is sent as the start of the payload without concatenating the two.
+    """
+    payload = memoryview(payload).cast('B')
+    sendmsg_all(sock, [header, struct.pack("Q", len(prefix) + len(payload)), prefix, payload])
+
+
+def encode_message(msg_type, body, flags=0, magic=SENSOR_MAGIC):
+    return SENSOR_HEADER.pack(magic, SENSOR_PROTOCOL_VERSION, msg_type, flags, len(body)) + body
+
+
+def parse_header(header, expected_magic=SENSOR_MAGIC):
+    """Returns (msg_type, flags, body_length) of a message header. Raises ValueError if it is invalid."""
+    magic, version, msg_type, flags, length = SENSOR_HEADER.unpack(header)
+    if magic != expected_magic:
+        raise ValueError(f"Bad message magic {magic!r}")
+    if version != SENSOR_PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported sensor protocol version {version}")
+    if length > MAX_SENSOR_BODY_SIZE:
+        raise ValueError(f"Sensor message of {length} bytes exceeds the size limit")
+    return msg_type, flags, length
+
+
+def encode_sensor_batch(sender_id, samples):
+    """Encodes a list of sample dicts from one sender as a single DATA message."""
+    body = json.dumps({'sender_id': sender_id, 'samples': list(samples)}, separators=(',', ':')).encode()
+    flags = 0
+    if len(body) >= COMPRESS_THRESHOLD:
+        body = zlib.compress(body)
+        flags |= FLAG_ZLIB
+    return encode_message(MSG_DATA, body, flags)
+
+
+def decode_sensor_batch(flags, body):
+    """Returns (sender_id, samples) from the body of a DATA message."""
+    if flags & FLAG_ZLIB:
+        body = zlib.decompress(body)
+    message = json.loads(body)
+    return message.get('sender_id', 'Unknown'), message.get('samples', [])
+
+
+def encode_ack(count):
+    return encode_message(MSG_ACK, ACK_BODY.pack(count))
+
+
+def read_message(sock, expected_magic=SENSOR_MAGIC):
+    """Reads one message from a blocking socket. Returns (msg_type, flags, body)."""
+    msg_type, flags, length = parse_header(recv_exactly(sock, SENSOR_HEADER.size), expected_magic)
+    return msg_type, flags, recv_exactly(sock, length)
+
+
+def encode_control(commands):
+    return encode_message(MSG_CONTROL, json.dumps(commands).encode())
+
+
+def read_reply(sock, expected_type, on_control=None):
+    """
+    Waits for a message of expected_type and returns its body. CONTROL messages arriving meanwhile are decoded and
+    passed to on_control, or ignored without it.
+    """
+    while True:
+        msg_type, _, body = read_message(sock)
+        if msg_type == expected_type:
+            return body
+        if msg_type != MSG_CONTROL:
+            raise ValueError(f"Expected message type {expected_type}, got {msg_type}")
+        if on_control is not None:
+            on_control(json.loads(body))
+
+
+def read_ack(sock, on_control=None):
+    """Waits for the ACK of a DATA message and returns the number of samples the receiver accepted."""
+    return ACK_BODY.unpack(read_reply(sock, MSG_ACK, on_control))[0]
+
+
+def encode_ping(sent_at):
+    return encode_message(MSG_PING, PING_BODY.pack(sent_at))
+
+
+def encode_pong(sent_at, receiver_time):
+    return encode_message(MSG_PONG, PONG_BODY.pack(sent_at, receiver_time))
+
+
+def read_pong(sock, on_control=None):
+    """Waits for the PONG of a PING. Returns (the sender time it echoes, the receiver time)."""
+    return PONG_BODY.unpack(read_reply(sock, MSG_PONG, on_control))
+
+
+def encode_frame_timing(sensor_timestamp, captured_at, sent_at, clock_offset):
+    return FRAME_TIMING.pack(FRAME_TIMING_MAGIC, FRAME_TIMING_VERSION, sensor_timestamp, captured_at, sent_at,
+                             clock_offset)
+
+
+def split_frame_timing(payload):
+    """
+    Returns (timing, jpeg) of a live frame payload. timing is a dict with sensor_timestamp, captured_at, sent_at
+    and clock_offset, or None if the payload has no timing prefix.
+    """
+    if payload[:2] != FRAME_TIMING_MAGIC or len(payload) < FRAME_TIMING.size:
+        return None, payload
+    _, version, sensor_timestamp, captured_at, sent_at, clock_offset = FRAME_TIMING.unpack_from(payload)
+    if version != FRAME_TIMING_VERSION:
+        return None, payload
+    timing = {'sensor_timestamp': sensor_timestamp, 'captured_at': captured_at, 'sent_at': sent_at,
+              'clock_offset': clock_offset}
+    return timing, payload[FRAME_TIMING.size:]
+
+
+def encode_still_offer(sender_id, upload_id, size, captured_at, timing=None):
+    """timing optionally adds sensor_timestamp, sent_at and clock_offset to the offer."""
+    offer = {'sender_id': sender_id, 'upload_id': upload_id, 'size': size, 'captured_at': captured_at}
+    offer.update(timing or {})
+    return encode_message(STILL_OFFER, json.dumps(offer).encode(), magic=STILL_MAGIC)
+
+
+def decode_still_offer(body):
+    """Returns (sender_id, upload_id, size, captured_at, offer); the full offer dict carries the optional timing."""
+    offer = json.loads(body)
+    return offer['sender_id'], offer['upload_id'], int(offer['size']), offer.get('captured_at'), offer
+
+
+def encode_still_offset(offset):
+    return encode_message(STILL_OFFSET, OFFSET_BODY.pack(offset), magic=STILL_MAGIC)
+
+
+def still_chunk_prefix(offset, length):
+    """Header and offset of a CHUNK message, to be sent followed by length bytes of data."""
+    return (SENSOR_HEADER.pack(STILL_MAGIC, SENSOR_PROTOCOL_VERSION, STILL_CHUNK, 0, OFFSET_BODY.size + length)
+            + OFFSET_BODY.pack(offset))
+
+
+def read_still_offset(sock):
+    """Waits for an OFFSET message and returns the offset."""
+    msg_type, _, body = read_message(sock, STILL_MAGIC)
+    if msg_type != STILL_OFFSET:
+        raise ValueError(f"Expected an OFFSET, got message type {msg_type}")
+    return OFFSET_BODY.unpack(body)[0]
+
+
+def send_frame_datagrams(sock, sender_id_encoded, seq, payload, max_datagram=DEFAULT_MAX_DATAGRAM, prefix=b''):
+    """
+    Sends one frame as fragment datagrams on a connected UDP socket, each chunk straight from the payload buffer.
+    prefix, shorter than a chunk, goes at the start of the first one. Returns the number of datagrams sent.
+    """
+    payload = memoryview(payload).cast('B')
+    chunk_size = max_datagram - VIDEO_FRAGMENT_HEADER.size - len(sender_id_encoded)
+    total = len(prefix) + len(payload)
+    count = max(-(-total // chunk_size), 1)
+    if count > 0xFFFF:
+        raise ValueError(f"Frame of {total} bytes needs more than 65535 fragments")
+
+    for index in range(count):
+        header = VIDEO_FRAGMENT_HEADER.pack(VIDEO_FRAGMENT_MAGIC, VIDEO_FRAGMENT_VERSION, len(sender_id_encoded),
+                                            seq & 0xFFFFFFFF, index, count)
+        # Offsets within the payload, shifted by the prefix that fills the start of the first chunk
+        start = max(index * chunk_size - len(prefix), 0)
+        end = (index + 1) * chunk_size - len(prefix)
+        chunks = [prefix, payload[:end]] if index == 0 else [payload[start:end]]
+        sock.sendmsg([header, sender_id_encoded] + chunks)
+    return count
+
+
+def parse_frame_datagram(datagram):
+    """Returns (sender_id, seq, index, count, chunk) of a fragment datagram. Raises ValueError if it is invalid."""
+    if len(datagram) < VIDEO_FRAGMENT_HEADER.size:
+        raise ValueError(f"Datagram of {len(datagram)} bytes is too short")
+    magic, version, id_length, seq, index, count = VIDEO_FRAGMENT_HEADER.unpack_from(datagram)
+    if magic != VIDEO_FRAGMENT_MAGIC or version != VIDEO_FRAGMENT_VERSION:
+        raise ValueError(f"Bad video datagram header {magic!r} v{version}")
+    if index >= count:
+        raise ValueError(f"Fragment {index} of a {count} fragment frame")
+    id_end = VIDEO_FRAGMENT_HEADER.size + id_length
+    sender_id = bytes(datagram[VIDEO_FRAGMENT_HEADER.size:id_end]).decode()
+    return sender_id, seq, index, count, memoryview(datagram)[id_end:]
@@ -0,0 +1,238 @@
+"""
+Continuous recording of the live frames received from the senders.
+
+Every sender's frames go to fixed-duration, append-only segment files:
+
+    <root>/<sender_id>/<YYYY-MM-DD>/<HH-MM-SS>.mjpeg   records of [timestamp, double][length, uint32][JPEG bytes]
+    <root>/<sender_id>/<YYYY-MM-DD>/<HH-MM-SS>.idx     entries of [timestamp, double][record offset, uint64]
+
+The index is small enough to read whole, so seeking to a moment is a binary search followed by a single slice of
+the memory-mapped segment. Frames are buffered in memory and written in batches by one background thread, so
+recording many cameras turns into a few large sequential writes per flush instead of one small write per frame.
+"""
+
+import bisect
+import datetime
+import mmap
+import os
+import struct
+import threading
+import time
+
+
+RECORD_HEADER = struct.Struct("!dI")
+INDEX_ENTRY = struct.Struct("!dQ")
+
+SEGMENT_SUFFIX = '.mjpeg'
+INDEX_SUFFIX = '.idx'
+
+
+class SegmentWriter:
+    """Appends the buffered frames of one sender to its current segment, starting a new one when it is full."""
+
+    def __init__(self, root, sender_id, segment_duration):
+        self.root = root
+        self.sender_id = sender_id
+        self.segment_duration = segment_duration
+        self.segment_start = None
+        self.data_file = None
+        self.index_file = None
+        self.offset = 0
+
+    def _open_segment(self, ts):
+        self.close()
+        start = datetime.datetime.fromtimestamp(ts)
+        directory = os.path.join(self.root, self.sender_id, start.strftime("%Y-%m-%d"))
+        os.makedirs(directory, exist_ok=True)
+        base_path = os.path.join(directory, start.strftime("%H-%M-%S"))
+        self.data_file = open(base_path + SEGMENT_SUFFIX, 'ab')
+        self.index_file = open(base_path + INDEX_SUFFIX, 'ab')
+        self.offset = self.data_file.tell()
+        self.segment_start = ts
+
+    def write(self, frames):
+        """Writes a list of (timestamp, jpeg) with one data write and one index write per segment touched."""
+        data = []
+        index = []
+        for ts, jpeg in frames:
+            if self.segment_start is None or ts >= self.segment_start + self.segment_duration:
+                self._flush(data, index)
+                data, index = [], []
+                self._open_segment(ts)
+
+            index.append(INDEX_ENTRY.pack(ts, self.offset))
+            data.append(RECORD_HEADER.pack(ts, len(jpeg)))
+            data.append(jpeg)
+            self.offset += RECORD_HEADER.size + len(jpeg)
+        self._flush(data, index)
+
+    def _flush(self, data, index):
+        if not data:
+            return
+        # Data first, so an index entry never points past the end of the segment
+        self.data_file.write(b''.join(data))
+        self.data_file.flush()
+        self.index_file.write(b''.join(index))
+        self.index_file.flush()
+
+    def close(self):
+        for file in (self.data_file, self.index_file):
+            if file is not None:
+                file.close()
+        self.data_file = self.index_file = None
+
+
+class Recorder:
+    """
+    Buffers the frames of the recorded senders and writes them out every flush_interval seconds.
+
+    record() only appends to an in-memory list, so it is cheap enough to call from the ingest loop. When the
+    buffered bytes exceed max_buffered_bytes (the disk can't keep up), new frames are dropped and counted.
+    """
+
+    def __init__(self, root, segment_duration=300, flush_interval=2.0, max_buffered_bytes=64 * 1024 * 1024,
+                 senders=None):
+        self.root = root
+        self.segment_duration = segment_duration
+        self.flush_interval = flush_interval
+        self.max_buffered_bytes = max_buffered_bytes
+        self.senders = senders  # None records every sender
+        self.pending = {}  # {sender_id: [(timestamp, jpeg), ...]}
+        self.buffered_bytes = 0
+        self.writers = {}
+        self.lock = threading.Lock()
+        self.recorded_frames = 0
+        self.dropped_frames = 0
+        self.last_flush_duration = None
+        self.thread = threading.Thread(target=self._run, name='recorder', daemon=True)
+        self.thread.start()
+
+    def is_recording(self, sender_id):
+        return self.senders is None or sender_id in self.senders
+
+    def record(self, sender_id, jpeg, ts=None):
+        if not self.is_recording(sender_id):
+            return
+        with self.lock:
+            if self.buffered_bytes + len(jpeg) > self.max_buffered_bytes:
+                self.dropped_frames += 1
+                return
+            self.pending.setdefault(sender_id, []).append((ts or time.time(), jpeg))
+            self.buffered_bytes += len(jpeg)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error writing recording segments: {e!r}")
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.buffered_bytes = 0
+
+        started = time.monotonic()
+        for sender_id, frames in pending.items():
+            writer = self.writers.get(sender_id)
+            if writer is None:
+                writer = self.writers[sender_id] = SegmentWriter(self.root, sender_id, self.segment_duration)
+            writer.write(frames)
+            self.recorded_frames += len(frames)
+        if pending:
+            self.last_flush_duration = time.monotonic() - started
+
+    def stats(self):
+        with self.lock:
+            buffered_bytes = self.buffered_bytes
+        return {
+            'recorded_frames': self.recorded_frames,
+            'dropped_frames': self.dropped_frames,
+            'buffered_bytes': buffered_bytes,
+            'last_flush_duration': self.last_flush_duration,
+        }
+
+
+def list_segments(root, sender_id):
+    """Returns the segments of a sender, oldest first, as dicts with the path relative to root and the start time."""
+    sender_directory = os.path.join(root, sender_id)
+    segments = []
+    if not os.path.isdir(sender_directory):
+        return segments
+
+    for current_date in sorted(os.listdir(sender_directory)):
+        date_directory = os.path.join(sender_directory, current_date)
+        if not os.path.isdir(date_directory):
+            continue
+        for name in sorted(os.listdir(date_directory)):
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            start = datetime.datetime.strptime(f'{current_date} {name[:-len(SEGMENT_SUFFIX)]}', "%Y-%m-%d %H-%M-%S")
+            segments.append({
+                'segment': '/'.join((sender_id, current_date, name)),
+                'start': start.timestamp(),
+                'size': os.path.getsize(os.path.join(date_directory, name)),
+            })
+    return segments
+
+
+def read_index(segment_path):
+    """Returns the (timestamps, offsets) lists of a segment."""
+    index_path = segment_path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+    with open(index_path, 'rb') as file:
+        data = file.read()
+    # A flush may be in progress; ignore a trailing partial entry
+    data = data[:len(data) - len(data) % INDEX_ENTRY.size]
+    timestamps = []
+    offsets = []
+    for ts, offset in INDEX_ENTRY.iter_unpack(data):
+        timestamps.append(ts)
+        offsets.append(offset)
+    return timestamps, offsets
+
+
+def segments_from(root, sender_id, ts):
+    """Returns the paths of the segment covering ts (the last one starting at or before it) and all later ones."""
+    segments = list_segments(root, sender_id)
+    position = bisect.bisect_right([segment['start'] for segment in segments], ts) - 1
+    if position < 0:
+        return []
+    return [os.path.join(root, segment['segment']) for segment in segments[position:]]
+
+
+class SegmentReader:
+    """Reads frames of one segment through a memory map. Use as a context manager."""
+
+    def __init__(self, segment_path):
+        self.timestamps, self.offsets = read_index(segment_path)
+        self.file = open(segment_path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def __len__(self):
+        # The index is read before the map is created and data is always written before its index entries, so
+        # every indexed frame is inside the map
+        return len(self.timestamps) if self.map is not None else 0
+
+    def position_at(self, ts):
+        """Index of the last frame at or before ts (the first frame if ts is earlier than all of them)."""
+        return max(bisect.bisect_right(self.timestamps, ts) - 1, 0)
+
+    def frame(self, position):
+        """Returns (timestamp, jpeg) of the frame at an index position."""
+        offset = self.offsets[position]
+        ts, length = RECORD_HEADER.unpack_from(self.map, offset)
+        start = offset + RECORD_HEADER.size
+        return ts, self.map[start:start + length]
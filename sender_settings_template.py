@@ -18,5 +18,78 @@ SAVE_TO_DISK = False  # Set to True to save pictures to disk
 # Sleep time (in seconds) between data reads and sending
 SLEEP_TIME = 30  # Adjust sleep time as needed
 
+# Sensor samples buffered while the receiver is unreachable (2880 is one day at SLEEP_TIME = 30)
+SENSOR_BUFFER_MAX = 2880
+# Maximum number of samples sent in one message when flushing the buffer
+SENSOR_MAX_BATCH = 500
+
+# Burst mode: maximum number of stills per burst and their JPEG quality
+BURST_MAX_FRAMES = 20
+BURST_JPEG_QUALITY = 95
+# Stills captured in a burst, spooled and uploaded, when the timed stills see the scene brightness change suddenly
+# (e.g. lights switched on). 0 disables it
+BURST_ON_SCENE_CHANGE = 0
+
 # Watchdog timeout
-watchdog_timeout = 60 * 5  # in seconds, adjust as needed
\ No newline at end of file
+watchdog_timeout = 60 * 5  # in seconds, adjust as needed
+# Worker supervision: seconds without a heartbeat before a worker is restarted (the timed stills worker uses
+# watchdog_timeout), and how many restarts within the window before a camera re-init or a process restart
+VIDEO_WORKER_DEADLINE = 60
+SENSOR_WORKER_DEADLINE = 120
+HTTP_WORKER_DEADLINE = 30
+WORKER_MAX_RESTARTS = 3
+WORKER_RESTART_WINDOW = 600
+# Seconds an HTTP request that needs the camera waits for it while it (re)starts, before answering 503
+CAMERA_WAIT_TIMEOUT = 10
+
+# Startup auto-tuning: benchmark the device once and pick the lores size, JPEG quality, buffer count and frame rate
+# of the live stream within these budgets. The result is cached per Pi model and camera in CALIBRATION_CACHE
+AUTO_TUNE = False
+AUTO_TUNE_CPU_BUDGET = 0.5  # Share of one core the live stream may use
+AUTO_TUNE_MEMORY_BUDGET = 0.5  # Share of the available memory the camera buffers may use
+AUTO_TUNE_MIN_FPS = 10
+AUTO_TUNE_MAX_FPS = 30
+CALIBRATION_CACHE = 'calibration_cache.json'
+
+# Live video transport: 'tcp', or 'udp' for low latency on lossy links (incomplete frames are dropped, not waited
+# for). Stills and sensor data always go over TCP
+VIDEO_TRANSPORT = 'tcp'
+UDP_MAX_DATAGRAM = 1400  # Bytes per datagram, keep below the path MTU
+
+# Spool of stills waiting to be uploaded: kept on disk until the receiver has them, within a size and age limit.
+# The backlog left by an outage is drained at SPOOL_DRAIN_RATE bytes per second (0 for no limit)
+SPOOL_DIR = 'spool'
+SPOOL_MAX_BYTES = 512 * 1024 * 1024
+SPOOL_MAX_AGE = 7 * 24 * 60 * 60  # in seconds
+SPOOL_CHUNK_SIZE = 256 * 1024
+SPOOL_DRAIN_RATE = 256 * 1024
+
+# Region-of-interest presets for the live stream, as (x, y, width, height) fractions of the full field of view.
+# Switch with /roi/<preset> (and /roi/full) on the sender or the receiver; the stream keeps its lores size and bitrate
+ROI_PRESETS = {
+    # 'gate': (0.55, 0.35, 0.2, 0.2),
+}
+# 'main' crops the full-resolution stream; 'scaler' uses the camera's ScalerCrop: no CPU, but crops the stills too
+# on Pi models before the Pi 5
+ROI_METHOD = 'main'
+
+# Browser live view of the hardware H.264 stream at /live (fragmented MP4 / HLS); the MJPEG /stream is the fallback.
+# A segment is one keyframe interval long, and the newest LIVE_SEGMENT_WINDOW segments are kept in memory
+LIVE_H264_KEYFRAME_INTERVAL = 30  # in frames
+LIVE_SEGMENT_WINDOW = 6
+
+# Load governor: steps the sender down through these tiers when the SoC gets hot ('temp', in C), the CPU load is high
+# ('cpu', in %) or the firmware throttles, and back up one tier at a time once it stayed GOVERNOR_*_HYSTERESIS below
+# the tier's thresholds for GOVERNOR_COOL_DOWN seconds. A tier caps the live stream's 'fps' and 'jpeg_quality',
+# scales the timed stills by 'still_scale' and, with 'analytics' False, analyses the stills' brightness at 1/8 scale.
+# The tier is reported in /health and in the sensor data. Set to [] to turn the governor off
+GOVERNOR_TIERS = [
+    {'name': 'warm', 'temp': 70, 'fps': 15},
+    {'name': 'hot', 'temp': 75, 'fps': 8, 'jpeg_quality': 70, 'still_scale': 0.5, 'analytics': False},
+    {'name': 'critical', 'temp': 80, 'fps': 2, 'jpeg_quality': 60, 'still_scale': 0.25, 'analytics': False},
+    # e.g. {'name': 'busy', 'cpu': 95, 'fps': 10} to also step down under sustained CPU load
+]
+GOVERNOR_INTERVAL = 10  # in seconds
+GOVERNOR_TEMP_HYSTERESIS = 5  # in C
+GOVERNOR_CPU_HYSTERESIS = 15  # in %
+GOVERNOR_COOL_DOWN = 120  # in seconds
@@ -0,0 +1,185 @@
+"""
+Time-series storage for the sensor and system data received from the senders.
+
+Samples are kept in an SQLite database in WAL mode, one row per (sender, timestamp, field), so senders can add or
+drop fields at any time. Writes are queued and committed in batches by a background thread, and range queries are
+downsampled in SQL so a chart of a month of data only transfers a few hundred points.
+"""
+
+import datetime
+import json
+import math
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    sender_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    field TEXT NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_by_field ON samples (sender_id, field, ts);
+
+CREATE TABLE IF NOT EXISTS readings (
+    sender_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS readings_by_sender ON readings (sender_id, ts);
+"""
+
+SQLITE_INTEGER_RANGE = (-2 ** 63, 2 ** 63 - 1)
+
+
+def reading_timestamp(data, default):
+    """Returns the sender's own 'datetime' of a reading as a unix timestamp, or default if missing or invalid."""
+    try:
+        return datetime.datetime.fromisoformat(data['datetime']).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return default
+
+
+def is_measurement(value):
+    """Whether a field value goes to the samples table: a finite number that fits SQLite's REAL NOT NULL column."""
+    if isinstance(value, bool):
+        return False  # bool is an int subclass, but True/False is not a measurement
+    if isinstance(value, int):
+        return SQLITE_INTEGER_RANGE[0] <= value <= SQLITE_INTEGER_RANGE[1]
+    return isinstance(value, float) and math.isfinite(value)
+
+
+class SensorStore:
+    """
+    Stores sensor readings and answers range queries over them.
+
+    Numeric fields go to the samples table for aggregation; the full reading, including text fields such as the
+    uptime, is kept as JSON in the readings table.
+    """
+
+    def __init__(self, db_path, batch_size=200, batch_interval=2.0, max_queued=10000):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.pending = queue.Queue(maxsize=max_queued)
+        self.committed = 0
+        self.dropped = 0
+        self.failed = 0
+
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        connection = self._connect()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+        connection.close()
+
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='sensor-store', daemon=True)
+        self.thread.start()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def add(self, sender_id, data, received_at=None):
+        """Queues one reading for the next batch. Never blocks; readings are dropped if the queue is full."""
+        ts = reading_timestamp(data, received_at or time.time())
+        try:
+            self.pending.put_nowait((sender_id, ts, data))
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                print(f"Sensor store queue full, dropped reading from {sender_id} ({self.dropped} dropped so far)")
+
+    def _run(self):
+        connection = self._connect()
+        while not self.stopped.is_set() or not self.pending.empty():
+            batch = []
+            deadline = time.monotonic() + self.batch_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            if batch:
+                # Whatever goes wrong with one batch, the writer carries on with the next
+                try:
+                    self._commit(connection, batch)
+                except Exception as e:
+                    self.failed += len(batch)
+                    print(f"Error committing {len(batch)} sensor readings: {e!r}")
+        connection.close()
+
+    def _commit(self, connection, batch):
+        samples = []
+        readings = []
+        for sender_id, ts, data in batch:
+            readings.append((sender_id, ts, json.dumps(data)))
+            # Values that aren't finite or don't fit are only kept in the reading, so they can't fail the batch
+            samples.extend((sender_id, ts, field, value) for field, value in data.items() if is_measurement(value))
+
+        with connection:
+            connection.executemany("INSERT INTO readings (sender_id, ts, data) VALUES (?, ?, ?)", readings)
+            connection.executemany("INSERT INTO samples (sender_id, ts, field, value) VALUES (?, ?, ?, ?)", samples)
+        self.committed += len(batch)
+
+    def close(self):
+        """Commits whatever is still queued and stops the writer thread."""
+        self.stopped.set()
+        self.thread.join(timeout=self.batch_interval + 10)
+
+    def fields(self, sender_id):
+        connection = self._connect()
+        try:
+            rows = connection.execute("SELECT DISTINCT field FROM samples WHERE sender_id = ? ORDER BY field",
+                                      (sender_id,))
+            return [row[0] for row in rows]
+        finally:
+            connection.close()
+
+    def query(self, sender_id, field, start, end, max_points=300):
+        """
+        Returns the samples of one field between the start and end unix timestamps, reduced to at most max_points
+        buckets of equal duration. Each point is a dict with the bucket start time and the min, max and mean of
+        the samples in it; empty buckets are left out.
+        """
+        bucket_width = max((end - start) / max(max_points, 1), 1e-6)
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                """
+                SELECT CAST((ts - :start) / :width AS INTEGER) AS bucket,
+                       MIN(value), MAX(value), AVG(value), COUNT(*)
+                FROM samples
+                WHERE sender_id = :sender_id AND field = :field AND ts >= :start AND ts < :end
+                GROUP BY bucket
+                ORDER BY bucket
+                """,
+                {'sender_id': sender_id, 'field': field, 'start': start, 'end': end, 'width': bucket_width})
+            return [{'ts': start + bucket * bucket_width, 'min': minimum, 'max': maximum, 'mean': mean,
+                     'count': count}
+                    for bucket, minimum, maximum, mean, count in rows]
+        finally:
+            connection.close()
+
+    def latest(self, sender_id):
+        """Returns the most recent full reading of a sender, or None."""
+        connection = self._connect()
+        try:
+            row = connection.execute("SELECT data FROM readings WHERE sender_id = ? ORDER BY ts DESC LIMIT 1",
+                                     (sender_id,)).fetchone()
+            return json.loads(row[0]) if row else None
+        finally:
+            connection.close()
+
+    def stats(self):
+        return {'queued': self.pending.qsize(), 'committed': self.committed, 'dropped': self.dropped,
+                'failed': self.failed}
@@ -0,0 +1,186 @@
+"""
+On-disk spool of the high-res stills waiting to be uploaded, and their resumable upload.
+
+Every timed still is written to the spool before it is sent and only removed once the receiver reports holding all
+of it, so stills taken while the uplink is down survive until it returns, and a sender restart as well. Uploads go
+in chunks; after a dropped connection the upload continues from the offset the receiver reports instead of starting
+over. The spool is bounded by total size and age, oldest stills going first.
+"""
+
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+
+from protocol import encode_still_offer, read_still_offset, sendmsg_all, still_chunk_prefix
+
+
+SPOOL_SUFFIX = '.jpg'
+
+
+class SpooledStill:
+    def __init__(self, path):
+        self.path = path
+        self.upload_id = os.path.basename(path)[:-len(SPOOL_SUFFIX)]
+        parts = self.upload_id.split('-')
+        self.captured_at = float(parts[0])
+        self.sensor_timestamp = int(parts[1]) if len(parts) == 3 else 0  # Stills spooled before it was recorded
+        self.size = os.path.getsize(path)
+
+
+class StillSpool:
+    """
+    Stills waiting to be uploaded, one file each, named <capture timestamp>-<sensor timestamp>-<random id>.jpg.
+
+    A still being uploaded is claimed, so the live upload and the backlog drain never send the same one at once
+    and the limits never delete it mid-upload.
+    """
+
+    def __init__(self, directory, max_bytes, max_age):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.claimed = set()  # upload ids
+        self.dropped = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, jpeg, captured_at, claim=False, sensor_timestamp=0):
+        """Writes a still to the spool and returns it, claimed if requested."""
+        upload_id = f'{captured_at:.3f}-{sensor_timestamp}-{uuid.uuid4().hex[:8]}'
+        path = os.path.join(self.directory, upload_id + SPOOL_SUFFIX)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(jpeg)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        still = SpooledStill(path)
+        if claim:
+            with self.lock:
+                self.claimed.add(still.upload_id)
+        self.enforce_limits()
+        return still
+
+    def pending(self):
+        """The spooled stills, oldest first."""
+        stills = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(SPOOL_SUFFIX):
+                continue
+            try:
+                stills.append(SpooledStill(os.path.join(self.directory, name)))
+            except (OSError, ValueError):
+                continue  # Removed meanwhile, or not one of ours
+        stills.sort(key=lambda still: still.captured_at)
+        return stills
+
+    def claim_oldest(self):
+        """Claims the oldest still nobody is uploading and returns it, or None."""
+        for still in self.pending():
+            with self.lock:
+                if still.upload_id not in self.claimed:
+                    self.claimed.add(still.upload_id)
+                    return still
+        return None
+
+    def release(self, still):
+        with self.lock:
+            self.claimed.discard(still.upload_id)
+
+    def remove(self, still):
+        try:
+            os.unlink(still.path)
+        except FileNotFoundError:
+            pass
+        self.release(still)
+
+    def enforce_limits(self):
+        """Drops unclaimed stills older than max_age, then the oldest ones until the spool fits max_bytes."""
+        stills = self.pending()
+        total = sum(still.size for still in stills)
+        now = time.time()
+        for still in stills:
+            too_old = now - still.captured_at > self.max_age
+            if not too_old and total <= self.max_bytes:
+                break
+            with self.lock:
+                if still.upload_id in self.claimed:
+                    continue
+            self.remove(still)
+            total -= still.size
+            self.dropped += 1
+            print(f"Spool limit reached, dropped still {still.upload_id}")
+
+    def stats(self):
+        stills = self.pending()
+        return {
+            'stills': len(stills),
+            'bytes': sum(still.size for still in stills),
+            'oldest': stills[0].captured_at if stills else None,
+            'dropped': self.dropped,
+        }
+
+
+def upload_still(sock, sender_id, still, chunk_size, max_rate=None, pause_event=None, progress=None,
+                 clock_offset=None):
+    """
+    Uploads a spooled still over a connected socket, resuming from whatever the receiver already holds.
+
+    max_rate limits the upload in bytes per second. While pause_event is set the upload waits between chunks, so
+    a backlog drain can step aside for a live upload. progress is called after every chunk. Returns once the
+    receiver reports the whole still on disk; raises ConnectionError if it reports less. clock_offset, the estimate of
+    receiver clock minus sender clock, lets the receiver measure the still's latency.
+    """
+    with open(still.path, 'rb') as file:
+        data = file.read()
+
+    timing = {'sensor_timestamp': still.sensor_timestamp, 'sent_at': time.time(), 'clock_offset': clock_offset}
+    sock.sendall(encode_still_offer(sender_id, still.upload_id, len(data), still.captured_at, timing))
+    offset = read_still_offset(sock)
+    if offset:
+        print(f"Resuming upload of {still.upload_id} at {offset} of {len(data)} bytes")
+
+    view = memoryview(data)
+    sent = offset
+    while sent < len(data):
+        while pause_event is not None and pause_event.is_set():
+            if progress is not None:
+                progress()
+            time.sleep(0.5)
+
+        chunk = view[sent:sent + chunk_size]
+        sendmsg_all(sock, [still_chunk_prefix(sent, len(chunk)), chunk])
+        sent += len(chunk)
+        if progress is not None:
+            progress()
+        if max_rate:
+            time.sleep(len(chunk) / max_rate)
+
+    # The receiver acknowledges every chunk with its offset; the last one tells whether it has everything
+    while offset < len(data):
+        offset = read_still_offset(sock)
+    if offset != len(data):
+        raise ConnectionError(f"Receiver holds {offset} of {len(data)} bytes of {still.upload_id}")
+
+
+def send_spooled_still(spool, still, resolve_receiver, port, sender_id, chunk_size, timeout=30, **upload_options):
+    """
+    Uploads a claimed still to port on the host resolve_receiver() returns, and removes it from the spool once the
+    receiver holds all of it. The claim is released whatever goes wrong, the name lookup failing during an outage
+    included, so the backlog drain sends the still later. Errors are raised to the caller.
+    """
+    try:
+        receiver_ip = resolve_receiver()
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as pic_socket:
+            pic_socket.settimeout(timeout)
+            pic_socket.connect((receiver_ip, port))
+            upload_still(pic_socket, sender_id, still, chunk_size, **upload_options)
+        spool.remove(still)
+    finally:
+        spool.release(still)
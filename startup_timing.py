@@ -0,0 +1,33 @@
+"""
+Startup phase timings of the sender.
+
+Imported before anything else, so phases are timed from (nearly) the start of the process. Each phase is recorded
+the first time it is reached, in seconds since then, and printed to the log; later marks of the same phase cost a
+dict lookup, so marks can sit on per-frame paths.
+"""
+
+import threading
+import time
+
+
+class StartupProfile:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.phases = {}
+        self.lock = threading.Lock()
+
+    def mark(self, phase):
+        if phase in self.phases:
+            return
+        with self.lock:
+            if phase in self.phases:
+                return
+            elapsed = time.monotonic() - self.started
+            self.phases[phase] = elapsed
+        print(f"Startup: {phase} after {elapsed:.2f} s")
+
+    def as_dict(self):
+        return dict(self.phases)
+
+
+startup = StartupProfile()
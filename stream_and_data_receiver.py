@@ -1,30 +1,124 @@
-import csv
-from flask import Flask, Response, url_for, render_template
+import asyncio
+import atexit
+import bisect
+import codecs
+import collections
+import hashlib
+import itertools
+import queue
+import re
+import socket
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, url_for, render_template, request
 import os
 import datetime
 import threading
-import socket
+import time
 import cv2
 import numpy as np
 import struct
 import json
+import math
+import mmap
+
+from werkzeug.security import safe_join
+
+import recorder
+from activity_index import ActivityIndex, thumbnail
+from frame_workers import FrameProcessPool, KIND_THUMBNAIL, KIND_TILE, fit_tile
+from latency import LatencyTracker
+from protocol import (SENSOR_HEADER, MSG_DATA, MSG_PING, PING_BODY, parse_header, decode_sensor_batch, encode_ack,
+                      encode_pong, encode_control, parse_frame_datagram, split_frame_timing, STILL_MAGIC, STILL_OFFER, STILL_CHUNK,
+                      OFFSET_BODY, decode_still_offer, encode_still_offset)
+from sensor_store import SensorStore
 
 
-class SingleItemQueue:
+class FrameBroadcast:
+    """
+    Holds the newest frame of one sender and wakes every viewer waiting on it.
+
+    Each put() bumps a sequence number, so a viewer only ever waits for a frame newer than the one it sent last.
+    A viewer that falls behind skips straight to the newest frame instead of queueing stale ones.
+    """
+
     def __init__(self):
         self.item = None
-        self.lock = threading.Lock()
+        self.seq = 0
+        self.updated_at = None
+        self.viewers = 0
+        self.skipped_frames = 0  # Frames that viewers never saw because a newer one replaced them first
+        self.condition = threading.Condition()
 
     def put(self, item):
-        with self.lock:
+        with self.condition:
             self.item = item
+            self.seq += 1
+            self.updated_at = time.time()
+            self.condition.notify_all()
 
     def get(self):
-        with self.lock:
-            return self.item
-
-    def is_empty(self):
-        return self.item is None
+        with self.condition:
+            return self.seq, self.item
+
+    def wait_newer(self, last_seq, timeout=None):
+        """
+        Blocks until a frame newer than last_seq is available or the timeout expires.
+        Returns (seq, item); item is None on timeout.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.seq > last_seq, timeout):
+                return last_seq, None
+            if last_seq:
+                self.skipped_frames += self.seq - last_seq - 1
+            return self.seq, self.item
+
+    def add_viewer(self):
+        with self.condition:
+            self.viewers += 1
+
+    def remove_viewer(self):
+        with self.condition:
+            self.viewers -= 1
+
+    def stats(self):
+        with self.condition:
+            return {
+                'seq': self.seq,
+                'viewers': self.viewers,
+                'skipped_frames': self.skipped_frames,
+                'last_frame_age': time.time() - self.updated_at if self.updated_at else None,
+            }
+
+
+class EncodedFrame:
+    """
+    A live frame as received from a sender: the JPEG bytes are kept untouched so they can be relayed to viewers
+    without a decode/re-encode round trip. Consumers that need pixels call pixels(), which decodes once per frame.
+    Frames that came with timing from their sender also know who sent them and when they arrived, for the latency
+    stats.
+    """
+
+    def __init__(self, jpeg, sender_id=None, received_at=None, timing=None):
+        self.jpeg = jpeg
+        self.sender_id = sender_id
+        self.received_at = received_at
+        self.timing = timing
+        self._pixels = None
+        self._decode_lock = threading.Lock()
+
+    def pixels(self):
+        """Returns the decoded BGR array (or None if the JPEG is corrupt), decoding on first use only."""
+        if self._pixels is None:
+            with self._decode_lock:
+                if self._pixels is None:
+                    self._pixels = cv2.imdecode(np.frombuffer(self.jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return self._pixels
+
+
+def is_jpeg(data):
+    # Cheap sanity check on the SOI/EOI markers instead of a full decode
+    return data[:2] == b'\xff\xd8' and data[-2:] == b'\xff\xd9'
 
 
 app = Flask(__name__)
@@ -33,23 +127,151 @@ VIDEO_STREAM_PORT = 5555
 DATA_PORT = 5556
 HIGH_RES_PIC_PORT = 5557
 
+# Ingest limits
+MAX_CONNECTIONS_PER_PORT = 64  # Extra connections on a port are closed right after accept
+CONNECTION_READ_TIMEOUT = 60  # Seconds without data before an ingest connection is dropped
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024  # Upper bound for a single framed payload, in bytes
+INGEST_WORKERS = os.cpu_count() or 2  # Threads for decoding and disk writes
+INGEST_MAX_PENDING_JOBS = INGEST_WORKERS * 4  # Jobs queued or running in the worker pool at once
+
+# Frame worker processes for mosaic tile decoding and still thumbnails, sharded by sender. 0 runs that work in the
+# receiver process itself; with more cameras than a core can decode for, set it to about the number of cores.
+FRAME_WORKER_PROCESSES = 0
+FRAME_WORKER_SLOTS = 4  # Shared-memory slots per worker, i.e. jobs it can have queued
+FRAME_WORKER_SLOT_SIZE = 16 * 1024 * 1024  # Bytes per slot; larger JPEGs are processed in the receiver process
+FRAME_WORKER_JOB_TIMEOUT = 10  # Seconds to wait for a worker before doing the job in the receiver process
+
+# High-res image writing
+IMAGE_WRITERS = 2  # Threads writing received stills to disk
+IMAGE_WRITER_MAX_QUEUED = 32  # Stills waiting to be written before ingest starts waiting on the writers
+SKIP_DUPLICATE_IMAGES = True  # Don't store a still whose bytes match a recent one from the same sender
+LATEST_IMAGES_PER_SENDER = 20  # Newest stills per sender kept in the in-memory index
+
+# Activity index of the stored stills
+ACTIVITY_INDEX_ENABLED = True
+ACTIVITY_INDEX_DIR = os.path.join("received_data", "activity_index")
+ACTIVITY_THUMBNAIL_SIZE = (32, 24)  # Width, height of the grayscale thumbnails the difference scores compare
+ACTIVITY_DEFAULT_RANGE = 24 * 60 * 60  # Seconds covered by /activity when no start is given
+
+# Resumable still uploads
+PARTIAL_UPLOADS_DIR = os.path.join("received_data", "partial_uploads")
+PARTIAL_UPLOAD_MAX_AGE = 7 * 24 * 60 * 60  # Seconds before an abandoned partial upload is deleted at startup
+COMPLETED_UPLOADS_REMEMBERED = 1000  # Recent upload ids answered as complete if a sender offers them again
+
+# Sensor data storage
+SENSOR_DB_PATH = os.path.join("received_data", "sensor_data.db")
+SENSOR_HISTORY_DEFAULT_RANGE = 24 * 60 * 60  # Seconds covered by /sensor_history when no start is given
+SENSOR_INLINE_DECODE_LIMIT = 64 * 1024  # Larger sensor messages are decoded in the worker pool
+LEGACY_SENSOR_MAX_BUFFER = 64 * 1024  # Bytes of unparsed bare-JSON sensor data before the connection is dropped
+
+# Viewer limits
+MAX_VIEWER_FPS = 15  # Default cap on frames sent to each /video_feed viewer, override with ?fps=
+VIEWER_WAIT_TIMEOUT = 5  # Seconds a viewer waits for a new frame before checking again
+
+# Multi-camera mosaic
+MOSAIC_SIZE = (1280, 720)  # Canvas size of /mosaic_feed, independent of the number of cameras
+MOSAIC_FPS = 5
+MOSAIC_JPEG_QUALITY = 70
+MOSAIC_ACTIVE_TIMEOUT = 10  # Seconds without frames before a camera is left out of the mosaic
+
+# Continuous recording of the live streams
+RECORDING_ENABLED = False
+RECORDING_DIR = "recordings"
+RECORDED_SENDERS = None  # Set of sender ids to record, None records every sender
+SEGMENT_DURATION = 300  # Seconds of video per segment file
+RECORDING_FLUSH_INTERVAL = 2  # Seconds between batched writes of the buffered frames
+RECORDING_CHUNK_SIZE = 1024 * 1024  # Bytes per chunk when serving segment byte ranges
+
+# UDP video mode (senders with VIDEO_TRANSPORT = 'udp'), served on VIDEO_STREAM_PORT alongside TCP
+UDP_VIDEO_ENABLED = True
+UDP_REASSEMBLY_DEADLINE = 0.25  # Seconds to wait for the missing fragments of a frame before dropping it
+UDP_MAX_PENDING_FRAMES = 4  # Incomplete frames kept per sender; the oldest is dropped to make room
+UDP_RECEIVE_BUFFER = 4 * 1024 * 1024  # Socket receive buffer, in bytes, so bursts of fragments aren't dropped
+
+# Dashboard push events
+EVENT_QUEUE_SIZE = 100  # Events buffered per subscriber; the oldest are dropped for subscribers that fall behind
+EVENT_KEEPALIVE_INTERVAL = 15  # Seconds between keepalive comments on an idle /events stream
+
 # Global variables
-frame_queue = SingleItemQueue()
-received_data = {}
+received_data = {}  # Latest sensor reading of each sender
 lock = threading.Lock()
 
-# Global dictionary to hold queues for each video stream
+# Global dictionary to hold the frame broadcast for each video stream
 video_stream_queues = {}
 #selected_cam = list(video_stream_queues)[0]
 selected_cam = 'rancho-cam'
 
 
-# Function to get or create a queue for a specific video stream
+class EventSubscription:
+    def __init__(self, sender_id, max_queued):
+        self.sender_id = sender_id
+        self.events = queue.Queue(maxsize=max_queued)
+
+    def deliver(self, event):
+        while True:
+            try:
+                self.events.put_nowait(event)
+                return
+            except queue.Full:
+                # A stalled client loses its oldest events rather than holding up the publisher
+                try:
+                    self.events.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def next_event(self, timeout=None):
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventHub:
+    """Fans out dashboard events to the /events subscribers, optionally filtered by sender."""
+
+    def __init__(self, max_queued_per_subscriber):
+        self.max_queued = max_queued_per_subscriber
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self, sender_id=None):
+        subscription = EventSubscription(sender_id, self.max_queued)
+        with self.lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def publish(self, event_type, data):
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            if subscription.sender_id is None or subscription.sender_id == data.get('sender_id'):
+                subscription.deliver((event_type, data))
+
+    def subscriber_count(self):
+        with self.lock:
+            return len(self.subscriptions)
+
+
+event_hub = EventHub(EVENT_QUEUE_SIZE)
+
+
+# Function to get or create the frame broadcast for a specific video stream, only called on ingest
 def get_video_stream_queue(stream_id):
     global video_stream_queues
-    if stream_id not in video_stream_queues:
-        video_stream_queues[stream_id] = SingleItemQueue()
-    return video_stream_queues[stream_id]
+    with lock:
+        if stream_id not in video_stream_queues:
+            video_stream_queues[stream_id] = FrameBroadcast()
+        return video_stream_queues[stream_id]
+
+
+def find_video_stream_queue(stream_id):
+    """The frame broadcast of a sender that has streamed video, or None. Viewers never create one."""
+    with lock:
+        return video_stream_queues.get(stream_id)
 
 
 # Directory to save high-resolution images
@@ -58,228 +280,825 @@ if not os.path.exists(HIGH_RES_IMAGES_DIR):
     os.makedirs(HIGH_RES_IMAGES_DIR)
 
 
-def handle_video_stream(client_socket):
-    try:
-        payload_size = struct.calcsize("Q")
-        data = b""
+class BoundedWorkerPool:
+    """
+    Thread pool for the blocking parts of ingest that must not run on the event loop: decoding large sensor batches,
+    the disk I/O of resumable still uploads, and waiting for room in the image writer queue when it is full. Live
+    video frames never go through it.
+
+    At most max_pending jobs are queued or running at once, so a burst of senders cannot grow memory without bound.
+    Nothing is dropped: a job finding the pool saturated waits for a slot, holding up its own connection only, and
+    is counted in waited.
+    """
+
+    def __init__(self, max_workers, max_pending):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ingest-worker')
+        self.slots = asyncio.Semaphore(max_pending)
+        self.max_pending = max_pending
+        self.pending = 0
+        self.waited = 0
+
+    async def run(self, fn, *args):
+        """Runs fn(*args) in the pool, waiting for a free slot first."""
+        if self.slots.locked():
+            self.waited += 1
+        async with self.slots:
+            self.pending += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+            finally:
+                self.pending -= 1
+
+
+class IngestServer:
+    """
+    Serves the VIDEO, DATA and HIGH_RES ports on a single asyncio event loop running in its own thread.
+
+    Each port has a connection cap and every read is bounded by a timeout, so flapping senders cannot pile up
+    idle connections. Handlers are coroutines taking (reader, writer). UDP ports are served on the same loop by
+    asyncio.DatagramProtocol factories.
+    """
+
+    def __init__(self, handlers, datagram_handlers=None, max_connections_per_port=MAX_CONNECTIONS_PER_PORT):
+        self.handlers = handlers  # {port: handler}
+        self.datagram_handlers = datagram_handlers or {}  # {port: protocol factory}
+        self.max_connections_per_port = max_connections_per_port
+        self.connections = {port: 0 for port in handlers}
+        self.rejected_connections = {port: 0 for port in handlers}
+        self.loop = None
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='ingest-loop', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        for port, handler in self.handlers.items():
+            self.loop.create_task(self._listen(port, handler))
+        for port, protocol_factory in self.datagram_handlers.items():
+            self.loop.create_task(self._listen_datagram(port, protocol_factory))
+        self.loop.run_forever()
+
+    async def _listen(self, port, handler):
+        while True:
+            try:
+                server = await asyncio.start_server(self._connection_callback(port, handler), '0.0.0.0', port,
+                                                    reuse_address=True)
+                print(f"Listening on port {port}")
+                async with server:
+                    await server.serve_forever()
+            except Exception as e:
+                print(f"Error setting up server on port {port}: {e}")
+                print(f"Retrying to listen on port {port}...")
+                await asyncio.sleep(5)
+
+    async def _listen_datagram(self, port, protocol_factory):
         while True:
-            # Receive the size of the sender's ID
-            while len(data) < payload_size:
-                packet = client_socket.recv(4 * 1024)
-                if not packet: return
-                data += packet
-
-            # Extract the size of the sender's ID
-            packed_id_size = data[:payload_size]
-            data = data[payload_size:]
-            id_size = struct.unpack("Q", packed_id_size)[0]
-
-            # Receive the sender's ID
-            while len(data) < id_size:
-                data += client_socket.recv(4 * 1024)
-
-            # Extract the sender's ID
-            sender_id = data[:id_size].decode()
-            data = data[id_size:]
-
-            # Receive the size of the image
-            while len(data) < payload_size:
-                data += client_socket.recv(4 * 1024)
-
-            # Extract the size of the image
-            packed_img_size = data[:payload_size]
-            data = data[payload_size:]
-            img_size = struct.unpack("Q", packed_img_size)[0]
-
-            # Receive the image
-            while len(data) < img_size:
-                data += client_socket.recv(4 * 1024)
-
-            # Extract the image
-            frame_data = data[:img_size]
-            data = data[img_size:]
-
-            # Process and put the frame in the appropriate queue
-            with lock:
-                frame = np.frombuffer(frame_data, dtype=np.uint8)
-                frame = cv2.imdecode(frame, cv2.IMREAD_COLOR)
-
-                if frame is not None:
-                    # Check if a queue exists for this sender, if not, create one
-                    if sender_id not in video_stream_queues:
-                        video_stream_queues[sender_id] = SingleItemQueue()
-
-                    video_stream_queues[sender_id].put(frame)
+            try:
+                await self.loop.create_datagram_endpoint(protocol_factory, local_addr=('0.0.0.0', port))
+                print(f"Listening on UDP port {port}")
+                return
+            except Exception as e:
+                print(f"Error setting up UDP endpoint on port {port}: {e}")
+                print(f"Retrying to listen on UDP port {port}...")
+                await asyncio.sleep(5)
+
+    def _connection_callback(self, port, handler):
+        async def on_connection(reader, writer):
+            addr = writer.get_extra_info('peername')
+            if self.connections[port] >= self.max_connections_per_port:
+                self.rejected_connections[port] += 1
+                print(f"Rejected connection from {addr} on port {port}: limit of "
+                      f"{self.max_connections_per_port} reached")
+                writer.close()
+                return
+
+            print(f"Connection from: {addr}")
+            self.connections[port] += 1
+            try:
+                await handler(reader, writer)
+            finally:
+                self.connections[port] -= 1
+                writer.close()
+
+        return on_connection
+
+    def stats(self):
+        return {
+            'connections': dict(self.connections),
+            'rejected_connections': dict(self.rejected_connections),
+            'pending_jobs': worker_pool.pending,
+            'max_pending_jobs': worker_pool.max_pending,
+            'waited_jobs': worker_pool.waited,
+            'image_writer': image_writer.stats(),
+            'sensor_store': sensor_store.stats(),
+            'event_subscribers': event_hub.subscriber_count(),
+            'recorder': stream_recorder.stats() if stream_recorder is not None else None,
+            'udp_video': frame_reassembler.stats(),
+            'still_uploads': dict(still_upload_stats, active=len(active_uploads)),
+            'activity_index': activity_index.stats() if activity_index is not None else None,
+            'frame_workers': frame_pool.stats() if frame_pool is not None else None,
+        }
+
+
+worker_pool = BoundedWorkerPool(INGEST_WORKERS, INGEST_MAX_PENDING_JOBS)
+
+
+async def read_exactly(reader, size):
+    # Raises asyncio.TimeoutError when the peer goes quiet and IncompleteReadError when it disconnects
+    return await asyncio.wait_for(reader.readexactly(size), CONNECTION_READ_TIMEOUT)
+
+
+async def read_id_and_payload(reader, prefix=b''):
+    """
+    Reads one message in the [id size][sender id][payload size][payload] format used by the video and high-res
+    senders. Returns (sender_id, payload) or None when the connection was closed between messages. prefix holds
+    bytes of the message already read by the caller.
+    """
+    payload_size = struct.calcsize("Q")
+    try:
+        packed_id_size = prefix + await read_exactly(reader, payload_size - len(prefix))
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise
 
-    except Exception as e:
-        print(f"Video stream connection lost: {e}")
-    finally:
-        client_socket.close()
+    id_size = struct.unpack("Q", packed_id_size)[0]
+    if id_size > MAX_MESSAGE_SIZE:
+        raise ValueError(f"Sender id of {id_size} bytes exceeds the message size limit")
+    sender_id = (await read_exactly(reader, id_size)).decode()
+
+    msg_size = struct.unpack("Q", await read_exactly(reader, payload_size))[0]
+    if msg_size > MAX_MESSAGE_SIZE:
+        raise ValueError(f"Payload of {msg_size} bytes from {sender_id} exceeds the message size limit")
+    payload = await read_exactly(reader, msg_size)
 
+    return sender_id, payload
 
-def save_received_data_to_csv(data, sender_id):
-    base_directory = "received_data"
-    sender_directory = os.path.join(base_directory, sender_id)
-    os.makedirs(sender_directory, exist_ok=True)  # Create the directory if it doesn't exist
 
-    # Path for the CSV file specific to the sender
-    received_data_file = os.path.join(sender_directory, "received_data.csv")
+stream_recorder = recorder.Recorder(RECORDING_DIR, SEGMENT_DURATION, RECORDING_FLUSH_INTERVAL,
+                                    senders=RECORDED_SENDERS) if RECORDING_ENABLED else None
 
-    file_exists = os.path.isfile(received_data_file)
-    with open(received_data_file, mode='a', newline='') as file:
-        writer = csv.DictWriter(file, fieldnames=data.keys())
 
-        if not file_exists:
-            writer.writeheader()  # Write the header only once
+latency_tracker = LatencyTracker()
 
-        writer.writerow(data)
-        print(f"Received data from {sender_id} appended to CSV file.")
 
+def record_frame_latency(sender_id, timing, received_at):
+    # capture_to_send is measured on the sender's clock alone; network needs its clock offset estimate
+    latency_tracker.record(sender_id, 'capture_to_send', timing['sent_at'] - timing['captured_at'])
+    latency_tracker.record(sender_id, 'network', received_at - (timing['sent_at'] + timing['clock_offset']))
 
-def handle_received_data(client_socket):
-    global received_data
+
+def publish_frame(sender_id, frame_data):
+    # Frames are relayed as received; decoding is left to the consumers that need pixels
+    received_at = time.time()
+    timing, frame_data = split_frame_timing(frame_data)
+    if is_jpeg(frame_data):
+        if timing is not None:
+            record_frame_latency(sender_id, timing, received_at)
+        get_video_stream_queue(sender_id).put(EncodedFrame(frame_data, sender_id, received_at, timing))
+        if stream_recorder is not None:
+            stream_recorder.record(sender_id, frame_data)
+
+
+async def handle_video_stream(reader, writer):
     try:
         while True:
-            data = client_socket.recv(1024).decode()
-            if not data: break
-            received_data = json.loads(data)
+            message = await read_id_and_payload(reader)
+            if message is None:
+                return
 
-            # Extract the sender's identifier
-            sender_id = received_data.pop('sender_id', 'Unknown')
+            sender_id, frame_data = message
+            publish_frame(sender_id, frame_data)
 
-            # Save data to CSV
-            save_received_data_to_csv(received_data, sender_id)
+    except Exception as e:
+        print(f"Video stream connection lost: {e!r}")
 
-            temperature = received_data.get('temperature', 'N/A')
-            humidity = received_data.get('humidity', 'N/A')
 
-            temperature_str = "{:.2f}°C".format(temperature) if isinstance(temperature, (int, float)) else 'N/A'
-            humidity_str = "{:.2f}%".format(humidity) if isinstance(humidity, (int, float)) else 'N/A'
+def seq_newer(seq, other):
+    """Whether frame sequence number seq comes after other, allowing for the uint32 wrap-around."""
+    return 0 < (seq - other) & 0xFFFFFFFF < 0x80000000
 
-            print(f"Data received from {sender_id}:")
-            print("Temperature: {}, Humidity: {}".format(temperature_str, humidity_str))
-            print("ALL DATA:")
-            print(received_data)
-    except Exception as e:
-        print(f"Sensor data connection lost: {e}")
-    finally:
-        client_socket.close()
 
+class PartialFrame:
+    __slots__ = ('started', 'chunks', 'missing')
+
+    def __init__(self, started, count):
+        self.started = started
+        self.chunks = [None] * count
+        self.missing = count
+
+
+class FrameReassembler:
+    """
+    Rebuilds live frames from the fragment datagrams of the UDP video mode.
+
+    A frame is delivered as soon as all its fragments are in. Frames still incomplete after the deadline, or once a
+    newer frame of the same sender has been delivered, are dropped: waiting for a lost datagram would only hold up
+    the frames behind it. Only called from the ingest loop, so it needs no locking.
+    """
+
+    REORDER_WINDOW = 64  # Frames further behind the last delivered one mean the sender restarted its numbering
+
+    def __init__(self, deadline, max_pending_per_sender):
+        self.deadline = deadline
+        self.max_pending_per_sender = max_pending_per_sender
+        self.pending = {}  # {sender_id: {seq: PartialFrame}}
+        self.last_delivered = {}  # {sender_id: seq}
+        self.last_sweep = 0
+        self.fragments = 0
+        self.frames = 0
+        self.incomplete_frames = 0
+        self.late_fragments = 0
+        self.invalid_datagrams = 0
+
+    def add(self, datagram):
+        """Adds one datagram. Returns (sender_id, frame bytes) when it completes a frame, otherwise None."""
+        try:
+            sender_id, seq, index, count, chunk = parse_frame_datagram(datagram)
+        except (ValueError, UnicodeDecodeError):
+            self.invalid_datagrams += 1
+            return None
+
+        now = time.monotonic()
+        if now - self.last_sweep >= self.deadline:
+            self._expire(now)
+        self.fragments += 1
+
+        last = self.last_delivered.get(sender_id)
+        if last is not None and not seq_newer(seq, last):
+            if (last - seq) & 0xFFFFFFFF <= self.REORDER_WINDOW:
+                self.late_fragments += 1
+                return None
+            del self.last_delivered[sender_id]  # The sender restarted, start over from its new numbering
+
+        frames = self.pending.setdefault(sender_id, {})
+        frame = frames.get(seq)
+        if frame is None:
+            if len(frames) >= self.max_pending_per_sender:
+                oldest = min(frames, key=lambda s: frames[s].started)
+                del frames[oldest]
+                self.incomplete_frames += 1
+            frame = frames[seq] = PartialFrame(now, count)
+        elif len(frame.chunks) != count:
+            self.invalid_datagrams += 1
+            return None
+
+        if frame.chunks[index] is None:
+            frame.chunks[index] = chunk
+            frame.missing -= 1
+        if frame.missing:
+            return None
+
+        del frames[seq]
+        # Older frames of this sender could only complete out of order now
+        for other in [s for s in frames if seq_newer(seq, s)]:
+            del frames[other]
+            self.incomplete_frames += 1
+        self.last_delivered[sender_id] = seq
+        self.frames += 1
+        return sender_id, b''.join(frame.chunks)
+
+    def _expire(self, now):
+        self.last_sweep = now
+        for frames in self.pending.values():
+            for seq in [s for s, frame in frames.items() if now - frame.started > self.deadline]:
+                del frames[seq]
+                self.incomplete_frames += 1
+
+    def stats(self):
+        return {
+            'fragments': self.fragments,
+            'frames': self.frames,
+            'incomplete_frames': self.incomplete_frames,
+            'late_fragments': self.late_fragments,
+            'invalid_datagrams': self.invalid_datagrams,
+        }
+
+
+frame_reassembler = FrameReassembler(UDP_REASSEMBLY_DEADLINE, UDP_MAX_PENDING_FRAMES)
+
+
+class VideoDatagramProtocol(asyncio.DatagramProtocol):
+    def connection_made(self, transport):
+        sock = transport.get_extra_info('socket')
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RECEIVE_BUFFER)
+        except OSError as e:
+            print(f"Could not enlarge the UDP receive buffer: {e}")
+
+    def datagram_received(self, data, addr):
+        frame = frame_reassembler.add(data)
+        if frame is not None:
+            publish_frame(*frame)
+
+
+sensor_store = SensorStore(SENSOR_DB_PATH)
+
+
+def store_sensor_samples(sender_id, samples):
+    for sample in samples:
+        sample.pop('sender_id', None)
+        # Queue the reading for the next batched commit
+        sensor_store.add(sender_id, sample)
+
+    if not samples:
+        return
+    latest_sample = samples[-1]
+    received_data[sender_id] = latest_sample
+    event_hub.publish('sensor', {'sender_id': sender_id, 'data': latest_sample})
+
+    temperature = latest_sample.get('temperature', 'N/A')
+    humidity = latest_sample.get('humidity', 'N/A')
 
-def handle_high_res_picture(client_socket):
+    temperature_str = "{:.2f}°C".format(temperature) if isinstance(temperature, (int, float)) else 'N/A'
+    humidity_str = "{:.2f}%".format(humidity) if isinstance(humidity, (int, float)) else 'N/A'
+
+    print(f"Data received from {sender_id} ({len(samples)} samples):")
+    print("Temperature: {}, Humidity: {}".format(temperature_str, humidity_str))
+    print("ALL DATA:")
+    print(latest_sample)
+
+
+def latest_sensor_data(sender_id):
+    """The latest reading of a sender, from the store if it hasn't reported since the receiver started."""
+    data = received_data.get(sender_id)
+    if data is None:
+        data = sensor_store.latest(sender_id) or {}
+    return data
+
+
+async def handle_legacy_received_data(reader, data):
+    """
+    Senders predating the framed protocol write bare JSON objects back to back. They are split with raw_decode on
+    a growing buffer, so objects coalesced into one segment or split across several are still parsed.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()  # Chunks may split a multi-byte character
+    buffer = text_decoder.decode(data)
+    while True:
+        buffer = buffer.lstrip()
+        try:
+            message, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            if len(buffer) > LEGACY_SENSOR_MAX_BUFFER:
+                raise ValueError("Unparseable legacy sensor data")
+            chunk = await asyncio.wait_for(reader.read(4 * 1024), CONNECTION_READ_TIMEOUT)
+            if not chunk:
+                return
+            buffer += text_decoder.decode(chunk)
+            continue
+
+        buffer = buffer[end:]
+        store_sensor_samples(message.pop('sender_id', 'Unknown'), [message])
+
+
+sensor_links = {}  # {sender_id: stream writer of its sensor data connection}, to send it CONTROL messages
+
+
+async def handle_received_data(reader, writer):
+    sender_id = None
     try:
-        payload_size = struct.calcsize("Q")
-        data = b""
-        while True:
-            # First, receive the size of the sender's ID
-            while len(data) < payload_size:
-                packet = client_socket.recv(4 * 1024)
-                if not packet: return
-                data += packet
+        first_byte = await read_exactly(reader, 1)
+        if first_byte == b'{':
+            await handle_legacy_received_data(reader, first_byte)
+            return
 
-            # Extract the size of the sender's ID
-            packed_id_size = data[:payload_size]
-            data = data[payload_size:]
-            id_size = struct.unpack("Q", packed_id_size)[0]
+        header = first_byte + await read_exactly(reader, SENSOR_HEADER.size - 1)
+        while True:
+            msg_type, flags, length = parse_header(header)
+            body = await read_exactly(reader, length)
+
+            if msg_type == MSG_DATA:
+                # A backlog flush can carry thousands of samples, decode it off the event loop
+                if length > SENSOR_INLINE_DECODE_LIMIT:
+                    sender_id, samples = await worker_pool.run(decode_sensor_batch, flags, body)
+                else:
+                    sender_id, samples = decode_sensor_batch(flags, body)
+                store_sensor_samples(sender_id, samples)
+                sensor_links[sender_id] = writer
+                writer.write(encode_ack(len(samples)))
+                await writer.drain()
+
+            elif msg_type == MSG_PING:
+                # Answered right away, the sender's clock offset estimate depends on the round trip being short
+                writer.write(encode_pong(PING_BODY.unpack(body)[0], time.time()))
+                await writer.drain()
+
+            try:
+                header = await read_exactly(reader, SENSOR_HEADER.size)
+            except asyncio.IncompleteReadError as e:
+                if not e.partial:
+                    return  # Closed between messages
+                raise
+
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            print(f"Sensor data connection lost: {e!r}")
+    except Exception as e:
+        print(f"Sensor data connection lost: {e!r}")
+    finally:
+        if sensor_links.get(sender_id) is writer:
+            del sensor_links[sender_id]
+
+
+def send_control(sender_id, commands):
+    """Sends a CONTROL message to a sender over its sensor data connection. Returns False if it isn't connected."""
+    writer = sensor_links.get(sender_id)
+    if writer is None:
+        return False
+    ingest_server.loop.call_soon_threadsafe(writer.write, encode_control(commands))
+    return True
+
+
+class LatestImageIndex:
+    """
+    Keeps the paths of the newest stills of every sender in memory, so finding the latest image never touches the
+    disk. Paths are relative to the static folder, e.g. 'high_res_images/<sender>/<YYYY-MM-DD>/<HH-MM-SS-mmm>.jpg',
+    which also makes them sort chronologically within a sender.
+    """
+
+    def __init__(self, images_dir, max_per_sender=20):
+        self.images_dir = images_dir
+        self.max_per_sender = max_per_sender
+        self.images = {}  # {sender_id: sorted list of relative paths, oldest first}
+        self.lock = threading.Lock()
 
-            # Now, receive the sender's ID
-            while len(data) < id_size:
-                data += client_socket.recv(4 * 1024)
+    def add(self, sender_id, relative_path):
+        with self.lock:
+            images = self.images.setdefault(sender_id, [])
+            # Writers may finish out of order, so insert in place instead of appending
+            position = bisect.bisect_left(images, relative_path)
+            if position < len(images) and images[position] == relative_path:
+                return
+            images.insert(position, relative_path)
+            if len(images) > self.max_per_sender:
+                del images[0]
+
+    def latest(self, sender_id):
+        with self.lock:
+            images = self.images.get(sender_id)
+            return images[-1] if images else None
 
-            # Extract the sender's ID
-            sender_id = data[:id_size].decode()
-            data = data[id_size:]
+    def recent(self, sender_id):
+        """Returns the indexed stills of a sender, newest first."""
+        with self.lock:
+            return list(reversed(self.images.get(sender_id, [])))
 
-            print(f"Received high-resolution image from sender: {sender_id}")
+    def senders(self):
+        with self.lock:
+            return sorted(self.images)
+
+    def rebuild(self):
+        """Fills the index from disk, reading only as many date folders per sender as needed. Called once at startup."""
+        base_directory = os.path.relpath(self.images_dir, app.static_folder)
+        images = {}
+        if os.path.isdir(self.images_dir):
+            for sender_id in os.listdir(self.images_dir):
+                sender_directory = os.path.join(self.images_dir, sender_id)
+                if not os.path.isdir(sender_directory):
+                    continue
+
+                found = []
+                for current_date in sorted(os.listdir(sender_directory), reverse=True):
+                    date_directory = os.path.join(sender_directory, current_date)
+                    if not os.path.isdir(date_directory):
+                        continue
+                    files = sorted((f for f in os.listdir(date_directory) if f.endswith('.jpg')), reverse=True)
+                    found.extend(os.path.join(base_directory, sender_id, current_date, f).replace('\\', '/')
+                                 for f in files[:self.max_per_sender - len(found)])
+                    if len(found) >= self.max_per_sender:
+                        break
+
+                if found:
+                    images[sender_id] = sorted(found)
 
-            # Next, receive the size of the image
-            while len(data) < payload_size:
-                data += client_socket.recv(4 * 1024)
+        with self.lock:
+            self.images = images
+        print(f"Indexed latest high-resolution images of {len(images)} senders")
 
-            # Extract the size of the image
-            packed_msg_size = data[:payload_size]
-            data = data[payload_size:]
-            msg_size = struct.unpack("Q", packed_msg_size)[0]
 
-            # Now, receive the image
-            while len(data) < msg_size:
-                data += client_socket.recv(4 * 1024)
+latest_images = LatestImageIndex(HIGH_RES_IMAGES_DIR, LATEST_IMAGES_PER_SENDER)
 
-            # Extract the image
-            frame_data = data[:msg_size]
-            data = data[msg_size:]
 
-            # Process and save the image
-            image = np.frombuffer(frame_data, dtype=np.uint8)
-            image = cv2.imdecode(image, cv2.IMREAD_COLOR)
+def still_name(taken_at):
+    """<YYYY-MM-DD>/<HH-MM-SS-mmm> of a still taken at the unix timestamp taken_at, without the extension."""
+    taken = datetime.datetime.fromtimestamp(taken_at)
+    return taken.strftime("%Y-%m-%d/%H-%M-%S-") + f'{taken.microsecond // 1000:03d}'
 
-            # Current date and time
-            current_date = datetime.datetime.now().strftime("%Y-%m-%d")
-            current_time = datetime.datetime.now().strftime("%H-%M-%S")
 
-            # Create directory path for current date and sender ID
-            date_directory = os.path.join(HIGH_RES_IMAGES_DIR, sender_id, current_date)
+def link_new_name(temp_path, base_path):
+    """
+    Links temp_path to base_path.jpg, or to base_path_1.jpg, base_path_2.jpg... if that is taken, and returns the
+    path used. Never replaces a still already stored, even one taken in the same millisecond.
+    """
+    for attempt in itertools.count():
+        path = f'{base_path}_{attempt}.jpg' if attempt else base_path + '.jpg'
+        try:
+            os.link(temp_path, path)
+            return path
+        except FileExistsError:
+            continue
 
-            # Make sure the directory exists
-            os.makedirs(date_directory, exist_ok=True)
 
-            # Define the full path for the image
-            image_path = os.path.join(date_directory, f'{current_time}.jpg')
+class ImageWriterPool:
+    """
+    Background threads that write received stills to disk exactly as they arrived.
+
+    Each image goes to a temporary file in the destination folder and is then renamed into place, so readers never
+    see a partially written JPEG. Byte-identical repeats from the same sender can be skipped by content hash.
+    """
+
+    def __init__(self, num_writers, max_queued, skip_duplicates=True, dedup_history=32):
+        self.jobs = queue.Queue(maxsize=max_queued)
+        self.skip_duplicates = skip_duplicates
+        self.recent_hashes = {}  # {sender_id: deque of recent content hashes}
+        self.dedup_history = dedup_history
+        self.stats_lock = threading.Lock()
+        self.written = 0
+        self.duplicates_skipped = 0
+        self.failed = 0
+        self.last_write_latency = None
+        self.max_write_latency = 0.0
+        self.total_write_latency = 0.0
+
+        for i in range(num_writers):
+            threading.Thread(target=self._run, name=f'image-writer-{i}', daemon=True).start()
+
+    def submit(self, sender_id, image_data, timeout=None, captured_at=None):
+        """
+        Queues an image for writing, blocking while the queue is full. Raises queue.Full after timeout.
+        The image is named after captured_at, when the sender provided it, or else the time it arrived.
+        """
+        self.jobs.put((sender_id, image_data, captured_at or time.time()), timeout=timeout)
+
+    def submit_nowait(self, sender_id, image_data, captured_at=None):
+        """Queues an image for writing. Returns False without queueing when the queue is full."""
+        try:
+            self.jobs.put_nowait((sender_id, image_data, captured_at or time.time()))
+            return True
+        except queue.Full:
+            return False
 
-            # Save the image
-            cv2.imwrite(image_path, image)
-            print("Saved high-resolution image:", image_path)
+    def _run(self):
+        while True:
+            sender_id, image_data, taken_at = self.jobs.get()
+            try:
+                self._write(sender_id, image_data, taken_at)
+            except Exception as e:
+                with self.stats_lock:
+                    self.failed += 1
+                print(f"Error saving high-resolution image from {sender_id}: {e!r}")
+            finally:
+                self.jobs.task_done()
+
+    def _is_duplicate(self, sender_id, image_data):
+        digest = hashlib.blake2b(image_data, digest_size=16).digest()
+        with self.stats_lock:
+            recent = self.recent_hashes.setdefault(sender_id, collections.deque(maxlen=self.dedup_history))
+            if digest in recent:
+                self.duplicates_skipped += 1
+                return True
+            recent.append(digest)
+            return False
+
+    def _write(self, sender_id, image_data, taken_at):
+        if self.skip_duplicates and self._is_duplicate(sender_id, image_data):
+            print(f"Skipped duplicate high-resolution image from {sender_id}")
+            return
+
+        # The file is named after the time it was captured (or arrived), not the time it was written
+        sender_directory = os.path.join(HIGH_RES_IMAGES_DIR, sender_id)
+        base_path = os.path.join(sender_directory, still_name(taken_at))
+        os.makedirs(os.path.dirname(base_path), exist_ok=True)
+
+        started = time.monotonic()
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(base_path), prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(image_data)
+            os.chmod(temp_path, 0o644)  # mkstemp creates owner-only files
+            image_path = link_new_name(temp_path, base_path)
+        finally:
+            os.unlink(temp_path)
+        latency = time.monotonic() - started
+
+        with self.stats_lock:
+            self.written += 1
+            self.last_write_latency = latency
+            self.max_write_latency = max(self.max_write_latency, latency)
+            self.total_write_latency += latency
+        relative_path = os.path.relpath(image_path, app.static_folder).replace('\\', '/')
+        latest_images.add(sender_id, relative_path)
+        if activity_index is not None:
+            try:
+                name = os.path.relpath(image_path, sender_directory).replace('\\', '/')
+                activity_index.add(sender_id, taken_at, image_data, name)
+            except Exception as e:
+                print(f"Error indexing high-resolution image from {sender_id}: {e!r}")
+        event_hub.publish('image', {'sender_id': sender_id, 'url': f'{app.static_url_path}/{relative_path}'})
+        print("Saved high-resolution image:", image_path)
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                'queue_depth': self.jobs.qsize(),
+                'max_queued': self.jobs.maxsize,
+                'written': self.written,
+                'duplicates_skipped': self.duplicates_skipped,
+                'failed': self.failed,
+                'last_write_latency': self.last_write_latency,
+                'avg_write_latency': self.total_write_latency / self.written if self.written else None,
+                'max_write_latency': self.max_write_latency,
+            }
+
+
+frame_pool = FrameProcessPool(FRAME_WORKER_PROCESSES, FRAME_WORKER_SLOTS, FRAME_WORKER_SLOT_SIZE,
+                              FRAME_WORKER_JOB_TIMEOUT) if FRAME_WORKER_PROCESSES else None
+
+
+def still_thumbnail(sender_id, jpeg, size):
+    if frame_pool is None:
+        return thumbnail(jpeg, size)
+    return frame_pool.run(sender_id, KIND_THUMBNAIL, jpeg, size)[0]
+
+
+activity_index = ActivityIndex(ACTIVITY_INDEX_DIR, ACTIVITY_THUMBNAIL_SIZE,
+                               thumbnailer=still_thumbnail) if ACTIVITY_INDEX_ENABLED else None
+image_writer = ImageWriterPool(IMAGE_WRITERS, IMAGE_WRITER_MAX_QUEUED, skip_duplicates=SKIP_DUPLICATE_IMAGES)
+
+
+VALID_UPLOAD_NAME = re.compile(r'^[A-Za-z0-9._-]+$')
+
+
+class PartialUpload:
+    """The part of a resumable still upload received so far, kept on disk across connections and restarts."""
+
+    def __init__(self, sender_id, upload_id, size, captured_at):
+        if not (VALID_UPLOAD_NAME.match(sender_id) and VALID_UPLOAD_NAME.match(upload_id)):
+            raise ValueError(f"Invalid upload {sender_id!r}/{upload_id!r}")
+        if size > MAX_MESSAGE_SIZE:
+            raise ValueError(f"Upload of {size} bytes from {sender_id} exceeds the message size limit")
+        self.sender_id = sender_id
+        self.upload_id = upload_id
+        self.size = size
+        self.captured_at = captured_at
+        directory = os.path.join(PARTIAL_UPLOADS_DIR, sender_id)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, upload_id + '.part')
+        self.offset = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if self.offset > size:
+            os.truncate(self.path, 0)
+            self.offset = 0
+
+    def append(self, offset, data):
+        """Writes the part of data past what is already on disk and returns the new offset."""
+        if offset > self.offset:
+            raise ValueError(f"Chunk at {offset} leaves a gap after {self.offset} in {self.upload_id}")
+        new_data = data[self.offset - offset:]
+        if len(new_data) > self.size - self.offset:
+            raise ValueError(f"Chunk runs past the {self.size} bytes of {self.upload_id}")
+        if new_data:
+            with open(self.path, 'ab') as file:
+                file.write(new_data)
+            self.offset += len(new_data)
+        return self.offset
+
+    def take(self):
+        """Returns the complete upload and deletes it from disk."""
+        with open(self.path, 'rb') as file:
+            data = file.read()
+        os.unlink(self.path)
+        return data
+
+
+active_uploads = set()  # (sender_id, upload_id) of the uploads a connection is receiving
+completed_uploads = collections.OrderedDict()  # (sender_id, upload_id) -> size, most recent last
+still_upload_stats = {'completed': 0, 'resumed': 0, 'bytes': 0}
+
+
+def remove_stale_partial_uploads():
+    cutoff = time.time() - PARTIAL_UPLOAD_MAX_AGE
+    for root, _, files in os.walk(PARTIAL_UPLOADS_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.getmtime(path) < cutoff:
+                os.unlink(path)
+                print(f"Removed abandoned partial upload {path}")
+
+
+async def handle_still_upload(reader, writer, prefix):
+    """Serves resumable still uploads (see protocol.py) until the sender closes the connection."""
+    upload = None
+    offer = {}
+    try:
+        header = prefix + await read_exactly(reader, SENSOR_HEADER.size - len(prefix))
+        while True:
+            msg_type, flags, length = parse_header(header, STILL_MAGIC)
+            body = await read_exactly(reader, length)
+
+            if msg_type == STILL_OFFER:
+                sender_id, upload_id, size, captured_at, offer = decode_still_offer(body)
+                key = (sender_id, upload_id)
+                if key in completed_uploads:
+                    offset = completed_uploads[key]
+                else:
+                    if key in active_uploads:
+                        raise ValueError(f"Upload {upload_id} from {sender_id} is already in progress")
+                    upload = await worker_pool.run(PartialUpload, sender_id, upload_id, size, captured_at)
+                    active_uploads.add(key)
+                    offset = upload.offset
+                    if offset:
+                        still_upload_stats['resumed'] += 1
+                        print(f"Resuming upload {upload_id} from {sender_id} at {offset} of {size} bytes")
+                writer.write(encode_still_offset(offset))
+
+            elif msg_type == STILL_CHUNK and upload is not None:
+                offset = OFFSET_BODY.unpack_from(body)[0]
+                chunk = memoryview(body)[OFFSET_BODY.size:]
+                previous_offset = upload.offset
+                offset = await worker_pool.run(upload.append, offset, chunk)
+                still_upload_stats['bytes'] += offset - previous_offset
+
+                if offset == upload.size:
+                    image_data = await worker_pool.run(upload.take)
+                    key = (upload.sender_id, upload.upload_id)
+                    completed_uploads[key] = upload.size
+                    while len(completed_uploads) > COMPLETED_UPLOADS_REMEMBERED:
+                        completed_uploads.popitem(last=False)
+                    active_uploads.discard(key)
+                    still_upload_stats['completed'] += 1
+                    if upload.captured_at is not None and offer.get('clock_offset') is not None:
+                        latency_tracker.record(upload.sender_id, 'still_capture_to_received',
+                                               time.time() - (upload.captured_at + offer['clock_offset']))
+                    print(f"Received high-resolution image from sender: {upload.sender_id}")
+                    if not image_writer.submit_nowait(upload.sender_id, image_data, upload.captured_at):
+                        await worker_pool.run(image_writer.submit, upload.sender_id, image_data, None,
+                                              upload.captured_at)
+                    upload = None
+                writer.write(encode_still_offset(offset))
+
+            else:
+                raise ValueError(f"Unexpected still upload message type {msg_type}")
+            await writer.drain()
+
+            try:
+                header = await read_exactly(reader, SENSOR_HEADER.size)
+            except asyncio.IncompleteReadError as e:
+                if not e.partial:
+                    return
+                raise
 
     except Exception as e:
-        print(f"High-res picture connection lost: {e}")
+        print(f"Still upload connection lost: {e!r}")
     finally:
-        client_socket.close()
+        if upload is not None:
+            active_uploads.discard((upload.sender_id, upload.upload_id))
 
 
-def listen_for_connections(port, handler):
-    while True:
+async def handle_high_res_picture(reader, writer):
+    try:
+        # Resumable uploads start with their magic; anything else is the one-shot [id][payload] format
         try:
-            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            server_socket.bind(('0.0.0.0', port))
-            server_socket.listen()
-            print(f"Listening on port {port}")
+            prefix = await read_exactly(reader, len(STILL_MAGIC))
+        except asyncio.IncompleteReadError:
+            return
+        if prefix == STILL_MAGIC:
+            await handle_still_upload(reader, writer, prefix)
+            return
 
-            while True:
-                client_socket, addr = server_socket.accept()
-                print(f"Connection from: {addr}")
-                client_thread = threading.Thread(target=handler, args=(client_socket,))
-                client_thread.start()
-        except Exception as e:
-            print(f"Error setting up server on port {port}: {e}")
-            server_socket.close()
-            print(f"Retrying to listen on port {port}...")
-            continue
+        while True:
+            message = await read_id_and_payload(reader, prefix)
+            prefix = b''
+            if message is None:
+                return
 
+            sender_id, frame_data = message
+            print(f"Received high-resolution image from sender: {sender_id}")
 
-def get_latest_high_res_image():
-    current_date = datetime.datetime.now().strftime("%Y-%m-%d")
-    base_directory = os.path.join('high_res_images')
-    full_base_path = os.path.join(app.static_folder, base_directory)
+            # Hand the bytes to the writers and go straight back to reading the socket. Only when the writer
+            # queue is full does this connection wait, in a worker thread so the event loop keeps running.
+            if not image_writer.submit_nowait(sender_id, frame_data):
+                await worker_pool.run(image_writer.submit, sender_id, frame_data)
 
-    if os.path.exists(full_base_path):
-        # List and sort subdirectories alphabetically
-        subdirectories = sorted([d for d in os.listdir(full_base_path) if os.path.isdir(os.path.join(full_base_path, d))])
-        if subdirectories:
-            # Select the first subdirectory alphabetically
-            #selected_subdirectory = subdirectories[0]
-            selected_subdirectory = selected_cam
-            date_directory = os.path.join(selected_subdirectory, current_date)
-            full_path = os.path.join(app.static_folder, base_directory, date_directory)
+    except Exception as e:
+        print(f"High-res picture connection lost: {e!r}")
 
-            if os.path.exists(full_path):
-                # List files in the date directory
-                files = sorted([f for f in os.listdir(full_path) if os.path.isfile(os.path.join(full_path, f))], key=lambda x: os.path.getmtime(os.path.join(full_path, x)), reverse=True)
-                if files:
-                    # Construct the relative path to the file
-                    relative_path = os.path.join(base_directory, date_directory, files[0]).replace('\\', '/')
 
-                    return relative_path
+ingest_server = IngestServer({
+    VIDEO_STREAM_PORT: handle_video_stream,
+    DATA_PORT: handle_received_data,
+    HIGH_RES_PIC_PORT: handle_high_res_picture,
+}, datagram_handlers={VIDEO_STREAM_PORT: VideoDatagramProtocol} if UDP_VIDEO_ENABLED else None)
+
+
+def get_latest_high_res_image(sender_id=None):
+    # Served from the in-memory index, kept up to date by the image writers
+    latest_image = latest_images.latest(sender_id or selected_cam)
+    if latest_image:
+        return latest_image
 
     #return os.path.join(app.static_folder, 'no-image-available.jpg').replace('\\', '/')
     return 'no-image-available.jpg'
@@ -287,7 +1106,7 @@ def get_latest_high_res_image():
 
 @app.route('/latest_image_url')
 def latest_image_url():
-    latest_image = get_latest_high_res_image()  # This function returns the latest image's relative path
+    latest_image = get_latest_high_res_image(request.args.get('sender'))  # This function returns the latest image's relative path
     if latest_image:
         return url_for('static', filename=latest_image)
     else:
@@ -296,43 +1115,387 @@ def latest_image_url():
 
 @app.route('/')
 def index():
-    latest_image = get_latest_high_res_image()
-    stream_url = url_for('video_feed')
-    # Use global sensor data
-    global received_data
-    return render_template('receiver_index.html', stream_url=stream_url, latest_image=latest_image, sensor_data=received_data)
+    sender_id = request.args.get('sender', selected_cam)
+    latest_image = get_latest_high_res_image(sender_id)
+    stream_url = url_for('video_feed', sender=sender_id)
+    return render_template('receiver_index.html', stream_url=stream_url, latest_image=latest_image,
+                           sensor_data=latest_sensor_data(sender_id), sender_id=sender_id)
+
+
+# Reduced-scale JPEG decode modes, largest reduction first
+REDUCED_DECODE_FLAGS = ((cv2.IMREAD_REDUCED_COLOR_8, 8), (cv2.IMREAD_REDUCED_COLOR_4, 4),
+                        (cv2.IMREAD_REDUCED_COLOR_2, 2))
+
+
+class MosaicRenderer:
+    """
+    Tiles the latest frame of every active sender into one fixed-size canvas and publishes it as a single JPEG
+    stream, so the bitrate stays bounded no matter how many cameras report.
+
+    The canvas is allocated once per layout. Only tiles whose sender delivered a new frame since the last render
+    are decoded (at reduced JPEG scale when the tile is small enough) and resized into place, and nothing is
+    encoded while no tile changed. Rendering stops while nobody is watching.
+    """
+
+    def __init__(self, size, fps, quality, active_timeout):
+        self.width, self.height = size
+        self.interval = 1.0 / fps
+        self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        self.active_timeout = active_timeout
+        self.output = FrameBroadcast()
+        self.canvas = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        self.layout = []  # Sender ids in tile order
+        self.tile_seqs = {}  # {sender_id: seq of the frame currently drawn}
+        self.source_sizes = {}  # {sender_id: (width, height) of its frames at full scale}
+        self.thread = None
+        self.start_lock = threading.Lock()
+
+    def ensure_running(self):
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='mosaic-renderer', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            started = time.monotonic()
+            if self.output.viewers > 0:
+                try:
+                    self.render()
+                except Exception as e:
+                    print(f"Error rendering mosaic: {e!r}")
+            time.sleep(max(self.interval - (time.monotonic() - started), 0.01))
+
+    def _active_streams(self):
+        now = time.time()
+        with lock:
+            streams = dict(video_stream_queues)
+        return {stream_id: stream_queue for stream_id, stream_queue in sorted(streams.items())
+                if stream_queue.updated_at and now - stream_queue.updated_at < self.active_timeout}
+
+    def _tile_rect(self, index, count):
+        cols = math.ceil(math.sqrt(count))
+        rows = math.ceil(count / cols)
+        tile_w, tile_h = self.width // cols, self.height // rows
+        row, col = divmod(index, cols)
+        return col * tile_w, row * tile_h, tile_w, tile_h
+
+    def _decode_flag(self, stream_id, tile_w, tile_h):
+        # libjpeg can decode straight to 1/2, 1/4 or 1/8 scale, far cheaper than a full decode plus resize. The
+        # largest reduction that still covers the tile is picked from the size of the sender's previous frame.
+        source_size = self.source_sizes.get(stream_id)
+        if source_size:
+            width, height = source_size
+            scale = min(tile_w / width, tile_h / height)
+            for reduced_flag, factor in REDUCED_DECODE_FLAGS:
+                if scale * factor <= 1:
+                    return reduced_flag
+        return cv2.IMREAD_COLOR
+
+    def render(self):
+        streams = self._active_streams()
+        layout = list(streams)
+        if layout != self.layout:
+            # Cameras came or went: start over with a blank canvas and redraw every tile
+            self.layout = layout
+            self.tile_seqs = {}
+            self.source_sizes = {}
+            self.canvas[:] = 0
+
+        # Decode every changed tile first: with frame worker processes they are all decoded in parallel
+        tiles = []
+        for index, stream_id in enumerate(layout):
+            seq, frame = streams[stream_id].get()
+            if frame is None or self.tile_seqs.get(stream_id) == seq:
+                continue
+            rect = self._tile_rect(index, len(layout))
+            args = (rect[2], rect[3], self._decode_flag(stream_id, rect[2], rect[3]))
+            future = frame_pool.submit(stream_id, KIND_TILE, frame.jpeg, args) if frame_pool is not None else None
+            tiles.append((stream_id, seq, frame, rect, args, future))
+
+        changed = False
+        for stream_id, seq, frame, (x, y, tile_w, tile_h), args, future in tiles:
+            if frame_pool is not None:
+                image, source_size = frame_pool.result(future, KIND_TILE, frame.jpeg, args)
+            else:
+                image, source_size = fit_tile(frame.jpeg, *args)
+            if image is None:
+                continue
+            if source_size:
+                self.source_sizes[stream_id] = source_size
+
+            # The frame is fitted inside the tile keeping its aspect ratio, centre it
+            fit_h, fit_w = image.shape[:2]
+            off_x, off_y = x + (tile_w - fit_w) // 2, y + (tile_h - fit_h) // 2
+            self.canvas[off_y:off_y + fit_h, off_x:off_x + fit_w] = image
+            cv2.putText(self.canvas, stream_id, (x + 8, y + 24), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+
+            self.tile_seqs[stream_id] = seq
+            changed = True
+
+        if changed:
+            ret, buffer = cv2.imencode('.jpg', self.canvas, self.encode_params)
+            if ret:
+                self.output.put(EncodedFrame(buffer.tobytes()))
 
 
-def generate_frames_for_stream(stream_id):
-    while True:
-        stream_queue = video_stream_queues.get(stream_id)
-        if stream_queue and not stream_queue.is_empty():
-            frame = stream_queue.get()
-            ret, buffer = cv2.imencode('.jpg', frame)
-            if ret:
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
+mosaic_renderer = MosaicRenderer(MOSAIC_SIZE, MOSAIC_FPS, MOSAIC_JPEG_QUALITY, MOSAIC_ACTIVE_TIMEOUT)
+
+
+def generate_frames(stream_queue, max_fps=MAX_VIEWER_FPS):
+    min_interval = 1.0 / max_fps if max_fps > 0 else 0
+    stream_queue.add_viewer()
+    try:
+        seq = 0
+        while True:
+            # Sleeps until a new frame is published; never re-sends the same one
+            seq, frame = stream_queue.wait_newer(seq, timeout=VIEWER_WAIT_TIMEOUT)
+            if frame is None:
+                continue
+
+            sent_at = time.monotonic()
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + frame.jpeg + b'\r\n')
+
+            # The server asks for the next part only once this one is written to the viewer's socket
+            if frame.timing is not None:
+                written_at = time.time()
+                latency_tracker.record(frame.sender_id, 'receive_to_viewer', written_at - frame.received_at)
+                latency_tracker.record(frame.sender_id, 'end_to_end',
+                                       written_at - (frame.timing['captured_at'] + frame.timing['clock_offset']))
+
+            # Frames arriving during the pause are skipped, the next wait returns the newest one
+            remaining = min_interval - (time.monotonic() - sent_at)
+            if remaining > 0:
+                time.sleep(remaining)
+    finally:
+        stream_queue.remove_viewer()
 
 
 @app.route('/video_feed')
 def video_feed():
-    # Fixme: Hardcoded for now
-    stream_id = selected_cam
-    return Response(generate_frames_for_stream(stream_id), mimetype='multipart/x-mixed-replace; boundary=frame')
+    stream_id = request.args.get('sender', selected_cam)
+    max_fps = request.args.get('fps', default=MAX_VIEWER_FPS, type=float)
+    stream_queue = find_video_stream_queue(stream_id)
+    if stream_queue is None:
+        return f'No video stream from sender {stream_id}', 404
+    return Response(generate_frames(stream_queue, max_fps), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+
+@app.route('/mosaic_feed')
+def mosaic_feed():
+    # All active cameras in one grid, at MOSAIC_FPS at most
+    mosaic_renderer.ensure_running()
+    return Response(generate_frames(mosaic_renderer.output, MOSAIC_FPS), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+
+@app.route('/stream_stats')
+def get_stream_stats():
+    with lock:
+        streams = dict(video_stream_queues)
+    return json.dumps({
+        'streams': {stream_id: stream_queue.stats() for stream_id, stream_queue in streams.items()},
+        'mosaic': mosaic_renderer.output.stats(),
+    })
+
+
+def find_recordings(sender_id, ts):
+    # Segment paths from the one covering ts onwards, or an empty list
+    if safe_join(RECORDING_DIR, sender_id) is None:
+        return []
+    return recorder.segments_from(RECORDING_DIR, sender_id, ts)
+
+
+@app.route('/recordings/<sender_id>')
+def list_recordings(sender_id):
+    if safe_join(RECORDING_DIR, sender_id) is None:
+        return 'Invalid sender', 400
+    return json.dumps(recorder.list_segments(RECORDING_DIR, sender_id))
+
+
+@app.route('/recordings/<sender_id>/frame')
+def recorded_frame(sender_id):
+    """The recorded frame closest to ?t= (unix timestamp) at or before it."""
+    ts = request.args.get('t', default=time.time(), type=float)
+    segment_paths = find_recordings(sender_id, ts)
+    if not segment_paths:
+        return 'No recording at that time', 404
+
+    with recorder.SegmentReader(segment_paths[0]) as reader:
+        if not len(reader):
+            return 'No recording at that time', 404
+        frame_ts, jpeg = reader.frame(reader.position_at(ts))
+    return Response(jpeg, mimetype='image/jpeg', headers={'X-Frame-Timestamp': str(frame_ts)})
+
+
+@app.route('/recordings/<sender_id>/play')
+def play_recording(sender_id):
+    """Replays the recording from ?t= as MJPEG at the recorded pace, multiplied by ?speed=."""
+    ts = request.args.get('t', type=float)
+    speed = request.args.get('speed', default=1.0, type=float)
+    if ts is None or speed <= 0:
+        return 'Missing t or invalid speed', 400
+    segment_paths = find_recordings(sender_id, ts)
+    if not segment_paths:
+        return 'No recording at that time', 404
+
+    def generate():
+        previous_ts = None
+        for segment_path in segment_paths:
+            with recorder.SegmentReader(segment_path) as reader:
+                # Start at ts in the first segment, then play the following segments from their beginning
+                first_position = reader.position_at(ts) if previous_ts is None else 0
+                for position in range(first_position, len(reader)):
+                    frame_ts, jpeg = reader.frame(position)
+                    if previous_ts is not None:
+                        time.sleep(min(max(frame_ts - previous_ts, 0) / speed, 1.0))
+                    previous_ts = frame_ts
+                    yield (b'--frame\r\n'
+                           b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+
+    return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+
+@app.route('/recording_segment/<path:segment>')
+def recording_segment(segment):
+    """Raw segment bytes, honouring Range requests. Served from a memory map in RECORDING_CHUNK_SIZE chunks."""
+    segment_path = safe_join(RECORDING_DIR, segment)
+    if segment_path is None or not segment_path.endswith(recorder.SEGMENT_SUFFIX) or not os.path.isfile(segment_path):
+        return 'Segment not found', 404
+
+    file = open(segment_path, 'rb')
+    size = os.fstat(file.fileno()).st_size
+    content_range = request.range.range_for_length(size) if request.range else None
+    start, stop = content_range if content_range else (0, size)
+
+    def generate():
+        try:
+            if stop <= start:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as segment_map:
+                for chunk_start in range(start, stop, RECORDING_CHUNK_SIZE):
+                    yield segment_map[chunk_start:min(chunk_start + RECORDING_CHUNK_SIZE, stop)]
+        finally:
+            file.close()
+
+    headers = {'Accept-Ranges': 'bytes', 'Content-Length': str(stop - start)}
+    if content_range:
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    return Response(generate(), status=206 if content_range else 200, mimetype='application/octet-stream',
+                    headers=headers)
+
+
+@app.route('/ingest_stats')
+def get_ingest_stats():
+    """
+    Ingest counters: connections per port, and the worker pool that runs sensor batch decoding and still upload
+    I/O (pending_jobs of at most max_pending_jobs, and waited_jobs, how many had to wait for a free slot). Also
+    the image writers, the sensor store and the other ingest stages.
+    """
+    return json.dumps(ingest_server.stats())
+
+
+@app.route('/roi/<sender_id>/<preset>')
+def switch_roi(sender_id, preset):
+    """
+    Switches a sender's live stream to one of its region of interest presets, or back to the full view with
+    /roi/<sender>/full. The sender reports the region in use with its sensor data.
+    """
+    if not send_control(sender_id, {'roi': preset}):
+        return f'Sender {sender_id} is not connected', 404
+    return json.dumps({'sender_id': sender_id, 'roi': preset, 'sent': True})
+
+
+@app.route('/latency_stats')
+def get_latency_stats():
+    """
+    Capture-to-display latency histograms per sender and stage: capture_to_send, network, receive_to_viewer,
+    end_to_end and still_capture_to_received. ?sender= limits them to one sender.
+    """
+    return json.dumps(latency_tracker.stats(request.args.get('sender')))
+
+
+@app.route('/activity')
+def get_activity():
+    """
+    The k stills that changed most from the one before them, e.g. /activity?sender=rancho-cam&k=10, most changed
+    first. start and end are unix timestamps; the default range is the last ACTIVITY_DEFAULT_RANGE seconds.
+    """
+    if activity_index is None:
+        return 'Activity index disabled', 404
+    sender_id = request.args.get('sender', selected_cam)
+    if safe_join(ACTIVITY_INDEX_DIR, sender_id) is None:
+        return 'Invalid sender', 400
+    end = request.args.get('end', default=time.time(), type=float)
+    start = request.args.get('start', default=end - ACTIVITY_DEFAULT_RANGE, type=float)
+    k = max(request.args.get('k', default=10, type=int), 1)
+
+    stills = activity_index.top_changed(sender_id, start, end, k)
+    for still in stills:
+        still['url'] = url_for('static', filename=f'high_res_images/{sender_id}/{still.pop("still")}')
+    return json.dumps({'sender_id': sender_id, 'start': start, 'end': end, 'stills': stills})
+
+
+@app.route('/sensor_history')
+def get_sensor_history():
+    """
+    Downsampled history of one sensor field, e.g. /sensor_history?sender=rancho-cam&field=temperature&points=300.
+    start and end are unix timestamps; the default range is the last SENSOR_HISTORY_DEFAULT_RANGE seconds.
+    Without a field, lists the fields stored for the sender.
+    """
+    sender_id = request.args.get('sender', selected_cam)
+    field = request.args.get('field')
+    if not field:
+        return json.dumps({'sender_id': sender_id, 'fields': sensor_store.fields(sender_id)})
+
+    end = request.args.get('end', default=time.time(), type=float)
+    start = request.args.get('start', default=end - SENSOR_HISTORY_DEFAULT_RANGE, type=float)
+    points = request.args.get('points', default=300, type=int)
+    return json.dumps({'sender_id': sender_id, 'field': field, 'start': start, 'end': end,
+                       'points': sensor_store.query(sender_id, field, start, end, points)})
 
 
 @app.route('/sensor_data')
 def get_sensor_data():
-    # Todo: handle separation of received data to show for each camera
-    global received_data
-    return json.dumps(received_data)
+    sender_id = request.args.get('sender', selected_cam)
+    return json.dumps(latest_sensor_data(sender_id))
+
+
+@app.route('/events')
+def events():
+    """
+    Server-sent events for the dashboard: 'sensor' when a sender reports data and 'image' when a new still is
+    committed to disk. ?sender= limits the stream to one sender.
+    """
+    sender_id = request.args.get('sender')
+
+    def generate():
+        subscription = event_hub.subscribe(sender_id)
+        try:
+            while True:
+                event = subscription.next_event(timeout=EVENT_KEEPALIVE_INTERVAL)
+                if event is None:
+                    yield ': keepalive\n\n'  # Comment line, lets the server notice closed connections
+                    continue
+                event_type, data = event
+                yield f'event: {event_type}\ndata: {json.dumps(data)}\n\n'
+        finally:
+            event_hub.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
 
 if __name__ == '__main__':
-    # Start threads for handling connections
-    threading.Thread(target=listen_for_connections, args=(VIDEO_STREAM_PORT, handle_video_stream)).start()
-    threading.Thread(target=listen_for_connections, args=(DATA_PORT, handle_received_data)).start()
-    threading.Thread(target=listen_for_connections, args=(HIGH_RES_PIC_PORT, handle_high_res_picture)).start()
+    latest_images.rebuild()
+    remove_stale_partial_uploads()
+    if frame_pool is not None:
+        frame_pool.start()
+        atexit.register(frame_pool.stop)
+
+    # Serve the video, data and high-res ports on a single event loop
+    ingest_server.start()
+
+    atexit.register(sensor_store.close)
 
     # IF on debug mode, things get messy with threads and they stop working properly.
     app.run(host='0.0.0.0', port=5000, threaded=True)
@@ -0,0 +1,186 @@
+"""
+Health supervision of the sender's worker threads.
+
+Every worker (video sender, timed stills, sensor sender, HTTP server) reports its own heartbeat and has its own
+deadline. When a worker misses its deadline or its thread dies, the supervisor escalates step by step:
+
+    1. Restart that worker alone, in a new thread, up to max_restarts times within restart_window seconds.
+    2. Run the worker's recover callback (e.g. a full camera re-init) once per window, then restart it again.
+    3. As a last resort, call fatal_callback to shut the process down so run.py starts it again, and exit the hard
+       way if that doesn't finish within hard_exit_timeout seconds.
+
+Python threads can't be killed, so a restarted worker's old thread is abandoned rather than stopped: its handle
+reports should_stop() from then on and its heartbeats are ignored, so it exits the next time it gets unblocked.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+
+class WorkerHandle:
+    """Passed to the worker's target as its first argument, to report heartbeats and check whether to stop."""
+
+    def __init__(self, worker, generation, shutdown_event):
+        self.worker = worker
+        self.generation = generation
+        self.shutdown_event = shutdown_event
+
+    def is_current(self):
+        return self.generation == self.worker.generation
+
+    def beat(self):
+        if self.is_current():
+            self.worker.last_heartbeat = time.monotonic()
+
+    def should_stop(self):
+        return self.shutdown_event.is_set() or not self.is_current()
+
+
+class Worker:
+    def __init__(self, name, target, deadline, args=(), recover=None):
+        self.name = name
+        self.target = target
+        self.deadline = deadline
+        self.args = args
+        self.recover = recover
+        self.generation = 0
+        self.thread = None
+        self.last_heartbeat = time.monotonic()
+        self.failures = deque()  # monotonic times of the recent failures
+        self.restarts = 0
+        self.recovered_at = None
+
+    def start(self, shutdown_event):
+        self.generation += 1
+        self.last_heartbeat = time.monotonic()
+        handle = WorkerHandle(self, self.generation, shutdown_event)
+        self.thread = threading.Thread(target=self._run, args=(handle,), name=f'{self.name}-{self.generation}',
+                                       daemon=True)
+        self.thread.start()
+
+    def _run(self, handle):
+        try:
+            self.target(handle, *self.args)
+        except Exception as e:
+            print(f"Worker {self.name} crashed: {e!r}")
+
+    def overdue(self, now):
+        return now - self.last_heartbeat > self.deadline
+
+    def status(self, now):
+        return {
+            'alive': self.thread is not None and self.thread.is_alive(),
+            'since_heartbeat': now - self.last_heartbeat,
+            'deadline': self.deadline,
+            'restarts': self.restarts,
+            'generation': self.generation,
+        }
+
+
+def run_with_timeout(function, timeout, name):
+    """Runs function in a daemon thread. Returns True if it returned within timeout seconds without raising."""
+    result = {'ok': False}
+
+    def run():
+        try:
+            function()
+            result['ok'] = True
+        except Exception as e:
+            print(f"{name} failed: {e!r}")
+
+    thread = threading.Thread(target=run, name=name, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return result['ok'] and not thread.is_alive()
+
+
+class Supervisor(threading.Thread):
+    def __init__(self, shutdown_event, fatal_callback, max_restarts=3, restart_window=600, recover_timeout=60,
+                 hard_exit_timeout=60, check_interval=1.0):
+        super().__init__(name='supervisor', daemon=True)
+        self.shutdown_event = shutdown_event
+        self.fatal_callback = fatal_callback
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.recover_timeout = recover_timeout
+        self.hard_exit_timeout = hard_exit_timeout
+        self.check_interval = check_interval
+        self.workers = {}
+        self.running = True
+
+    def add(self, name, target, deadline, args=(), recover=None):
+        """Registers a worker; target(handle, *args) is started with the supervisor and restarted when it stalls."""
+        self.workers[name] = Worker(name, target, deadline, args, recover)
+
+    def start(self):
+        for worker in self.workers.values():
+            worker.start(self.shutdown_event)
+            print(worker.thread.name, f" : {worker.name} worker started")
+        super().start()
+
+    def run(self):
+        while self.running and not self.shutdown_event.wait(self.check_interval):
+            now = time.monotonic()
+            for worker in self.workers.values():
+                if not self.running or self.shutdown_event.is_set():
+                    break
+                if not worker.thread.is_alive():
+                    print(f"Worker {worker.name} exited unexpectedly")
+                    self._handle_failure(worker, now)
+                elif worker.overdue(now):
+                    print(f"Worker {worker.name} missed its {worker.deadline} s deadline")
+                    self._handle_failure(worker, now)
+
+    def _handle_failure(self, worker, now):
+        while worker.failures and now - worker.failures[0] > self.restart_window:
+            worker.failures.popleft()
+        worker.failures.append(now)
+
+        if len(worker.failures) > self.max_restarts:
+            recovered_recently = worker.recovered_at is not None and now - worker.recovered_at <= self.restart_window
+            if worker.recover is None or recovered_recently:
+                self._escalate_fatal(worker)
+                return
+
+            print(f"Worker {worker.name} keeps failing, running its recovery")
+            worker.recovered_at = now
+            if not run_with_timeout(worker.recover, self.recover_timeout, f'{worker.name}-recover'):
+                self._escalate_fatal(worker)
+                return
+            worker.failures.clear()
+
+        worker.restarts += 1
+        worker.start(self.shutdown_event)
+        print(f"Worker {worker.name} restarted (restart {worker.restarts})")
+
+    def _escalate_fatal(self, worker):
+        print(f"Worker {worker.name} could not be recovered, shutting the process down")
+        self.running = False
+        threading.Thread(target=self.fatal_callback, name='fatal-shutdown', daemon=True).start()
+        threading.Thread(target=self._final_run, name='final-run', daemon=True).start()
+
+    def _final_run(self):
+        time.sleep(self.hard_exit_timeout)
+        print("Something failed shutting down the system, exiting the hard way...")
+        os._exit(2)
+
+    def stop(self):
+        self.running = False
+
+    def join_workers(self, timeout):
+        """Waits for the current thread of every worker to finish, skipping the calling thread."""
+        current_thread = threading.current_thread()
+        for worker in self.workers.values():
+            if worker.thread is None or worker.thread is current_thread or not worker.thread.is_alive():
+                print(f"{worker.name} worker NOT ALIVE OR IS CURRENT THREAD...")
+                continue
+            print(f"Waiting for {worker.name} worker to finish...")
+            worker.thread.join(timeout=timeout)
+            if worker.thread.is_alive():
+                print(f"Warning: {worker.name} worker did not shut down cleanly.")
+
+    def status(self):
+        now = time.monotonic()
+        return {name: worker.status(now) for name, worker in self.workers.items()}
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+@pytest.fixture(scope='session')
+def receiver(tmp_path_factory):
+    """The receiver module. It creates its data folders relative to the working directory when imported."""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('receiver'))
+    try:
+        import stream_and_data_receiver
+    finally:
+        os.chdir(cwd)
+    return stream_and_data_receiver
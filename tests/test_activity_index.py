@@ -0,0 +1,86 @@
+import math
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from activity_index import ActivityIndex, difference_score  # noqa: E402
+
+
+NOON = 1700049600.0
+DAY = 24 * 60 * 60
+
+
+def flat(level, size=(32, 24)):
+    return np.full((size[1], size[0]), level, np.uint8)
+
+
+def spot(level, size=(32, 24)):
+    """A flat thumbnail with a bright patch, which a change of exposure alone can't explain."""
+    small = flat(level, size)
+    small[:8, :8] = 255
+    return small
+
+
+def index_with(tmp_path, thumbnails):
+    """An ActivityIndex whose thumbnailer returns the given thumbnails, in order, instead of decoding JPEGs."""
+    thumbnails = iter(thumbnails)
+    return ActivityIndex(str(tmp_path), thumbnailer=lambda sender_id, jpeg, size: next(thumbnails))
+
+
+def test_difference_ignores_a_change_of_brightness():
+    assert difference_score(flat(100), flat(40)) == 0
+    assert difference_score(spot(100), flat(100)) > 10
+
+
+def test_top_changed_finds_the_stills_that_changed(tmp_path):
+    index = index_with(tmp_path, [flat(50), flat(80), spot(80), flat(80), flat(120)])
+    for n in range(5):
+        index.add('cam', NOON + n * 60, b'', f'day/{n}.jpg')
+
+    records = index.query('cam', NOON, NOON + 5 * 60)
+    assert list(records['ts']) == [NOON + n * 60 for n in range(5)]
+    assert math.isnan(records['difference'][0])  # Nothing before the first one
+
+    top = index.top_changed('cam', NOON, NOON + 5 * 60, k=2)
+    assert sorted(still['still'] for still in top) == ['day/2.jpg', 'day/3.jpg']
+    assert top[0]['difference'] >= top[1]['difference']
+
+
+def test_compares_with_the_still_taken_before_when_added_out_of_order(tmp_path):
+    index = index_with(tmp_path, [flat(50), spot(50), flat(50)])
+    index.add('cam', NOON, b'', 'day/0.jpg')
+    index.add('cam', NOON + 120, b'', 'day/2.jpg')
+    index.add('cam', NOON + 60, b'', 'day/1.jpg')  # A writer finishing late: compared with the first still
+
+    records = index.query('cam', NOON, NOON + 180)
+    assert [still.decode() for still in records['still']] == ['day/0.jpg', 'day/1.jpg', 'day/2.jpg']
+    assert records['difference'][1] == 0
+
+
+def test_picks_up_the_last_still_of_a_previous_run(tmp_path):
+    index_with(tmp_path, [flat(50)]).add('cam', NOON, b'', 'day/0.jpg')
+    index = index_with(tmp_path, [spot(50)])
+    index.add('cam', NOON + 60, b'', 'day/1.jpg')
+    assert not math.isnan(index.query('cam', NOON, NOON + 120)['difference'][1])
+
+
+def test_query_only_reads_the_days_on_disk(tmp_path, monkeypatch):
+    index = index_with(tmp_path, [flat(50), flat(60), flat(70)])
+    for n in range(3):
+        index.add('cam', NOON + n * 10 * DAY, b'', f'day/{n}.jpg')
+
+    loads = []
+    load = index._load
+    monkeypatch.setattr(index, '_load', lambda path: loads.append(path) or load(path))
+    assert len(index.query('cam', 0, NOON + 100 * DAY)) == 3
+    assert len(loads) == 3
+
+    loads.clear()
+    assert list(index.query('cam', NOON + 5 * DAY, NOON + 15 * DAY)['ts']) == [NOON + 10 * DAY]
+    assert len(loads) == 1
+
+    assert len(index.query('cam', -1e300, 1e300)) == 3  # Outside the range of dates
+    assert len(index.query('nobody', 0, NOON)) == 0
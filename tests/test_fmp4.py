@@ -0,0 +1,147 @@
+import os
+import struct
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fmp4 import (DELTA_FRAME_FLAGS, KEYFRAME_FLAGS, TIMESCALE, LiveSegmenter, box, full_box,  # noqa: E402
+                  init_segment, media_segment, split_nal_units)
+
+
+SPS = bytes([0x67, 100, 0, 40, 0xAC, 0x2B])
+PPS = bytes([0x68, 0xEE, 0x3C, 0x80])
+AUD = bytes([0x09, 0xF0])
+FRAME_INTERVAL = 1000000 // 30  # Microseconds
+
+
+def boxes(data):
+    """(kind, payload) of the boxes laid end to end in data."""
+    found = []
+    offset = 0
+    while offset < len(data):
+        size, kind = struct.unpack_from('>I4s', data, offset)
+        assert size >= 8 and offset + size <= len(data)
+        found.append((kind, data[offset + 8:offset + size]))
+        offset += size
+    return found
+
+
+def child(data, *path):
+    """Payload of the box at a path of nested box kinds."""
+    for kind in path:
+        data = dict(boxes(data))[kind]
+    return data
+
+
+def annex_b(*units, long_start_code=False):
+    start_code = b'\0\0\0\1' if long_start_code else b'\0\0\1'
+    return b''.join(start_code + unit for unit in units)
+
+
+def keyframe(n, sps=SPS):
+    return annex_b(AUD, sps, PPS, bytes([0x65, n]) * 10, long_start_code=True)
+
+
+def delta_frame(n):
+    return annex_b(AUD, bytes([0x41, n]) * 5)
+
+
+def test_box_sizes_include_the_header():
+    assert box(b'free') == b'\0\0\0\x08free'
+    assert boxes(full_box(b'tfdt', 1, 0x000701, b'xy')) == [(b'tfdt', b'\x01\x00\x07\x01xy')]
+
+
+def test_split_nal_units_handles_both_start_codes():
+    assert split_nal_units(annex_b(SPS, PPS) + annex_b(AUD, long_start_code=True)) == [SPS, PPS, AUD]
+    assert split_nal_units(b'no start code') == []
+
+
+def test_init_segment_layout():
+    init = init_segment(SPS, PPS, 1280, 720)
+    assert [kind for kind, _ in boxes(init)] == [b'ftyp', b'moov']
+    assert [kind for kind, _ in boxes(child(init, b'moov'))] == [b'mvhd', b'trak', b'mvex']
+
+    tkhd = child(init, b'moov', b'trak', b'tkhd')
+    assert struct.unpack('>II', tkhd[-8:]) == (1280 << 16, 720 << 16)
+    stsd = child(init, b'moov', b'trak', b'mdia', b'minf', b'stbl', b'stsd')
+    avcc = child(stsd[8 + 8 + 78:], b'avcC')  # Past the stsd header, the avc1 header and its fixed fields
+    assert avcc[8:8 + len(SPS)] == SPS
+    assert avcc[11 + len(SPS):11 + len(SPS) + len(PPS)] == PPS
+
+
+def test_media_segment_offsets_point_at_the_samples():
+    samples = [(3000, b'\0\0\0\3key', True), (3000, b'\0\0\0\4next', False)]
+    segment = media_segment(7, 90000, samples)
+    assert [kind for kind, _ in boxes(segment)] == [b'moof', b'mdat']
+
+    assert child(segment, b'moof', b'mfhd')[4:] == struct.pack('>I', 7)
+    assert child(segment, b'moof', b'traf', b'tfdt')[4:] == struct.pack('>Q', 90000)
+    trun = child(segment, b'moof', b'traf', b'trun')
+    count, data_offset = struct.unpack_from('>Ii', trun, 4)
+    entries = list(struct.iter_unpack('>III', trun[12:]))
+    assert count == 2
+    assert entries == [(3000, 7, KEYFRAME_FLAGS), (3000, 8, DELTA_FRAME_FLAGS)]
+    assert segment[data_offset:] == b''.join(data for _, data, _ in samples)
+
+
+def test_segments_are_cut_at_keyframes():
+    segmenter = LiveSegmenter(window=3)
+    segmenter.reset((640, 480))
+    timestamp = 0
+    for frame, is_keyframe in [(delta_frame(0), False),  # Before the first keyframe: dropped
+                               (keyframe(1), True), (delta_frame(2), False), (delta_frame(3), False),
+                               (keyframe(4), True), (delta_frame(5), False), (keyframe(6), True)]:
+        segmenter.add_frame(frame, is_keyframe, timestamp)
+        timestamp += FRAME_INTERVAL
+
+    assert [segment.sequence for segment in segmenter.segments] == [1, 2]
+    first = segmenter.segment(1)
+    trun = child(first.data, b'moof', b'traf', b'trun')
+    assert struct.unpack_from('>I', trun, 4)[0] == 3
+    assert round(first.duration * 30) == 3
+    # Length-prefixed, without the parameter sets and delimiters
+    assert child(first.data, b'mdat').startswith(struct.pack('>I', 20) + bytes([0x65, 1]) * 10)
+    assert boxes(segmenter.init)[0][0] == b'ftyp'
+
+    second = child(segmenter.segment(2).data, b'moof', b'traf', b'tfdt')
+    assert struct.unpack('>Q', second[4:])[0] == 3 * FRAME_INTERVAL * TIMESCALE // 1000000
+
+
+def test_window_keeps_the_newest_segments_and_the_playlist_follows():
+    segmenter = LiveSegmenter(window=3)
+    assert segmenter.playlist() is None
+    for n in range(6):
+        segmenter.add_frame(keyframe(n), True, n * 1000000)
+
+    assert [segment.sequence for segment in segmenter.segments] == [3, 4, 5]
+    assert segmenter.segment(1) is None
+    playlist = segmenter.playlist().splitlines()
+    assert '#EXT-X-MEDIA-SEQUENCE:3' in playlist
+    assert '#EXT-X-TARGETDURATION:1' in playlist
+    assert [line for line in playlist if not line.startswith('#')] == ['3.m4s', '4.m4s', '5.m4s']
+
+
+def test_wait_newer_wakes_up_for_the_next_segment():
+    segmenter = LiveSegmenter()
+    segmenter.add_frame(keyframe(0), True, 0)
+    assert segmenter.wait_newer(0, timeout=0.05) is None
+
+    timer = threading.Timer(0.05, segmenter.add_frame, (keyframe(1), True, FRAME_INTERVAL))
+    timer.start()
+    assert segmenter.wait_newer(0, timeout=5).sequence == 1
+    timer.join()
+
+
+def test_new_parameter_sets_start_a_new_stream():
+    segmenter = LiveSegmenter()
+    for n in range(3):
+        segmenter.add_frame(keyframe(n), True, n * FRAME_INTERVAL)
+    init = segmenter.init
+    assert segmenter.sequence == 2
+
+    new_sps = SPS[:-1] + b'\x2C'
+    segmenter.add_frame(keyframe(3, sps=new_sps), True, 3 * FRAME_INTERVAL)
+    assert segmenter.init is not init
+    assert segmenter.sequence == 0 and not segmenter.segments
+    assert child(segmenter.init, b'moov', b'trak', b'mdia', b'minf', b'stbl', b'stsd').find(new_sps) != -1
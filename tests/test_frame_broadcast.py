@@ -0,0 +1,61 @@
+import threading
+import time
+
+
+def test_viewer_wakes_up_for_a_newer_frame(receiver):
+    broadcast = receiver.FrameBroadcast()
+    assert broadcast.get() == (0, None)
+    assert broadcast.wait_newer(0, timeout=0.05) == (0, None)
+
+    timer = threading.Timer(0.05, broadcast.put, ('frame 1',))
+    timer.start()
+    assert broadcast.wait_newer(0, timeout=5) == (1, 'frame 1')
+    timer.join()
+    assert broadcast.wait_newer(1, timeout=0.05) == (1, None)
+
+
+def test_slow_viewer_skips_to_the_newest_frame(receiver):
+    broadcast = receiver.FrameBroadcast()
+    broadcast.put('frame 1')
+    seq, item = broadcast.wait_newer(0)
+    for n in range(2, 6):
+        broadcast.put(f'frame {n}')
+
+    assert broadcast.wait_newer(seq, timeout=0) == (5, 'frame 5')
+    assert broadcast.stats()['skipped_frames'] == 3
+
+
+def test_a_new_viewer_doesnt_count_the_frames_before_it_as_skipped(receiver):
+    broadcast = receiver.FrameBroadcast()
+    for n in range(1, 4):
+        broadcast.put(f'frame {n}')
+    assert broadcast.wait_newer(0) == (3, 'frame 3')
+    assert broadcast.stats()['skipped_frames'] == 0
+
+
+def test_every_waiting_viewer_gets_the_frame(receiver):
+    broadcast = receiver.FrameBroadcast()
+    received = []
+
+    def view():
+        broadcast.add_viewer()
+        try:
+            received.append(broadcast.wait_newer(0, timeout=5))
+        finally:
+            broadcast.remove_viewer()
+
+    viewers = [threading.Thread(target=view) for _ in range(4)]
+    for viewer in viewers:
+        viewer.start()
+    deadline = time.monotonic() + 5
+    while broadcast.stats()['viewers'] < 4:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    broadcast.put('frame 1')
+    for viewer in viewers:
+        viewer.join()
+    assert received == [(1, 'frame 1')] * 4
+    stats = broadcast.stats()
+    assert stats['viewers'] == 0
+    assert 0 <= stats['last_frame_age'] < 5
@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from protocol import encode_frame_timing, send_frame_datagrams, split_frame_timing  # noqa: E402
+
+
+class RecordingSocket:
+    """Stands in for a connected UDP socket, keeping the datagrams sent."""
+
+    def __init__(self):
+        self.datagrams = []
+
+    def sendmsg(self, buffers):
+        self.datagrams.append(b''.join(bytes(buffer) for buffer in buffers))
+
+
+def datagrams(seq, payload, sender_id=b'cam', max_datagram=200, prefix=b''):
+    sock = RecordingSocket()
+    send_frame_datagrams(sock, sender_id, seq, payload, max_datagram, prefix)
+    return sock.datagrams
+
+
+def jpeg(n, size=1000):
+    return b'\xff\xd8' + bytes([n % 256]) * size + b'\xff\xd9'
+
+
+def feed(reassembler, datagrams):
+    return [frame for frame in map(reassembler.add, datagrams) if frame is not None]
+
+
+def test_fragments_arriving_out_of_order_make_one_frame(receiver):
+    reassembler = receiver.FrameReassembler(deadline=1, max_pending_per_sender=4)
+    prefix = encode_frame_timing(1, 2.0, 3.0, 0.5)
+    fragments = datagrams(1, jpeg(1), prefix=prefix)
+    assert len(fragments) > 5
+    assert all(len(fragment) <= 200 for fragment in fragments)
+
+    frames = feed(reassembler, fragments[::-1] + fragments[:1])  # Reversed, and a duplicate at the end
+    assert len(frames) == 1
+    sender_id, payload = frames[0]
+    timing, frame = split_frame_timing(payload)
+    assert (sender_id, frame, timing['captured_at']) == ('cam', jpeg(1), 2.0)
+    assert reassembler.stats()['late_fragments'] == 1
+
+
+def test_a_lost_fragment_costs_one_frame(receiver):
+    reassembler = receiver.FrameReassembler(deadline=1, max_pending_per_sender=4)
+    first = datagrams(1, jpeg(1))
+    frames = feed(reassembler, first[1:] + datagrams(2, jpeg(2)) + first[:1])
+
+    assert frames == [('cam', jpeg(2))]
+    stats = reassembler.stats()
+    assert stats['incomplete_frames'] == 1  # Dropped once the newer one was delivered
+    assert stats['late_fragments'] == 1
+
+
+def test_incomplete_frames_expire_after_the_deadline(receiver):
+    reassembler = receiver.FrameReassembler(deadline=0.05, max_pending_per_sender=4)
+    feed(reassembler, datagrams(1, jpeg(1))[1:])
+    time.sleep(0.1)
+    assert feed(reassembler, datagrams(5, jpeg(5), sender_id=b'other')) == [('other', jpeg(5))]
+    assert reassembler.stats()['incomplete_frames'] == 1
+    assert reassembler.pending['cam'] == {}
+
+
+def test_pending_frames_are_capped_per_sender(receiver):
+    reassembler = receiver.FrameReassembler(deadline=10, max_pending_per_sender=2)
+    for seq in (1, 2, 3):
+        feed(reassembler, datagrams(seq, jpeg(seq))[1:])
+    assert sorted(reassembler.pending['cam']) == [2, 3]
+    assert reassembler.stats()['incomplete_frames'] == 1
+
+
+def test_sender_restart_and_sequence_wraparound(receiver):
+    reassembler = receiver.FrameReassembler(deadline=1, max_pending_per_sender=4)
+    assert feed(reassembler, datagrams(5000, jpeg(1))) == [('cam', jpeg(1))]
+    # Far behind the last frame: the sender restarted, not a late frame
+    assert feed(reassembler, datagrams(0, jpeg(2))) == [('cam', jpeg(2))]
+
+    assert feed(reassembler, datagrams(0xFFFFFFFF, jpeg(3))) == []  # Just behind: late
+    reassembler.last_delivered['cam'] = 0xFFFFFFFE
+    assert feed(reassembler, datagrams(0xFFFFFFFF, jpeg(4)) + datagrams(0, jpeg(5))) == [('cam', jpeg(4)),
+                                                                                        ('cam', jpeg(5))]
+
+
+def test_invalid_datagrams_are_counted(receiver):
+    reassembler = receiver.FrameReassembler(deadline=1, max_pending_per_sender=4)
+    fragment = datagrams(1, jpeg(1))[0]
+    for datagram in (b'', b'junk' * 10, b'XX' + fragment[2:], fragment[:8] + b'\x00\x09\x00\x02' + fragment[12:]):
+        assert reassembler.add(datagram) is None
+    assert reassembler.stats()['invalid_datagrams'] == 4
@@ -0,0 +1,92 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from governor import LoadGovernor, cap, throttle_flag_names  # noqa: E402
+
+
+TIERS = [
+    {'name': 'warm', 'temp': 70, 'fps': 15},
+    {'name': 'hot', 'temp': 75, 'cpu': 95, 'fps': 8, 'analytics': False},
+    {'name': 'critical', 'temp': 80, 'fps': 2},
+]
+
+
+def governor():
+    return LoadGovernor(TIERS, temp_hysteresis=5, cpu_hysteresis=15, cool_down=60)
+
+
+def test_thresholds_can_skip_tiers():
+    load = governor()
+    assert load.update(60, 20, 0, now=0) is None
+    assert load.update(81, 20, 0, now=1) == 'critical'
+    assert load.limits['fps'] == 2
+
+    load = governor()
+    assert load.update(60, 99, 0, now=0) == 'hot'  # The CPU load alone
+    assert load.stats()['limits'] == {'fps': 8, 'analytics': False}
+
+
+def test_throttling_steps_up_one_tier_per_poll():
+    load = governor()
+    throttled = 0x4 | 0x50000
+    assert [load.update(60, 20, throttled, now=n) for n in range(4)] == ['warm', 'hot', 'critical', None]
+    assert load.changes[0]['reason'] == 'firmware throttling'
+    assert throttle_flag_names(throttled) == ['throttled']
+
+    # Under-voltage alone doesn't slow the CPU down
+    load = governor()
+    assert load.update(60, 20, 0x1, now=0) is None
+
+
+def test_leaves_one_tier_at_a_time_after_the_cool_down():
+    load = governor()
+    load.update(81, 20, 0, now=0)
+
+    assert load.update(60, 20, 0, now=10) is None
+    assert load.update(60, 20, 0, now=69) is None
+    assert load.update(60, 20, 0, now=70) == 'hot'
+    # The cool-down starts over in the new tier
+    assert load.update(60, 20, 0, now=71) is None
+    assert load.update(60, 20, 0, now=131) == 'warm'
+    assert load.update(60, 20, 0, now=132) is None
+    assert load.update(60, 20, 0, now=192) == 'normal'
+    assert [change['reason'] for change in load.changes] == ['thresholds reached'] + ['cooled down'] * 3
+
+
+def test_readings_within_the_hysteresis_hold_the_tier():
+    load = governor()
+    load.update(76, 20, 0, now=0)
+    assert load.tier == 2
+
+    # Below the threshold of 75 but within the 5 degree margin: not cool, however long it lasts
+    for now in range(10, 300, 10):
+        assert load.update(72, 20, 0, now=now) is None
+    # A warm reading restarts the cool-down
+    assert load.update(69, 20, 0, now=300) is None
+    assert load.update(72, 20, 0, now=330) is None
+    assert load.update(69, 20, 0, now=340) is None
+    assert load.update(69, 20, 0, now=399) is None
+    assert load.update(69, 20, 0, now=400) == 'warm'
+
+
+def test_throttling_holds_the_top_tier():
+    load = governor()
+    load.update(81, 20, 0, now=0)
+    assert load.update(50, 20, 0x2, now=100) is None
+    assert load.cool_since is None
+    assert load.stats()['throttling'] == ['frequency_capped']
+
+
+def test_missing_readings_dont_change_the_tier():
+    load = governor()
+    assert load.update(None, None, None, now=0) is None
+    assert load.stats()['name'] == 'normal'
+
+
+def test_cap():
+    assert cap(30, None) == 30
+    assert cap(None, 8) == 8
+    assert cap(30, 8) == 8
+    assert cap(5, 8) == 5
@@ -0,0 +1,26 @@
+import asyncio
+import threading
+
+
+def test_pool_bounds_the_pending_jobs_and_counts_the_waits(receiver):
+    pool = receiver.BoundedWorkerPool(max_workers=4, max_pending=2)
+    release = threading.Event()
+    running = []
+
+    def job(n):
+        running.append(n)
+        release.wait(5)
+        return n
+
+    async def main():
+        tasks = [asyncio.create_task(pool.run(job, n)) for n in range(5)]
+        while len(running) < 2:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        assert pool.pending == 2 and len(running) == 2  # Three jobs wait for a slot, none is dropped
+        release.set()
+        return await asyncio.gather(*tasks)
+
+    assert asyncio.run(main()) == [0, 1, 2, 3, 4]
+    assert pool.waited == 3
+    assert pool.pending == 0
@@ -0,0 +1,124 @@
+import math
+import os
+import socket
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from protocol import (COMPRESS_THRESHOLD, FLAG_ZLIB, MAX_SENSOR_BODY_SIZE, MSG_DATA, MSG_PING, PING_BODY,  # noqa: E402
+                      SENSOR_HEADER, SENSOR_MAGIC, SENSOR_PROTOCOL_VERSION, STILL_MAGIC, STILL_OFFER,
+                      decode_sensor_batch, decode_still_offer, encode_ack, encode_control, encode_frame_timing,
+                      encode_message, encode_ping, encode_pong, encode_sensor_batch, encode_still_offer,
+                      parse_header, read_ack, read_message, read_pong, split_frame_timing)
+
+
+@pytest.fixture
+def pair():
+    left, right = socket.socketpair()
+    with left, right:
+        yield left, right
+
+
+def test_small_batch_is_sent_uncompressed(pair):
+    sender, receiver = pair
+    samples = [{'temperature': 21.5, 'humidity': 40}]
+    sender.sendall(encode_sensor_batch('cam', samples))
+
+    msg_type, flags, body = read_message(receiver)
+    assert (msg_type, flags & FLAG_ZLIB) == (MSG_DATA, 0)
+    assert decode_sensor_batch(flags, body) == ('cam', samples)
+
+
+def test_backlog_batch_is_compressed(pair):
+    sender, receiver = pair
+    samples = [{'temperature': 20 + n / 10, 'uptime': f'{n}:00:00'} for n in range(500)]
+    message = encode_sensor_batch('cam', samples)
+    assert len(message) < len(str(samples)) / 4
+
+    sender.sendall(message)
+    msg_type, flags, body = read_message(receiver)
+    assert flags & FLAG_ZLIB
+    assert decode_sensor_batch(flags, body) == ('cam', samples)
+
+
+def test_compression_threshold():
+    small = encode_sensor_batch('cam', [])
+    assert len(small) - SENSOR_HEADER.size < COMPRESS_THRESHOLD
+    assert not parse_header(small[:SENSOR_HEADER.size])[1] & FLAG_ZLIB
+
+
+def test_messages_survive_coalescing_and_splitting(pair):
+    sender, receiver = pair
+    stream = encode_sensor_batch('cam', [{'n': 1}]) + encode_ping(12.5) + encode_sensor_batch('cam', [{'n': 2}])
+    for offset in range(len(stream)):  # One byte at a time
+        sender.send(stream[offset:offset + 1])
+
+    first, ping, second = (read_message(receiver) for _ in range(3))
+    assert decode_sensor_batch(first[1], first[2]) == ('cam', [{'n': 1}])
+    assert ping[0] == MSG_PING
+    assert decode_sensor_batch(second[1], second[2]) == ('cam', [{'n': 2}])
+
+
+@pytest.mark.parametrize('header, error', [
+    (SENSOR_HEADER.pack(b'XX', SENSOR_PROTOCOL_VERSION, MSG_DATA, 0, 0), 'magic'),
+    (SENSOR_HEADER.pack(SENSOR_MAGIC, SENSOR_PROTOCOL_VERSION + 1, MSG_DATA, 0, 0), 'version'),
+    (SENSOR_HEADER.pack(SENSOR_MAGIC, SENSOR_PROTOCOL_VERSION, MSG_DATA, 0, MAX_SENSOR_BODY_SIZE + 1), 'size limit'),
+    (SENSOR_HEADER.pack(STILL_MAGIC, SENSOR_PROTOCOL_VERSION, MSG_DATA, 0, 0), 'magic'),
+])
+def test_invalid_headers_are_rejected(header, error):
+    with pytest.raises(ValueError, match=error):
+        parse_header(header)
+
+
+def test_ack_passes_control_messages_on(pair):
+    sender, receiver = pair
+    receiver.sendall(encode_control({'roi': 'gate'}) + encode_ack(7))
+    commands = []
+    assert read_ack(sender, commands.append) == 7
+    assert commands == [{'roi': 'gate'}]
+
+
+def test_unexpected_reply_is_an_error(pair):
+    sender, receiver = pair
+    receiver.sendall(encode_pong(1.0, 2.0))
+    with pytest.raises(ValueError):
+        read_ack(sender)
+
+
+def test_ping_is_echoed_with_the_receiver_time(pair):
+    sender, receiver = pair
+    sender.sendall(encode_ping(1700000000.25))
+    msg_type, _, body = read_message(receiver)
+    assert msg_type == MSG_PING
+    receiver.sendall(encode_pong(PING_BODY.unpack(body)[0], 1700000001.5))
+    assert read_pong(sender) == (1700000000.25, 1700000001.5)
+
+
+def test_closed_connection_mid_message(pair):
+    sender, receiver = pair
+    sender.sendall(encode_message(MSG_DATA, b'{}')[:-1])
+    sender.close()
+    with pytest.raises(ConnectionError):
+        read_message(receiver)
+
+
+def test_frame_timing_prefix():
+    jpeg = b'\xff\xd8' + bytes(100) + b'\xff\xd9'
+    timing, payload = split_frame_timing(encode_frame_timing(123456789, 10.5, 10.75, math.nan) + jpeg)
+    assert payload == jpeg
+    assert timing['sensor_timestamp'] == 123456789
+    assert (timing['captured_at'], timing['sent_at']) == (10.5, 10.75)
+    assert math.isnan(timing['clock_offset'])
+
+    assert split_frame_timing(jpeg) == (None, jpeg)
+
+
+def test_still_offer_carries_the_timing():
+    message = encode_still_offer('cam', 'up-1', 1234, 10.5, {'clock_offset': 0.25})
+    msg_type, _, length = parse_header(message[:SENSOR_HEADER.size], STILL_MAGIC)
+    assert (msg_type, length) == (STILL_OFFER, len(message) - SENSOR_HEADER.size)
+    sender_id, upload_id, size, captured_at, offer = decode_still_offer(message[SENSOR_HEADER.size:])
+    assert (sender_id, upload_id, size, captured_at) == ('cam', 'up-1', 1234, 10.5)
+    assert offer['clock_offset'] == 0.25
@@ -0,0 +1,74 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from recorder import INDEX_ENTRY, SegmentReader, SegmentWriter, list_segments, read_index, segments_from  # noqa: E402
+
+
+NOON = 1700049600.0
+
+
+def jpeg(n, size=100):
+    return b'\xff\xd8' + bytes([n % 256]) * size + b'\xff\xd9'
+
+
+def record(root, frames, segment_duration=60):
+    writer = SegmentWriter(str(root), 'cam', segment_duration)
+    writer.write(frames)
+    writer.close()
+
+
+def test_frames_are_split_into_segments(tmp_path):
+    record(tmp_path, [(NOON + n * 10, jpeg(n)) for n in range(15)])
+
+    segments = list_segments(str(tmp_path), 'cam')
+    assert [segment['start'] for segment in segments] == [NOON, NOON + 60, NOON + 120]
+    assert list_segments(str(tmp_path), 'nobody') == []
+
+    timestamps, offsets = read_index(os.path.join(str(tmp_path), segments[1]['segment']))
+    assert timestamps == [NOON + 60 + n * 10 for n in range(6)]
+    assert offsets[0] == 0 and offsets == sorted(offsets)
+
+
+def test_reader_seeks_to_the_frame_at_or_before_a_moment(tmp_path):
+    frames = [(NOON + n, jpeg(n)) for n in range(10)]
+    record(tmp_path, frames)
+
+    [path] = segments_from(str(tmp_path), 'cam', NOON + 5)
+    with SegmentReader(path) as reader:
+        assert len(reader) == 10
+        assert reader.frame(reader.position_at(NOON + 4.5)) == frames[4]
+        assert reader.frame(reader.position_at(NOON + 4)) == frames[4]
+        assert reader.position_at(NOON - 100) == 0
+        assert reader.frame(reader.position_at(NOON + 100)) == frames[-1]
+
+
+def test_segments_from_starts_at_the_covering_segment(tmp_path):
+    record(tmp_path, [(NOON + n * 30, jpeg(n)) for n in range(6)])
+    paths = [os.path.join(str(tmp_path), segment['segment']) for segment in list_segments(str(tmp_path), 'cam')]
+
+    assert segments_from(str(tmp_path), 'cam', NOON - 1) == []
+    assert segments_from(str(tmp_path), 'cam', NOON + 90) == paths[1:]
+    assert segments_from(str(tmp_path), 'cam', NOON + 1000) == paths[-1:]
+
+
+def test_a_partly_written_index_entry_is_ignored(tmp_path):
+    frames = [(NOON + n, jpeg(n)) for n in range(3)]
+    record(tmp_path, frames)
+    [path] = segments_from(str(tmp_path), 'cam', NOON)
+    with open(path[:-len('.mjpeg')] + '.idx', 'ab') as file:
+        file.write(INDEX_ENTRY.pack(NOON + 3, 10 ** 9)[:5])
+
+    with SegmentReader(path) as reader:
+        assert len(reader) == 3
+        assert reader.frame(2) == frames[2]
+
+
+def test_a_restarted_writer_appends_to_the_segment(tmp_path):
+    record(tmp_path, [(NOON, jpeg(1))])
+    record(tmp_path, [(NOON, jpeg(2))])  # Same start second: same files
+
+    [path] = segments_from(str(tmp_path), 'cam', NOON)
+    with SegmentReader(path) as reader:
+        assert [reader.frame(position)[1] for position in range(len(reader))] == [jpeg(1), jpeg(2)]
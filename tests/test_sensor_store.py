@@ -0,0 +1,88 @@
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sensor_store import SensorStore  # noqa: E402
+
+
+NOON = 1700049600.0
+
+
+def reading(ts, **fields):
+    return {'datetime': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(ts)), **fields}
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_values_that_dont_fit_are_kept_out_of_the_samples(tmp_path):
+    store = SensorStore(str(tmp_path / 'sensors.db'), batch_interval=0.05)
+    store.add('a', reading(NOON, temperature=21.5, humidity=math.nan, pressure=math.inf, counter=2 ** 70,
+                           fan=True, uptime='1:00:00'))
+    store.add('b', reading(NOON, temperature=18.0))
+    store.close()
+
+    assert store.stats()['failed'] == 0
+    assert store.fields('a') == ['temperature']
+    assert store.query('a', 'temperature', NOON - 1, NOON + 1)[0]['mean'] == 21.5
+    assert store.query('b', 'temperature', NOON - 1, NOON + 1)[0]['mean'] == 18.0
+    assert store.latest('a')['counter'] == 2 ** 70  # The full reading still has it
+
+
+def test_writer_carries_on_after_a_failed_batch(tmp_path):
+    store = SensorStore(str(tmp_path / 'sensors.db'), batch_interval=0.05)
+    commit = store._commit
+
+    def fail_once(connection, batch):
+        store._commit = commit
+        raise RuntimeError("disk on fire")
+
+    store._commit = fail_once
+    store.add('a', reading(NOON, temperature=1.0))
+    wait_until(lambda: store.stats()['failed'] == 1)
+
+    store.add('a', reading(NOON + 60, temperature=2.0))
+    store.close()
+    assert store.stats()['committed'] == 1
+    assert [point['mean'] for point in store.query('a', 'temperature', NOON - 1, NOON + 120)] == [2.0]
+
+
+def test_query_downsamples_into_buckets(tmp_path):
+    store = SensorStore(str(tmp_path / 'sensors.db'), batch_interval=0.05)
+    for minute in range(60):
+        store.add('a', reading(NOON + minute * 60, temperature=float(minute)))
+    store.add('b', reading(NOON, temperature=99.0))
+    store.close()
+
+    points = store.query('a', 'temperature', NOON, NOON + 3600, max_points=6)
+    assert [point['ts'] for point in points] == [NOON + n * 600 for n in range(6)]
+    assert [point['count'] for point in points] == [10] * 6
+    assert points[0] == {'ts': NOON, 'min': 0.0, 'max': 9.0, 'mean': 4.5, 'count': 10}
+    assert points[-1]['max'] == 59.0
+
+
+def test_query_range_is_half_open_and_leaves_out_empty_buckets(tmp_path):
+    store = SensorStore(str(tmp_path / 'sensors.db'), batch_interval=0.05)
+    for minute in (0, 1, 30, 60):
+        store.add('a', reading(NOON + minute * 60, temperature=float(minute)))
+    store.close()
+
+    points = store.query('a', 'temperature', NOON, NOON + 3600, max_points=60)
+    assert [(point['ts'], point['mean']) for point in points] == [(NOON, 0.0), (NOON + 60, 1.0),
+                                                                  (NOON + 1800, 30.0)]
+    assert store.query('a', 'humidity', NOON, NOON + 3600) == []
+
+
+def test_readings_without_a_valid_datetime_use_the_arrival_time(tmp_path):
+    store = SensorStore(str(tmp_path / 'sensors.db'), batch_interval=0.05)
+    store.add('a', {'datetime': 'yesterday', 'temperature': 1.0}, received_at=NOON)
+    store.add('a', {'temperature': 2.0}, received_at=NOON + 60)
+    store.close()
+    assert [point['mean'] for point in store.query('a', 'temperature', NOON, NOON + 120, 2)] == [1.0, 2.0]
@@ -0,0 +1,58 @@
+import os
+import socket
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from protocol import (OFFSET_BODY, STILL_CHUNK, STILL_MAGIC, STILL_OFFER, decode_still_offer,  # noqa: E402
+                      encode_still_offset, read_message)
+from spool import StillSpool, send_spooled_still  # noqa: E402
+
+
+JPEG = b'\xff\xd8' + bytes(range(256)) * 40 + b'\xff\xd9'
+
+
+def serve_one_upload(server, received):
+    """Accepts one connection and answers a still upload like the receiver, keeping the bytes in received."""
+    connection, _ = server.accept()
+    with connection:
+        msg_type, _, body = read_message(connection, STILL_MAGIC)
+        assert msg_type == STILL_OFFER
+        _, upload_id, size, _, _ = decode_still_offer(body)
+        data = bytearray()
+        connection.sendall(encode_still_offset(0))
+        while len(data) < size:
+            msg_type, _, body = read_message(connection, STILL_MAGIC)
+            assert msg_type == STILL_CHUNK
+            data += body[OFFSET_BODY.size:]
+            connection.sendall(encode_still_offset(len(data)))
+        received[upload_id] = bytes(data)
+
+
+def unresolvable():
+    raise socket.gaierror(socket.EAI_AGAIN, "Temporary failure in name resolution")
+
+
+def test_failed_name_lookup_leaves_the_still_to_the_drain(tmp_path):
+    spool = StillSpool(str(tmp_path), max_bytes=10 ** 8, max_age=3600)
+    still = spool.add(JPEG, 1700000000.0, claim=True)
+
+    with pytest.raises(socket.gaierror):
+        send_spooled_still(spool, still, unresolvable, 1, 'cam', 1024)
+
+    # Still spooled and no longer claimed, so the backlog drain picks it up
+    drained = spool.claim_oldest()
+    assert drained is not None and drained.upload_id == still.upload_id
+
+    with socket.create_server(('127.0.0.1', 0)) as server:
+        received = {}
+        thread = threading.Thread(target=serve_one_upload, args=(server, received))
+        thread.start()
+        send_spooled_still(spool, drained, lambda: '127.0.0.1', server.getsockname()[1], 'cam', 1024)
+        thread.join(timeout=5)
+
+    assert received == {still.upload_id: JPEG}
+    assert spool.pending() == []
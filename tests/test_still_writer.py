@@ -0,0 +1,117 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from activity_index import ActivityIndex  # noqa: E402
+from spool import StillSpool, send_spooled_still  # noqa: E402
+
+
+NOON = 1700049600.0
+
+
+def jpeg(level):
+    """A small JPEG of uniform brightness, distinct per level."""
+    image = np.full((48, 64, 3), level, np.uint8)
+    image[:8, :8] = 255 - level  # Something that moves the difference score
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+@pytest.fixture
+def stills_dir(receiver, tmp_path, monkeypatch):
+    images_dir = str(tmp_path / 'high_res_images')
+    monkeypatch.setattr(receiver, 'HIGH_RES_IMAGES_DIR', images_dir)
+    monkeypatch.setattr(receiver, 'latest_images', receiver.LatestImageIndex(images_dir))
+    monkeypatch.setattr(receiver, 'activity_index', ActivityIndex(str(tmp_path / 'activity')))
+    return images_dir
+
+
+@pytest.fixture
+def still_port(receiver, stills_dir, tmp_path, monkeypatch):
+    """Port of the receiver's still upload handler, served on an event loop of its own."""
+    monkeypatch.setattr(receiver, 'PARTIAL_UPLOADS_DIR', str(tmp_path / 'partial_uploads'))
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(asyncio.start_server(receiver.handle_high_res_picture, '127.0.0.1', 0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield server.sockets[0].getsockname()[1]
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout=5)
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+    loop.close()
+
+
+def stored_stills(images_dir, sender_id):
+    stills = {}
+    for root, _, files in os.walk(os.path.join(images_dir, sender_id)):
+        for name in files:
+            with open(os.path.join(root, name), 'rb') as file:
+                stills[os.path.relpath(os.path.join(root, name), images_dir)] = file.read()
+    return stills
+
+
+def test_stills_of_the_same_second_are_all_kept(receiver, stills_dir):
+    writer = receiver.ImageWriterPool(1, 8, skip_duplicates=False)
+    images = [jpeg(level) for level in range(10, 60, 10)]
+    for index, image in enumerate(images):
+        writer._write('cam', image, NOON + index * 0.2)
+
+    stills = stored_stills(stills_dir, 'cam')
+    assert sorted(stills.values()) == sorted(images)
+    assert writer.stats()['written'] == 5
+
+
+def test_same_millisecond_gets_a_new_name(receiver, stills_dir):
+    writer = receiver.ImageWriterPool(1, 8, skip_duplicates=False)
+    writer._write('cam', jpeg(10), NOON)
+    writer._write('cam', jpeg(20), NOON)
+
+    stills = stored_stills(stills_dir, 'cam')
+    assert sorted(stills.values()) == sorted([jpeg(10), jpeg(20)])
+    assert len(receiver.latest_images.recent('cam')) == 2
+
+
+def test_latest_image_index_ignores_repeated_paths(receiver):
+    index = receiver.LatestImageIndex('unused', max_per_sender=3)
+    for path in ['a/1.jpg', 'a/2.jpg', 'a/2.jpg', 'a/1.jpg']:
+        index.add('cam', path)
+    assert index.recent('cam') == ['a/2.jpg', 'a/1.jpg']
+
+
+def test_activity_urls_point_at_the_stored_still(receiver, stills_dir):
+    writer = receiver.ImageWriterPool(1, 8, skip_duplicates=False)
+    images = [jpeg(level) for level in (10, 200, 10, 200)]
+    for index, image in enumerate(images):
+        writer._write('cam', image, NOON + index * 0.25)
+
+    client = receiver.app.test_client()
+    response = client.get(f'/activity?sender=cam&start={NOON - 1}&end={NOON + 1}&k=10')
+    stills = json.loads(response.data)['stills']
+    assert len(stills) == 3  # The first still has nothing to compare with
+
+    prefix = receiver.app.static_url_path + '/high_res_images/'
+    for still in stills:
+        relative_path = still['url'][len(prefix):]
+        with open(os.path.join(stills_dir, relative_path), 'rb') as file:
+            assert file.read() == images[round((still['ts'] - NOON) / 0.25)]
+
+
+def test_burst_stills_sent_from_the_spool_are_all_stored(receiver, stills_dir, still_port, tmp_path):
+    spool = StillSpool(str(tmp_path / 'spool'), max_bytes=10 ** 8, max_age=3600)
+    images = [jpeg(level) for level in range(10, 60, 10)]
+    for index, image in enumerate(images):
+        # A burst: consecutive frames, all within one second
+        still = spool.add(image, NOON + index * 0.1, claim=True, sensor_timestamp=index)
+        send_spooled_still(spool, still, lambda: '127.0.0.1', still_port, 'burst-cam', 1024)
+    receiver.image_writer.jobs.join()
+
+    assert spool.pending() == []
+    assert sorted(stored_stills(stills_dir, 'burst-cam').values()) == sorted(images)
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from video_encoding import fit_roi  # noqa: E402
+
+
+FULL = (4056, 3040)
+
+
+def test_region_grows_around_its_centre_to_the_stream_aspect():
+    x, y, width, height = fit_roi((0.4, 0.4, 0.1, 0.2), FULL, 4 / 3)
+    assert abs(width / height - 4 / 3) < 0.01
+    assert height == 608  # The taller side is kept
+    # Rounding down to even coordinates moves the centre by a few pixels at most
+    assert abs((x + width / 2) - 0.45 * FULL[0]) <= 3
+    assert abs((y + height / 2) - 0.5 * FULL[1]) <= 3
+
+
+def test_wide_region_grows_in_height():
+    x, y, width, height = fit_roi((0.25, 0.5, 0.5, 0.05), FULL, 4 / 3)
+    assert width == 2028
+    assert height == 1520
+
+
+@pytest.mark.parametrize('fractions', [
+    (0, 0, 0.05, 0.05),
+    (0.95, 0.95, 0.05, 0.05),
+    (0, 0.45, 1, 0.1),  # Full width: can't grow wider, so it grows taller inside the frame
+    (0, 0, 1, 1),
+    (0.5, 0.5, 0, 0),
+])
+def test_region_stays_inside_the_frame_with_even_coordinates(fractions):
+    for aspect in (4 / 3, 16 / 9, 1):
+        x, y, width, height = fit_roi(fractions, FULL, aspect)
+        assert x >= 0 and y >= 0 and width > 0 and height > 0
+        assert x + width <= FULL[0] and y + height <= FULL[1]
+        assert all(value % 2 == 0 for value in (x, y, width, height))
+        assert abs(width - height * aspect) <= 2 * aspect + 2  # Up to the even rounding of both sides
+
+
+def test_whole_frame_of_another_aspect_is_cropped_in_the_middle():
+    x, y, width, height = fit_roi((0, 0, 1, 1), (1920, 1080), 4 / 3)
+    assert (width, height) == (1440, 1080)
+    assert (x, y) == (240, 0)
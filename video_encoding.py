@@ -0,0 +1,110 @@
+"""
+JPEG encoding of the lores YUV420 stream for the live view.
+
+The lores stream is planar I420: a full-size Y plane followed by quarter-size U and V planes. When simplejpeg is
+available (it is installed with picamera2), the planes are handed to libjpeg-turbo as they are, already subsampled
+the way JPEG stores them, which skips the full-frame YUV -> RGB -> YCbCr round trip of the OpenCV path. Otherwise
+the frame is converted to BGR into a reused buffer and encoded with OpenCV.
+
+With an RGB main stream, as configured by the sender, Picamera2 puts the camera in the full-range sYCC colour space,
+which is the YCbCr flavour JPEG itself uses, so the planes can be stored without any conversion.
+
+In region-of-interest mode the live view is instead a crop of the full-resolution main stream (BGR), scaled down to
+the lores size, so a small part of the scene streams with the detail of the full sensor at the same frame size.
+
+An encoder is not thread-safe; every thread that encodes frames needs its own. OpenCV is only imported once the
+OpenCV path is actually used, so it stays out of the sender's startup when simplejpeg is available.
+"""
+
+import numpy as np
+
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+
+DEFAULT_QUALITY = 95  # OpenCV's default, so both paths produce comparable images
+
+
+def split_i420(yuv420):
+    """Returns (Y, U, V) views of a (height * 3 / 2, width) I420 array, without copying."""
+    height, width = yuv420.shape[0] * 2 // 3, yuv420.shape[1]
+    chroma_size = (height // 2) * (width // 2)
+    chroma = yuv420[height:].reshape(-1)
+    u = chroma[:chroma_size].reshape(height // 2, width // 2)
+    v = chroma[chroma_size:2 * chroma_size].reshape(height // 2, width // 2)
+    return yuv420[:height], u, v
+
+
+def fit_roi(fractions, full_size, aspect):
+    """
+    Pixel rectangle (x, y, width, height) of a region of interest given as (x, y, width, height) fractions of a
+    full_size frame. The region is grown around its centre to the aspect ratio (width / height) of the stream it
+    is scaled to, so the picture isn't distorted, and kept inside the frame. Coordinates are even, as YUV420 needs.
+    """
+    fx, fy, fw, fh = fractions
+    full_w, full_h = full_size
+    width, height = max(fw * full_w, 2), max(fh * full_h, 2)
+    if width / height < aspect:
+        width = height * aspect
+    else:
+        height = width / aspect
+    if width > full_w:
+        width, height = full_w, full_w / aspect
+    if height > full_h:
+        width, height = full_h * aspect, full_h
+
+    centre_x, centre_y = (fx + fw / 2) * full_w, (fy + fh / 2) * full_h
+    x = min(max(centre_x - width / 2, 0), full_w - width)
+    y = min(max(centre_y - height / 2, 0), full_h - height)
+    return int(x) & ~1, int(y) & ~1, int(width) & ~1, int(height) & ~1
+
+
+class LoresJpegEncoder:
+    def __init__(self, quality=DEFAULT_QUALITY, use_yuv_planes=True):
+        self.quality = quality
+        self.use_yuv_planes = use_yuv_planes and simplejpeg is not None
+        self.bgr = None
+        self.scaled = None
+
+    def encode(self, yuv420):
+        """
+        Encodes a (height * 3 / 2, width) I420 array as JPEG and returns a bytes-like object (bytes or a 1-D numpy
+        array) that can be sent as is. yuv420 can be a view into a camera buffer: it is only read during the call.
+        """
+        if self.use_yuv_planes:
+            try:
+                y, u, v = split_i420(yuv420)
+                return simplejpeg.encode_jpeg_yuv_planes(y, u, v, quality=self.quality)
+            except (ValueError, TypeError) as e:
+                # Unexpected layout (odd sizes, padded stride): stay on the OpenCV path from now on
+                print(f"YUV plane JPEG encoding unavailable, falling back to OpenCV: {e}")
+                self.use_yuv_planes = False
+        return self._encode_bgr(yuv420)
+
+    def encode_scaled(self, bgr, size):
+        """
+        Scales a BGR array (e.g. a crop of a mapped camera buffer, only read during the call) to size and encodes
+        it as JPEG.
+        """
+        import cv2
+
+        if self.scaled is None or self.scaled.shape[:2] != (size[1], size[0]):
+            self.scaled = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        cv2.resize(bgr, size, dst=self.scaled, interpolation=cv2.INTER_AREA)
+        if simplejpeg is not None:
+            return simplejpeg.encode_jpeg(self.scaled, quality=self.quality, colorspace='BGR')
+        _, buffer = cv2.imencode('.jpg', self.scaled, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        return buffer
+
+    def _encode_bgr(self, yuv420):
+        import cv2
+
+        height, width = yuv420.shape[0] * 2 // 3, yuv420.shape[1]
+        if self.bgr is None or self.bgr.shape[:2] != (height, width):
+            self.bgr = np.empty((height, width, 3), dtype=np.uint8)
+
+        cv2.cvtColor(yuv420, cv2.COLOR_YUV2BGR_I420, dst=self.bgr)
+        _, buffer = cv2.imencode('.jpg', self.bgr, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        return buffer